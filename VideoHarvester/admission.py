@@ -0,0 +1,140 @@
+import os
+import time
+import random
+import shutil
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+
+import metrics
+import downloader
+from models import db, DownloadJob
+
+logger = logging.getLogger(__name__)
+
+# Longest Retry-After we hand out; beyond this the estimate is noise
+MAX_RETRY_AFTER = 300
+
+# Retry-After when pressure comes from CPU load or disk space rather than the queue
+LOAD_RETRY_AFTER = 15
+DISK_RETRY_AFTER = 60
+
+Decision = namedtuple('Decision', 'admitted reason retry_after')
+
+
+class AdmissionController:
+    """Decides whether a new download may join the queue.
+
+    Pressure is the worst of four ratios against their limits: queued jobs
+    across the cluster, p95 time-to-done of recently finished jobs, load
+    average per CPU, and the free space left in TEMP_DIR. Low-priority
+    requests are shed once pressure reaches 1.0; normal requests only past
+    ADMISSION_HARD_FACTOR, so the work we accept keeps its latency target.
+    Cluster-wide signals are read from the database at most once per
+    ADMISSION_CHECK_INTERVAL.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._signals = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_queue = app.config.get('ADMISSION_MAX_QUEUE', 50)
+        self.target_p95 = app.config.get('ADMISSION_TARGET_P95', 300.0)
+        self.max_load = app.config.get('ADMISSION_MAX_LOAD', 2.0)
+        self.min_free_bytes = app.config.get('ADMISSION_MIN_FREE_BYTES', 1024 * 1024 * 1024)
+        self.hard_factor = app.config.get('ADMISSION_HARD_FACTOR', 1.5)
+        self.window = app.config.get('ADMISSION_WINDOW', 300.0)
+        self.check_interval = app.config.get('ADMISSION_CHECK_INTERVAL', 1.0)
+
+    def signals(self):
+        """Current load signals, cached for ADMISSION_CHECK_INTERVAL seconds"""
+        now = time.monotonic()
+        with self._lock:
+            if self._signals is not None and now - self._checked_at < self.check_interval:
+                return self._signals
+
+        since = datetime.utcnow() - timedelta(seconds=self.window)
+        queue_depth = db.session.execute(
+            select(func.count()).select_from(DownloadJob).where(DownloadJob.status == 'queued')
+        ).scalar()
+        finished = db.session.execute(
+            select(DownloadJob.created_at, DownloadJob.finished_at)
+            .where(DownloadJob.status == 'done', DownloadJob.finished_at >= since)
+            .order_by(DownloadJob.finished_at.desc())
+            .limit(metrics.SAMPLE_WINDOW)
+        ).all()
+        latencies = [(done - created).total_seconds() for created, done in finished]
+
+        signals = {
+            'queue_depth': queue_depth,
+            'p95_seconds': metrics.percentile(latencies, 95) or 0.0,
+            # Jobs finished per second across the cluster, used to estimate when the queue drains
+            'throughput': len(latencies) / self.window,
+            'load': os.getloadavg()[0] / (os.cpu_count() or 1),
+            'free_bytes': shutil.disk_usage(downloader.TEMP_DIR).free,
+        }
+        for name, value in signals.items():
+            metrics.set_gauge(f"admission.{name}", value)
+
+        with self._lock:
+            self._signals = signals
+            self._checked_at = time.monotonic()
+        return signals
+
+    def check(self, priority='normal'):
+        """Admit or shed a new download of the given priority ('normal' or 'low')"""
+        try:
+            signals = self.signals()
+        except Exception as e:
+            # Never turn users away because the load signals themselves are unavailable
+            logger.error("Error reading admission signals: %s: %s", type(e).__name__, e)
+            return Decision(True, None, 0)
+
+        pressures = {
+            'queue': signals['queue_depth'] / self.max_queue,
+            'latency': signals['p95_seconds'] / self.target_p95,
+            'load': signals['load'] / self.max_load,
+            # Below the free-space floor nothing fits, whatever its priority
+            'disk': self.hard_factor if signals['free_bytes'] < self.min_free_bytes else 0.0,
+        }
+        reason = max(pressures, key=pressures.get)
+        pressure = pressures[reason]
+        metrics.set_gauge('admission.pressure', round(pressure, 3))
+
+        limit = 1.0 if priority == 'low' else self.hard_factor
+        if pressure < limit:
+            metrics.inc('admission.accepted', priority=priority)
+            return Decision(True, None, 0)
+
+        retry_after = self._retry_after(reason, signals)
+        metrics.inc('admission.rejected', priority=priority, reason=reason)
+        logger.warning("Shedding %s download: %s pressure %.2f, retry after %ss",
+                       priority, reason, pressure, retry_after)
+        return Decision(False, reason, retry_after)
+
+    def _retry_after(self, reason, signals):
+        """Estimate when the driving signal will be back under its limit"""
+        if reason == 'queue':
+            # Time for the cluster to work the queue back down to its limit
+            excess = signals['queue_depth'] - self.max_queue + 1
+            estimate = excess / signals['throughput'] if signals['throughput'] else MAX_RETRY_AFTER
+        elif reason == 'latency':
+            estimate = signals['p95_seconds'] - self.target_p95
+        elif reason == 'load':
+            estimate = LOAD_RETRY_AFTER
+        else:
+            estimate = DISK_RETRY_AFTER
+        # Spread retries out so shed clients do not come back all at once
+        estimate *= random.uniform(1.0, 1.2)
+        return int(min(MAX_RETRY_AFTER, max(1, estimate)))
+
+
+admission_controller = AdmissionController()
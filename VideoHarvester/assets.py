@@ -0,0 +1,111 @@
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+import tempfile
+from flask import request, send_file, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # Optional: only gzip variants are generated without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Fingerprinted URLs never change content, so let browsers keep them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Only text formats are worth compressing; images and fonts already are
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+def _fingerprint(filename, digest):
+    """css/style.css -> css/style.<digest>.css"""
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{digest}{ext}"
+
+
+def _compress(source_path, variant_dir, hashed):
+    """Write .gz (and .br when brotli is installed) variants next to each other"""
+    variants = {}
+    with open(source_path, 'rb') as source:
+        data = source.read()
+
+    encoders = [('gzip', '.gz', lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        encoders.insert(0, ('br', '.br', lambda raw: brotli.compress(raw, quality=11)))
+
+    for encoding, suffix, encode in encoders:
+        path = os.path.join(variant_dir, hashed.replace('/', os.sep) + suffix)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compressed = encode(data)
+            if len(compressed) >= len(data):
+                continue
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as variant:
+                variant.write(compressed)
+            os.replace(temp_path, path)
+        variants[encoding] = path
+    return variants
+
+
+def build_manifest(static_folder, variant_dir):
+    """Hash every static file and pre-generate its compressed variants"""
+    manifest = {}
+    files = {}
+    for dirpath, _, filenames in os.walk(static_folder):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as static_file:
+                digest = hashlib.sha256(static_file.read()).hexdigest()[:12]
+            hashed = _fingerprint(filename, digest)
+
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            variants = {}
+            if mimetype.startswith(COMPRESSIBLE_TYPES):
+                variants = _compress(path, variant_dir, hashed)
+
+            manifest[filename] = hashed
+            files[hashed] = (filename, mimetype, variants)
+    return manifest, files
+
+
+def init_app(app):
+    """Serve static files under content-hashed, long-cacheable URLs"""
+    variant_dir = app.config.get('ASSET_CACHE_DIR') or os.path.join(
+        tempfile.gettempdir(), 'videoharvester-assets')
+    manifest, files = build_manifest(app.static_folder, variant_dir)
+    logger.info("Fingerprinted %s static files", len(manifest))
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        """Rewrite url_for('static', filename=...) to the hashed name"""
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = manifest.get(values['filename'], values['filename'])
+
+    def static(filename):
+        """Serve a static file, preferring a precompressed variant"""
+        entry = files.get(filename)
+        if entry is None:
+            # Plain (unhashed) paths keep Flask's default behaviour
+            return send_from_directory(app.static_folder, filename)
+
+        original, mimetype, variants = entry
+        accepted = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in variants and accepted[encoding]:
+                response = send_file(variants[encoding], mimetype=mimetype, etag=filename + '.' + encoding)
+                response.headers['Content-Encoding'] = encoding
+                response.headers.pop('Content-Disposition', None)
+                break
+        else:
+            response = send_from_directory(app.static_folder, original, mimetype=mimetype)
+
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = static
@@ -0,0 +1,144 @@
+"""Simulated download queue: wait times of small clients while one heavy client floods it.
+
+The same arrivals and service times run through two orderings on a
+simulated clock:
+
+  fifo  jobs are claimed by age, as before fair queueing
+  fair  jobs carry FairPolicy.tag_for() tags and are claimed by tag,
+        skipping clients that FairPolicy.saturated_clients() reports at
+        their cap, as JobRunner.claim() does
+
+The queue is a DownloadJob table in an in-memory SQLite database, so the
+tags and caps come from the code the app runs. Waits are measured from
+enqueue to the start of the job.
+
+    python benchmarks/fair_queue_sim.py
+    python benchmarks/fair_queue_sim.py --workers 8 --cap 2 --heavy-jobs 1000
+"""
+import os
+import sys
+import heapq
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import or_, select
+
+from metrics import percentile
+from fair_queue import FairPolicy
+from models import db, DownloadJob
+
+EPOCH = datetime(2026, 1, 1)
+
+# Running jobs never lose their lease in the simulation
+LEASE_FOREVER = datetime(9999, 1, 1)
+
+
+def arrivals(args):
+    """(time, client) of every job: the heavy batch at t=0, small clients at random intervals"""
+    rng = random.Random(args.seed)
+    jobs = [(0.0, 'key:heavy')] * args.heavy_jobs
+    for index in range(args.small_clients):
+        at = rng.uniform(0, args.small_interval)
+        while at < args.duration:
+            jobs.append((at, f"session:small{index}"))
+            at += rng.expovariate(1 / args.small_interval)
+    return sorted(jobs, key=lambda job: job[0])
+
+
+def claim(policy, fair, now):
+    """Next job for a free worker, in the order JobRunner.claim() uses"""
+    query = select(DownloadJob).where(DownloadJob.status == 'queued')
+    if fair:
+        capped = policy.saturated_clients()
+        if capped:
+            query = query.where(or_(DownloadJob.client_id.is_(None), DownloadJob.client_id.notin_(capped)))
+    job = db.session.execute(query.order_by(DownloadJob.fair_tag, DownloadJob.created_at).limit(1)).scalar()
+    if job is not None:
+        job.status = 'running'
+        job.started_at = EPOCH + timedelta(seconds=now)
+        job.lease_expires_at = LEASE_FOREVER
+    return job
+
+
+def simulate(args, fair):
+    """Run the queue; returns {client: [wait seconds, ...]}"""
+    db.session.query(DownloadJob).delete()
+    db.session.commit()
+    policy = FairPolicy({'FAIR_MAX_PER_CLIENT': args.cap, 'FAIR_WEIGHTS': args.weights})
+    service = random.Random(args.seed + 1)
+    pending = arrivals(args)
+    # Event heap of (time, sequence, job id); job id None is an arrival
+    events = [(at, index, None) for index, (at, _) in enumerate(pending)]
+    heapq.heapify(events)
+    idle = args.workers
+    waits = {}
+
+    while events:
+        now, sequence, finished_id = heapq.heappop(events)
+        if finished_id is None:
+            client_id = pending[sequence][1]
+            db.session.add(DownloadJob(
+                id=f"{sequence:08d}", kind='video', url='https://example.com/v', format_id='22', status='queued',
+                client_id=client_id, created_at=EPOCH + timedelta(seconds=now),
+                fair_tag=policy.tag_for(client_id) if fair else 0.0))
+        else:
+            db.session.get(DownloadJob, finished_id).status = 'done'
+            idle += 1
+        db.session.flush()
+
+        while idle:
+            job = claim(policy, fair, now)
+            if job is None:
+                break
+            idle -= 1
+            waits.setdefault(job.client_id, []).append(now - (job.created_at - EPOCH).total_seconds())
+            heapq.heappush(events, (now + service.expovariate(1 / args.service_time), sequence, job.id))
+            db.session.flush()
+    db.session.commit()
+    return waits
+
+
+def summarize(waits):
+    small = [wait for client_id, values in waits.items() if client_id != 'key:heavy' for wait in values]
+    heavy = waits.get('key:heavy', [])
+    return {
+        'small p50': percentile(small, 50), 'small p99': percentile(small, 99), 'small max': max(small),
+        'heavy p50': percentile(heavy, 50), 'heavy p99': percentile(heavy, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, default=4, help='concurrent downloads (DOWNLOAD_WORKERS)')
+    parser.add_argument('--cap', type=int, default=4, help='running jobs per client (FAIR_MAX_PER_CLIENT)')
+    parser.add_argument('--weights', default=None, help='FAIR_WEIGHTS, e.g. "key:heavy=2"')
+    parser.add_argument('--heavy-jobs', type=int, default=400, help='jobs the heavy client queues at once')
+    parser.add_argument('--small-clients', type=int, default=5)
+    parser.add_argument('--small-interval', type=float, default=5.0, help='mean seconds between a small job')
+    parser.add_argument('--duration', type=float, default=60.0, help='seconds during which small clients queue')
+    parser.add_argument('--service-time', type=float, default=1.0, help='mean seconds per download')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        results = {mode: summarize(simulate(args, mode == 'fair')) for mode in ('fifo', 'fair')}
+
+    columns = list(results['fifo'])
+    print(f"{args.heavy_jobs} heavy jobs at t=0, {args.small_clients} small clients every "
+          f"~{args.small_interval:g}s for {args.duration:g}s, {args.workers} workers, "
+          f"~{args.service_time:g}s per job, cap {args.cap}")
+    print(f"{'':6}" + ''.join(f"{column:>12}" for column in columns))
+    for mode, summary in results.items():
+        print(f"{mode:6}" + ''.join(f"{summary[column]:>11.2f}s" for column in columns))
+
+
+if __name__ == '__main__':
+    main()
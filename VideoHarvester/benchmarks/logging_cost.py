@@ -0,0 +1,128 @@
+"""Per-request logging cost: synchronous handler logging against the JSON queue handler.
+
+Each request of a small Flask app logs what a failing /download did
+before and after the change: two debug lines and an error carrying about
+3 KB of yt-dlp output.
+
+  before  logging.basicConfig(level=DEBUG) with a synchronous stream handler
+          and eagerly formatted f-strings, as routes.py used to set up
+  after   logs.init_app(): lazy %-style arguments through LazyQueueHandler,
+          JSON rendered and written by the listener thread
+
+Each variant runs in its own process, writing its log to a temporary file.
+Reported per request: the CPU time the request thread spends in those
+logging calls (which is what the change moves off the request path), and
+the wall time of a whole test-client request, both the best of several
+batches.
+
+    python benchmarks/logging_cost.py
+    python benchmarks/logging_cost.py --requests 5000 --batches 9
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+VARIANTS = [
+    ('before', 'DEBUG', 1.0),
+    ('after', 'INFO', 0.01),
+    ('after', 'DEBUG', 0.01),
+    ('after', 'DEBUG', 1.0),
+]
+
+VIDEO_ID = 'dQw4w9WgXcQ'
+ERROR_TEXT = ('ERROR: [youtube] dQw4w9WgXcQ: ' +
+              'Sign in to confirm your age. This video may be inappropriate for some users. ' * 40)
+
+
+def measure(variant, level, sample_rate, requests, batches, log_path):
+    """Run one variant in this process; returns microseconds per request"""
+    from flask import Flask
+    app = Flask('logging_cost')
+    if variant == 'before':
+        logging.basicConfig(level=logging.DEBUG, stream=open(log_path, 'w'))
+    else:
+        import logs
+        sys.stderr = open(log_path, 'w')
+        app.config.update(LOG_LEVEL=level, LOG_DEBUG_SAMPLE_RATE=sample_rate)
+        logs.init_app(app)
+    logger = logging.getLogger('routes')
+
+    def log_request():
+        if variant == 'before':
+            logger.debug(f"Attempting to fetch video with ID: {VIDEO_ID}")
+            logger.debug(f"Attempting to download video from URL: https://youtu.be/{VIDEO_ID} with format ID: 22")
+            logger.error(f"Download error: {str(ERROR_TEXT)}")
+        else:
+            logger.debug("Attempting to fetch video with ID: %s", VIDEO_ID)
+            logger.debug("Attempting to download video from URL: %s with format ID: %s",
+                         f"https://youtu.be/{VIDEO_ID}", 22)
+            logger.error("Download error: %s", ERROR_TEXT)
+
+    @app.route('/download')
+    def download():
+        log_request()
+        return 'ok'
+
+    client = app.test_client()
+
+    def best(run, clock):
+        runs = []
+        for _ in range(batches):
+            started = clock()
+            run()
+            runs.append((clock() - started) / requests * 1e6)
+        return min(runs)
+
+    def whole_requests():
+        for _ in range(requests):
+            client.get('/download')
+
+    def logging_calls():
+        # Inside one request context, so sampling and request ids behave as they do per request
+        with app.test_request_context('/download'):
+            app.preprocess_request()
+            for _ in range(requests):
+                log_request()
+
+    whole_requests()  # Warm up
+    return {'logging_cpu_us': best(logging_calls, time.thread_time),
+            'request_wall_us': best(whole_requests, time.perf_counter)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=2000, help='requests per batch')
+    parser.add_argument('--batches', type=int, default=7)
+    parser.add_argument('--variant', nargs=3, metavar=('KIND', 'LEVEL', 'SAMPLE_RATE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        kind, level, sample_rate = args.variant
+        with tempfile.TemporaryDirectory() as directory:
+            result = measure(kind, level, float(sample_rate), args.requests, args.batches,
+                             os.path.join(directory, 'log'))
+        print(json.dumps(result))
+        return
+
+    print(f"{args.requests} requests x best of {args.batches} batches; "
+          f"2 debug lines + 1 error with {len(ERROR_TEXT)} chars of yt-dlp output per request")
+    print(f"{'':28}{'logging cpu/request':>22}{'request wall':>16}")
+    for kind, level, sample_rate in VARIANTS:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--requests', str(args.requests),
+             '--batches', str(args.batches), '--variant', kind, level, str(sample_rate)],
+            check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        label = f"{kind} {level}" + (f" sampled {sample_rate:g}" if kind == 'after' and level == 'DEBUG' else '')
+        print(f"{label:28}{result['logging_cpu_us']:>19.1f} us{result['request_wall_us']:>13.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Sectioned downloads against yt-dlp's single connection on a throttled origin.
+
+Serves a generated file from benchmarks/throttled_server.py, which sends
+at most --rate bytes per second per connection, and downloads its page
+through downloader.download_video twice per round: once as yt-dlp does
+on its own, once with a SectionPolicy so the file is fetched in parallel
+ranges. Every download is checked against the source file's SHA-256.
+--no-ranges runs the sectioned download against an origin that ignores
+Range headers, which should fall back to a single connection.
+
+    python benchmarks/sectioned_download.py
+    python benchmarks/sectioned_download.py --size 128 --rate 2 --sections 8
+"""
+import os
+import sys
+import time
+import hashlib
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.basicConfig(level=logging.WARNING)
+
+import downloader
+from sections import SectionPolicy
+from throttled_server import ThrottledMediaServer
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=64, help='file size in MB')
+    parser.add_argument('--rate', type=float, default=4, help='MB/s per connection')
+    parser.add_argument('--sections', type=int, default=8, help='PARALLEL_MAX_SECTIONS')
+    parser.add_argument('--rounds', type=int, default=2)
+    parser.add_argument('--no-ranges', action='store_true', help='origin ignores Range headers')
+    args = parser.parse_args()
+
+    policy = SectionPolicy({'PARALLEL_MAX_SECTIONS': args.sections, 'PARALLEL_SECTION_SECONDS': 4.0})
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'media.mp4')
+        with open(source, 'wb') as f:
+            for _ in range(args.size):
+                f.write(os.urandom(1024 * 1024))
+        expected = sha256(source)
+        downloader.TEMP_DIR = os.path.join(directory, 'downloads')
+        os.makedirs(downloader.TEMP_DIR)
+
+        server = ThrottledMediaServer(source, args.rate * 1e6, ranges=not args.no_ranges).start()
+        try:
+            runs = [('sectioned', policy)] if args.no_ranges else [('single connection', None), ('sectioned', policy)]
+            print(f"{args.size} MB at {args.rate:g} MB/s per connection"
+                  f"{', origin ignores Range' if args.no_ranges else ''}")
+            for round_ in range(args.rounds):
+                for label, sections in runs:
+                    started = time.perf_counter()
+                    result = downloader.download_video(server.page_url, 'best', work_id=f"bench-{round_}-{len(label)}",
+                                                       sections=sections)
+                    elapsed = time.perf_counter() - started
+                    intact = sha256(result['file_path']) == expected
+                    os.remove(result['file_path'])
+                    print(f"  {label:18s} {elapsed:6.1f}s  {result['file_size'] / elapsed / 1e6:6.1f} MB/s"
+                          f"  intact={intact}", flush=True)
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
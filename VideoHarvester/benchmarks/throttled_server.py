@@ -0,0 +1,149 @@
+"""Local stand-in for a media origin that throttles each connection.
+
+Serves one file at /media.mp4 with Range support, sending at most `rate`
+bytes per second per connection, as origins that throttle single
+connections do. /media.html is a page whose JSON-LD VideoObject points at
+the file, so yt-dlp's generic extractor finds it like a long lecture
+video. Two switches stand in for misbehaving origins: ranges=False
+answers every request with the whole file, and cut_after ends ranged
+responses that do not start at byte 0 after that many bytes.
+
+    python benchmarks/throttled_server.py FILE --port 8000 --rate 4e6
+"""
+import os
+import re
+import json
+import time
+import socket
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RANGE_PATTERN = re.compile(r'bytes=(\d+)-(\d*)')
+
+# Bytes written per send while throttling
+SEND_SIZE = 64 * 1024
+
+
+class ThrottledMediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, media_path, rate=None, port=0, ranges=True, duration=7200):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.media_path = media_path
+        self.rate = rate
+        self.ranges = ranges
+        self.duration = duration
+        self.cut_after = None
+        self.bytes_sent = 0
+        self.ranges_requested = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/media.mp4"
+
+    @property
+    def page_url(self):
+        return f"http://127.0.0.1:{self.server_port}/media.html"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='throttled-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, sent):
+        with self._lock:
+            self.bytes_sent += sent
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/media.html':
+            self._send_page()
+        elif path == '/media.mp4':
+            self._send_media()
+        else:
+            self.send_error(404)
+
+    def _send_page(self):
+        video = {'@context': 'https://schema.org', '@type': 'VideoObject', 'name': 'Lecture',
+                 'contentUrl': self.server.url, 'duration': f"PT{self.server.duration}S",
+                 'uploadDate': '2026-01-01', 'description': 'Throttled media'}
+        body = (f"<html><head><title>Lecture</title><script type=\"application/ld+json\">{json.dumps(video)}"
+                f"</script></head><body></body></html>").encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_media(self):
+        size = os.path.getsize(self.server.media_path)
+        match = RANGE_PATTERN.match(self.headers.get('Range') or '')
+        if match and self.server.ranges:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+            self.server.ranges_requested.append((start, end))
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        else:
+            start, end = 0, size - 1
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Accept-Ranges', 'bytes' if self.server.ranges else 'none')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+
+        limit = end - start + 1
+        if self.server.cut_after is not None and start > 0:
+            limit = min(limit, self.server.cut_after)
+        sent = 0
+        started = time.perf_counter()
+        with open(self.server.media_path, 'rb') as media:
+            media.seek(start)
+            try:
+                while sent < limit:
+                    chunk = media.read(min(SEND_SIZE, limit - sent))
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+                    if self.server.rate:
+                        ahead = sent / self.server.rate - (time.perf_counter() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                self.server.count(sent)
+        if sent < end - start + 1:
+            # Hang up mid-body, as a dropped connection would
+            self.close_connection = True
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('file', help='file to serve as /media.mp4')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--rate', type=float, default=4e6, help='bytes per second per connection')
+    parser.add_argument('--no-ranges', action='store_true', help='ignore Range headers')
+    args = parser.parse_args()
+    server = ThrottledMediaServer(args.file, args.rate, args.port, ranges=not args.no_ranges)
+    print(f"Serving {args.file} at {server.url} and {server.page_url}, {args.rate / 1e6:g} MB/s per connection")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+import os
+import zlib
+import struct
+import uuid
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import delete, or_, select, update
+import requests
+
+import metrics
+from jobs import job_runner, internal_token, PROXY_CHUNK_SIZE
+from models import db, DownloadJob, DownloadBundle
+
+logger = logging.getLogger(__name__)
+
+# Sizes and offsets from this value up are kept in ZIP64 extra fields
+ZIP64_LIMIT = 0xFFFFFFFF
+
+# Archives with this many entries or more need the ZIP64 end records
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+# Values written in the classic fields when the real one is in a ZIP64 field
+SIZE_MARKER = 0xFFFFFFFF
+COUNT_MARKER = 0xFFFF
+
+# General purpose flags: sizes and CRC follow the data, names are UTF-8
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+# Regular file, rw-r--r--
+EXTERNAL_ATTRIBUTES = 0o100644 << 16
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IBBBBHHHHIIIHHHHHII')
+END_RECORD = struct.Struct('<IHHHHIIH')
+ZIP64_END_RECORD = struct.Struct('<IQHHIIQQQQ')
+ZIP64_LOCATOR = struct.Struct('<IIQI')
+
+
+class BundleError(Exception):
+    """A member of a bundle cannot be read, or no longer matches the archive layout"""
+
+
+def _dos_datetime(moment):
+    moment = max(moment or datetime.utcnow(), datetime(1980, 1, 1))
+    return ((moment.hour << 11) | (moment.minute << 5) | (moment.second // 2),
+            ((moment.year - 1980) << 9) | (moment.month << 5) | moment.day)
+
+
+def _clip(data, offset, start, stop):
+    """The part of data (placed at offset in the archive) that falls in [start, stop)"""
+    return data[max(start - offset, 0):max(stop - offset, 0)]
+
+
+class Entry:
+    """One member of the archive and where its local header, data and descriptor sit"""
+    __slots__ = ('name', 'size', 'crc', 'time', 'date', 'flags', 'zip64', 'offset', 'data_offset', 'end', 'source')
+
+    def __init__(self, name, size, modified=None, crc=None, source=None):
+        self.name = name.encode('utf-8')
+        self.size = size
+        self.crc = crc
+        self.time, self.date = _dos_datetime(modified)
+        self.flags = FLAG_DATA_DESCRIPTOR | (0 if name.isascii() else FLAG_UTF8)
+        self.zip64 = size >= ZIP64_LIMIT
+        self.source = source
+
+    def local_header(self):
+        # As with any streamed ZIP, CRC and sizes are left to the data descriptor
+        if self.zip64:
+            extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+            size = SIZE_MARKER
+        else:
+            extra = b''
+            size = 0
+        return LOCAL_HEADER.pack(0x04034b50, 45 if self.zip64 else 20, self.flags, 0, self.time, self.date,
+                                 0, size, size, len(self.name), len(extra)) + self.name + extra
+
+    def descriptor(self):
+        if self.zip64:
+            return struct.pack('<IIQQ', 0x08074b50, self.crc, self.size, self.size)
+        return struct.pack('<IIII', 0x08074b50, self.crc, self.size, self.size)
+
+    def descriptor_length(self):
+        return 24 if self.zip64 else 16
+
+    def central_extra(self):
+        fields = [self.size, self.size] if self.zip64 else []
+        if self.offset >= ZIP64_LIMIT:
+            fields.append(self.offset)
+        return struct.pack(f'<HH{len(fields)}Q', 1, 8 * len(fields), *fields) if fields else b''
+
+    def central_header(self):
+        extra = self.central_extra()
+        version = 45 if extra else 20
+        size = SIZE_MARKER if self.zip64 else self.size
+        offset = SIZE_MARKER if self.offset >= ZIP64_LIMIT else self.offset
+        return CENTRAL_HEADER.pack(0x02014b50, version, 3, version, 0, self.flags, 0, self.time, self.date,
+                                   self.crc, size, size, len(self.name), len(extra), 0, 0, 0,
+                                   EXTERNAL_ATTRIBUTES, offset) + self.name + extra
+
+
+class ZipLayout:
+    """Byte layout of a stored (uncompressed) ZIP built from files of known size.
+
+    Every offset depends only on the member names and sizes, so the total
+    length is known before the first byte and any byte range can be
+    produced on its own. Members are written with data descriptors: the
+    CRC of each file is computed while its data streams out and only
+    appears after it, so a full download starts at once. A range that
+    ends in a descriptor or in the central directory needs the CRCs of
+    the members involved; unknown ones are computed by reading those
+    members, and reported through on_crc so that later ranges (resumed
+    downloads) can skip the reads.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        offset = 0
+        for entry in entries:
+            entry.offset = offset
+            entry.data_offset = offset + len(entry.local_header())
+            entry.end = entry.data_offset + entry.size + entry.descriptor_length()
+            offset = entry.end
+        self.directory_offset = offset
+        self.directory_length = sum(46 + len(entry.name) + len(entry.central_extra()) for entry in entries)
+        self.zip64 = (len(entries) >= ZIP64_COUNT_LIMIT or self.directory_offset >= ZIP64_LIMIT
+                      or self.directory_length >= ZIP64_LIMIT)
+        end_length = END_RECORD.size + (ZIP64_END_RECORD.size + ZIP64_LOCATOR.size if self.zip64 else 0)
+        self.size = self.directory_offset + self.directory_length + end_length
+
+    def etag(self):
+        digest = hashlib.sha256()
+        for entry in self.entries:
+            digest.update(b'%s\0%d\0%d\0%d\0' % (entry.name, entry.size, entry.time, entry.date))
+        return digest.hexdigest()[:32]
+
+    def directory(self):
+        """Central directory and end records; every CRC must be known"""
+        parts = [entry.central_header() for entry in self.entries]
+        count, length, offset = len(self.entries), self.directory_length, self.directory_offset
+        if self.zip64:
+            end64_offset = offset + length
+            parts.append(ZIP64_END_RECORD.pack(0x06064b50, 44, 45, 45, 0, 0, count, count, length, offset))
+            parts.append(ZIP64_LOCATOR.pack(0x07064b50, 0, end64_offset, 1))
+            count, length, offset = (COUNT_MARKER if count >= ZIP64_COUNT_LIMIT else count,
+                                     SIZE_MARKER if length >= ZIP64_LIMIT else length,
+                                     SIZE_MARKER if offset >= ZIP64_LIMIT else offset)
+        parts.append(END_RECORD.pack(0x06054b50, 0, 0, count, count, length, offset, 0))
+        return b''.join(parts)
+
+    def iter_range(self, read, start=0, stop=None, on_crc=None):
+        """Yield bytes [start, stop) of the archive; read(entry, begin, end) yields that slice of a member"""
+        stop = self.size if stop is None else stop
+        directory_in_range = stop > self.directory_offset
+        for entry in self.entries:
+            if entry.offset >= stop:
+                break
+            data_end = entry.data_offset + entry.size
+            need_crc = entry.crc is None and stop > data_end and (start < entry.end or directory_in_range)
+            if entry.end <= start and not need_crc:
+                continue
+
+            header = _clip(entry.local_header(), entry.offset, start, stop)
+            if header:
+                yield header
+
+            low, high = max(start, entry.data_offset), min(stop, data_end)
+            if need_crc:
+                # Read the whole member for its CRC, sending only the part in range
+                crc = 0
+                position = entry.data_offset
+                for chunk in read(entry, 0, entry.size):
+                    crc = zlib.crc32(chunk, crc)
+                    if position + len(chunk) > low and position < high:
+                        yield chunk[max(low - position, 0):high - position]
+                    position += len(chunk)
+                if position != data_end:
+                    raise BundleError(f"{entry.name.decode()} is {position - entry.data_offset} bytes, "
+                                      f"expected {entry.size}")
+                entry.crc = crc
+                if on_crc:
+                    on_crc(entry)
+            elif low < high:
+                position = low
+                for chunk in read(entry, low - entry.data_offset, high - entry.data_offset):
+                    position += len(chunk)
+                    yield chunk
+                if position != high:
+                    raise BundleError(f"{entry.name.decode()} ended early")
+
+            descriptor = _clip(entry.descriptor() if entry.crc is not None else b'', data_end, start, stop)
+            if descriptor:
+                yield descriptor
+
+        if directory_in_range:
+            yield _clip(self.directory(), self.directory_offset, start, stop)
+
+
+def _member_name(job, taken):
+    """File name of a job inside the archive, made unique within it"""
+    name = (job.filename or f"{job.id}.{'mp3' if job.kind == 'audio' else 'mp4'}").replace('/', '_').replace('\\', '_')
+    stem, ext = os.path.splitext(name)
+    candidate, counter = name, 1
+    while candidate.lower() in taken:
+        counter += 1
+        candidate = f"{stem} ({counter}){ext}"
+    taken.add(candidate.lower())
+    return candidate
+
+
+def layout_for(jobs):
+    """Archive layout for a list of finished jobs; raises BundleError if a file is gone"""
+    entries = []
+    taken = set()
+    for job in jobs:
+        if job.storage_key and job_runner.storage:
+            size = job.file_size
+        elif job_runner.is_local(job):
+            if not job.file_path or not os.path.exists(job.file_path):
+                raise BundleError(f"{job.filename or job.id} is no longer available")
+            size = os.path.getsize(job.file_path)
+        elif job.node_url:
+            size = job.file_size
+        else:
+            raise BundleError(f"{job.filename or job.id} is stored on another server")
+        if size is None:
+            raise BundleError(f"{job.filename or job.id} has no known size")
+        entries.append(Entry(_member_name(job, taken), size, job.finished_at, job.crc32, source=job))
+    return ZipLayout(entries)
+
+
+def read_member(entry, start, end):
+    """Yield bytes [start, end) of a member's file, from object storage, this node or its owner node"""
+    if start >= end:
+        return
+    job = entry.source
+    if job.storage_key and job_runner.storage:
+        yield from job_runner.storage.read_range(job.storage_key, start, end)
+    elif job_runner.is_local(job):
+        with open(job.file_path, 'rb') as member:
+            member.seek(start)
+            remaining = end - start
+            while remaining:
+                chunk = member.read(min(PROXY_CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+    else:
+        # keep=1: the owner must not delete the file after serving it, or resumes would fail
+        upstream = requests.get(f"{job.node_url.rstrip('/')}/internal/file/{job.id}", params={'keep': '1'},
+                                headers={'X-Internal-Token': internal_token(job.id),
+                                         'Range': f"bytes={start}-{end - 1}"},
+                                stream=True, timeout=(5, 60))
+        try:
+            if upstream.status_code != 206 and not (upstream.status_code == 200 and start == 0):
+                raise BundleError(f"Node {job.node} answered {upstream.status_code} for {job.filename}")
+            remaining = end - start
+            for chunk in upstream.iter_content(PROXY_CHUNK_SIZE):
+                chunk = chunk[:remaining]
+                remaining -= len(chunk)
+                yield chunk
+                if not remaining:
+                    break
+        finally:
+            upstream.close()
+
+
+def stream(layout, start, stop):
+    """Archive bytes [start, stop) for a response, saving the CRCs computed on the way"""
+    computed = {}
+    sent = 0
+    try:
+        for chunk in layout.iter_range(read_member, start, stop,
+                                       on_crc=lambda entry: computed.__setitem__(entry.source.id, entry.crc)):
+            sent += len(chunk)
+            yield chunk
+    except Exception as e:
+        metrics.inc('bundles.errors')
+        logger.error("Error streaming bundle at byte %s: %s: %s", start + sent, type(e).__name__, e)
+        raise
+    finally:
+        metrics.inc('bundles.bytes_sent', sent)
+        if computed:
+            _save_crcs(computed)
+
+
+def _save_crcs(computed):
+    try:
+        for job_id, crc in computed.items():
+            db.session.execute(update(DownloadJob).where(DownloadJob.id == job_id).values(crc32=crc))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Error saving bundle member checksums: %s: %s", type(e).__name__, e)
+
+
+def create(job_ids, ttl):
+    """Store a bundle of jobs and keep their local files at least until it expires"""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl)
+    bundle = DownloadBundle(id=str(uuid.uuid4()), job_ids=job_ids, created_at=now, expires_at=expires_at)
+    db.session.add(bundle)
+    db.session.execute(
+        update(DownloadJob)
+        .where(DownloadJob.id.in_(job_ids),
+               or_(DownloadJob.keep_until.is_(None), DownloadJob.keep_until < expires_at))
+        .values(keep_until=expires_at)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    metrics.inc('bundles.created')
+    return bundle
+
+
+def load(bundle_id):
+    """The bundle with this id, or None once it has expired"""
+    bundle = db.session.get(DownloadBundle, bundle_id)
+    if bundle is None or bundle.expires_at <= datetime.utcnow():
+        return None
+    return bundle
+
+
+def sweep(node_id):
+    """Drop expired bundles and remove the files this node kept only for them; returns the files removed"""
+    now = datetime.utcnow()
+    db.session.execute(delete(DownloadBundle).where(DownloadBundle.expires_at <= now))
+    jobs = db.session.execute(
+        select(DownloadJob).where(DownloadJob.node == node_id, DownloadJob.keep_until <= now)
+    ).scalars().all()
+    removed = 0
+    for job in jobs:
+        if job.file_path:
+            try:
+                os.remove(job.file_path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error("Error removing bundled file %s: %s", job.file_path, e)
+                continue
+            job.file_path = None
+        job.keep_until = None
+    db.session.commit()
+    if removed:
+        metrics.inc('bundles.files_expired', removed)
+    return removed
+
+
+def init_app(app):
+    """Sweep expired bundles every BUNDLE_SWEEP_INTERVAL seconds"""
+    interval = app.config.get('BUNDLE_SWEEP_INTERVAL', 300.0)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    sweep(job_runner.node_id)
+            except Exception as e:
+                logger.error("Bundle sweep error: %s: %s", type(e).__name__, e)
+
+    threading.Thread(target=run, name='bundle-sweep', daemon=True).start()
@@ -0,0 +1,74 @@
+from datetime import timedelta
+
+# Shorthands accepted in place of the five fields
+ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+
+# (minimum, maximum) of minute, hour, day of month, month and day of week (0 and 7 = Sunday)
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+# Give up looking for a matching time after this long (e.g. "0 0 31 2 *" never matches)
+MAX_LOOKAHEAD = timedelta(days=366 * 4)
+
+
+def _parse_field(field, minimum, maximum):
+    """Expand one cron field ('*', '*/15', '1-5', '0,30', ...) into a set of values"""
+    values = set()
+    for part in field.split(','):
+        spec, _, step = part.partition('/')
+        step = int(step) if step else 1
+        if spec == '*':
+            start, end = minimum, maximum
+        elif '-' in spec:
+            start, end = (int(value) for value in spec.split('-', 1))
+        else:
+            start = end = int(spec)
+            if step > 1:
+                end = maximum
+        if start < minimum or end > maximum or start > end or step < 1:
+            raise ValueError(f"Cron field '{field}' is out of range {minimum}-{maximum}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """A five-field cron expression (minute hour day-of-month month day-of-week)"""
+
+    def __init__(self, expression):
+        self.expression = expression.strip()
+        fields = ALIASES.get(self.expression, self.expression).split()
+        if len(fields) != 5:
+            raise ValueError('Cron expressions need five fields: minute hour day month weekday')
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            _parse_field(field, *limits) for field, limits in zip(fields, FIELD_RANGES))
+        self.weekdays = {weekday % 7 for weekday in self.weekdays}
+        # Like cron, a restricted day of month and day of week match if either does
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment):
+        """First matching minute strictly after the given datetime"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + MAX_LOOKAHEAD
+        while candidate <= limit:
+            if candidate.month not in self.months or not self._day_matches(candidate):
+                # Skip the rest of the day
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression '{self.expression}' never matches")
@@ -0,0 +1,418 @@
+import os
+import re
+import glob
+import time
+import uuid
+import shutil
+import logging
+import tempfile
+import yt_dlp
+import requests
+
+from tracing import current_trace
+from sections import SectionedDownload, SectionError, recorded_bytes
+from utils import sanitize_filename
+
+logger = logging.getLogger(__name__)
+
+# Directory for temporary storage of downloads
+TEMP_DIR = tempfile.gettempdir()
+
+
+# yt-dlp error messages that will not go away by retrying
+PERMANENT_ERROR_PATTERN = re.compile(
+    r'private video|video unavailable|is not available|unsupported url|has been removed|'
+    r'members[- ]only|sign in to confirm|copyright|account .* terminated|http error 40[14]|http error 410',
+    re.IGNORECASE
+)
+
+
+class DownloadFailed(Exception):
+    """A download that failed with a message that is safe to show to the user"""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class PhaseTimer:
+    """Splits one yt-dlp run into extract, transfer and postprocess spans of the current trace"""
+
+    def __init__(self):
+        self.started = time.time_ns()
+        self.transfer_start = None
+        self.transfer_end = None
+        self.postprocess_start = None
+        self.postprocess_end = None
+        self._recorded = set()
+
+    def install(self, ydl_opts):
+        ydl_opts['progress_hooks'] = ydl_opts.get('progress_hooks', []) + [self.progress_hook]
+        ydl_opts['postprocessor_hooks'] = [self.postprocessor_hook]
+
+    def progress_hook(self, progress):
+        now = time.time_ns()
+        if self.transfer_start is None:
+            self.transfer_start = now
+        if progress.get('status') == 'finished':
+            # Merged formats finish once per part; the transfer ends with the last one
+            self.transfer_end = now
+
+    def postprocessor_hook(self, progress):
+        now = time.time_ns()
+        if progress.get('status') == 'started' and self.postprocess_start is None:
+            self.postprocess_start = now
+        elif progress.get('status') == 'finished':
+            self.postprocess_end = now
+
+    def record(self):
+        """Add the phases that ran so far; called after the transfer and again after deferred postprocessing"""
+        trace = current_trace()
+        if trace is None:
+            return
+        now = time.time_ns()
+        if 'transfer' not in self._recorded:
+            self._recorded.add('transfer')
+            trace.add('extract', self.started, self.transfer_start or self.postprocess_start or now)
+            if self.transfer_start:
+                trace.add('transfer', self.transfer_start, self.transfer_end or self.postprocess_start or now)
+        if self.postprocess_start and 'postprocess' not in self._recorded:
+            self._recorded.add('postprocess')
+            trace.add('postprocess', self.postprocess_start, self.postprocess_end or now)
+
+
+class DeferringYoutubeDL(yt_dlp.YoutubeDL):
+    """YoutubeDL that stops once the media is transferred and keeps its postprocessing for later.
+
+    yt-dlp runs merging, fixups and audio extraction from post_process()
+    right after the download. Here that call only records its arguments;
+    run_deferred() runs it later, possibly on another thread, on the same
+    info dict, so a CPU-bound ffmpeg step need not hold a network worker.
+    """
+
+    def __init__(self, params=None, auto_init=True):
+        super().__init__(params, auto_init)
+        self.deferred = None
+
+    def post_process(self, filename, info, files_to_move=None):
+        info['filepath'] = filename
+        self.deferred = (filename, info, files_to_move)
+        return info
+
+    @property
+    def needs_postprocessing(self):
+        """Whether the deferred step runs ffmpeg (a merge, fixup or conversion) rather than just moving files"""
+        if self.deferred is None:
+            return False
+        return bool(self.deferred[1].get('__postprocessors') or self._pps['post_process'])
+
+    def run_deferred(self):
+        if self.deferred is None:
+            return None
+        filename, info, files_to_move = self.deferred
+        self.deferred = None
+        return super().post_process(filename, info, files_to_move)
+
+
+class PendingDownload:
+    """A transferred download waiting for its postprocessing; finish() returns the details of the file"""
+
+    def __init__(self, ydl, phases, complete):
+        self.ydl = ydl
+        self.phases = phases
+        self._complete = complete
+
+    @property
+    def needs_postprocessing(self):
+        return self.ydl is not None and self.ydl.needs_postprocessing
+
+    def finish(self):
+        if self.ydl is not None:
+            try:
+                self.ydl.run_deferred()
+            except (yt_dlp.utils.PostProcessingError, yt_dlp.utils.DownloadError) as e:
+                logger.error("Postprocessing error: %s", e)
+                raise DownloadFailed('The downloaded media could not be processed. Please try again.',
+                                     retryable=True) from e
+            finally:
+                self.phases.record()
+        return self._complete()
+
+
+def is_retryable(error):
+    """Tell transient yt-dlp failures (network, throttling, 5xx) from permanent ones"""
+    original = getattr(error, 'exc_info', None) and error.exc_info[1]
+    for candidate in (error, original):
+        if isinstance(candidate, (yt_dlp.utils.UnavailableVideoError, yt_dlp.utils.GeoRestrictedError)):
+            return False
+    return not PERMANENT_ERROR_PATTERN.search(str(error))
+
+
+def video_path(work_id):
+    """Output path of a video download; stable per job so retries resume its .part file"""
+    return os.path.join(TEMP_DIR, f"youtube_video_{work_id}.mp4")
+
+
+def audio_dir(work_id):
+    """Working directory of an audio download; stable per job so retries resume"""
+    return os.path.join(TEMP_DIR, work_id)
+
+
+def partial_files(work_id):
+    """Partial data (.part files, fragments, yt-dlp resume state) left by an earlier attempt"""
+    # Merged formats download to <name>.f<format>.<ext>.part and parallel sections to <name>.mp4.sections.part
+    base = os.path.splitext(video_path(work_id))[0]
+    patterns = [base + '.*.part*', base + '.*.ytdl',
+                os.path.join(audio_dir(work_id), '*.part*'), os.path.join(audio_dir(work_id), '*.ytdl')]
+    return sorted({path for pattern in patterns for path in glob.glob(pattern)})
+
+
+def partial_bytes(work_id):
+    total = 0
+    for path in partial_files(work_id):
+        try:
+            # Section part files are preallocated to the full size; count what was written
+            total += recorded_bytes(path) if path.endswith('.sections.part') else os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
+def discard_partial(work_id):
+    """Remove partial data of a job that will not be retried"""
+    if not work_id:
+        return
+    for path in partial_files(work_id):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    shutil.rmtree(audio_dir(work_id), ignore_errors=True)
+
+
+def full_size(info):
+    """Size in bytes of the whole selected format(s), as reported or estimated from bitrate and duration"""
+    total = 0
+    for fmt in info.get('requested_formats') or [info]:
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if not size and fmt.get('tbr') and info.get('duration'):
+            size = fmt['tbr'] * 1000 / 8 * info['duration']
+        if not size:
+            return None
+        total += size
+    return int(total)
+
+
+def _clip_options(ydl_opts, clip, precise_cuts):
+    """Fetch only the fragments or byte ranges that cover clip (start, end) in seconds.
+
+    yt-dlp hands sections to ffmpeg, which seeks in the remote stream and
+    stream-copies from the keyframe at or before the start. precise_cuts
+    forces keyframes at the cut points instead, which re-encodes the video.
+    """
+    ydl_opts['download_ranges'] = yt_dlp.utils.download_range_func(None, [clip])
+    ydl_opts['force_keyframes_at_cuts'] = precise_cuts
+
+
+def _clip_label(clip):
+    return f"{int(clip[0])}-{int(clip[1])}s"
+
+
+def download_video(video_url, format_id, progress_hook=None, work_id=None, sections=None, clip=None,
+                   precise_cuts=False):
+    """Download a video format (or only a clip of it) with yt-dlp and return details of the finished file"""
+    return fetch_video(video_url, format_id, progress_hook, work_id, sections, clip, precise_cuts).finish()
+
+
+def fetch_video(video_url, format_id, progress_hook=None, work_id=None, sections=None, clip=None,
+                precise_cuts=False):
+    """Transfer a video format (or a clip of it); merging and fixups wait for PendingDownload.finish()"""
+    # A unique name avoids collisions; reusing a job's work id resumes its partial file
+    timestamp = work_id or uuid.uuid4().hex[:8]
+    file_path = video_path(timestamp)
+
+    logger.debug("Attempting to download video from URL: %s with format ID: %s", video_url, format_id)
+
+    # Configure yt-dlp options for downloading
+    ydl_opts = {
+        'format': format_id,
+        'outtmpl': file_path,
+        'quiet': True,
+        'no_warnings': True,
+        'noplaylist': True,     # Single video, not a playlist
+        'noprogress': False,    # Show progress
+        'continuedl': True,     # Resume a .part file left by an earlier attempt
+    }
+    if progress_hook:
+        ydl_opts['progress_hooks'] = [progress_hook]
+    if clip:
+        _clip_options(ydl_opts, clip, precise_cuts)
+    phases = PhaseTimer()
+    phases.install(ydl_opts)
+
+    try:
+        with DeferringYoutubeDL(ydl_opts) as ydl:
+            logger.debug("Downloading video to: %s", file_path)
+            if sections and sections.enabled and not clip:
+                # Resolve the format first: long progressive files are fetched in parallel sections
+                info = ydl.extract_info(video_url, download=False)
+                sectioned = bool(info) and sections.eligible(info) and SectionedDownload(
+                    ydl, info, file_path, sections, ydl_opts['progress_hooks']).run()
+                if info and not sectioned:
+                    info = ydl.process_ie_result(info, download=True)
+            else:
+                # Extract and download in one pass, so the transfer starts right after extraction
+                info = ydl.extract_info(video_url, download=True)
+            if not info:
+                raise DownloadFailed('Could not retrieve video information for download')
+
+            # Get proper video title and create a better filename
+            title = info.get('title', 'Unknown Video')
+            resolution = f"{info['height']}p" if info.get('height') else "unknown"
+
+            # Create a better final filename
+            sanitized_title = sanitize_filename(title)
+            if clip:
+                final_filename = f"{sanitized_title}_{resolution}_{_clip_label(clip)}_{timestamp}.mp4"
+            else:
+                final_filename = f"{sanitized_title}_{resolution}_{timestamp}.mp4"
+            whole_size = full_size(info) if clip else None
+    except yt_dlp.utils.DownloadError as e:
+        logger.error("Download error: %s", e)
+        raise DownloadFailed('This video could not be downloaded. It may be unavailable or restricted.',
+                             retryable=is_retryable(e)) from e
+    except yt_dlp.utils.ExtractorError as e:
+        logger.error("Extractor error: %s", e)
+        raise DownloadFailed('Could not extract video information for download.',
+                             retryable=is_retryable(e)) from e
+    except requests.RequestException as e:
+        logger.error("Request error: %s", e)
+        raise DownloadFailed('Network error when connecting to YouTube. Please check your connection and try again.',
+                             retryable=True) from e
+    except SectionError as e:
+        logger.error("Sectioned download error: %s", e)
+        raise DownloadFailed('The download was interrupted. Please try again.', retryable=True) from e
+    finally:
+        phases.record()
+
+    def complete():
+        # Verify the file was downloaded successfully
+        if not os.path.exists(file_path):
+            raise DownloadFailed('Download failed. The file was not created.', retryable=True)
+
+        # Verify file size
+        file_size = os.path.getsize(file_path)
+        if file_size == 0:
+            os.remove(file_path)  # Clean up empty file
+            raise DownloadFailed('Download failed. The file is empty.', retryable=True)
+
+        logger.debug("Download successful. File size: %d bytes", file_size)
+        return {
+            'file_path': file_path,
+            'filename': final_filename,
+            'title': title,
+            'resolution': resolution,
+            'file_size': file_size,
+            'full_size': whole_size
+        }
+
+    return PendingDownload(ydl, phases, complete)
+
+
+def download_audio(video_url, format_id, fallback_title='Unknown Title', work_id=None, clip=None):
+    """Download an audio format (or only a clip of it), convert it to mp3 and return details of the finished file"""
+    return fetch_audio(video_url, format_id, fallback_title, work_id, clip).finish()
+
+
+def fetch_audio(video_url, format_id, fallback_title='Unknown Title', work_id=None, clip=None):
+    """Transfer an audio format (or a clip of it); the mp3 conversion waits for PendingDownload.finish()"""
+    # A unique directory avoids collisions; reusing a job's work id resumes its partial file
+    timestamp = work_id or uuid.uuid4().hex[:8]
+    temp_dir = audio_dir(timestamp)
+    os.makedirs(temp_dir, exist_ok=True)
+
+    # Configure yt-dlp options for downloading audio
+    ydl_opts = {
+        'format': format_id,
+        'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
+        'quiet': True,
+        'no_warnings': True,
+        'noplaylist': True,
+        'noprogress': False,
+        'continuedl': True,
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192',
+        }]
+    }
+    if clip:
+        # Audio frames all start cleanly, so stream copy cuts are already exact
+        _clip_options(ydl_opts, clip, False)
+    phases = PhaseTimer()
+    phases.install(ydl_opts)
+
+    try:
+        with DeferringYoutubeDL(ydl_opts) as ydl:
+            # Extract and download in one pass, so the transfer starts right after extraction
+            logger.debug("Downloading audio from: %s", video_url)
+            info = ydl.extract_info(video_url, download=True)
+            if not info:
+                raise DownloadFailed('Could not retrieve audio information for download')
+
+            # Get proper title
+            title = info.get('title', fallback_title)
+            whole_size = full_size(info) if clip else None
+    except yt_dlp.utils.DownloadError as e:
+        logger.error("Download error: %s", e)
+        raise DownloadFailed('This audio could not be downloaded. It may be unavailable or restricted.',
+                             retryable=is_retryable(e)) from e
+    finally:
+        phases.record()
+
+    def complete():
+        # Find the downloaded file, ignoring resume state of earlier attempts
+        downloaded_files = [name for name in os.listdir(temp_dir)
+                            if '.part' not in name and not name.endswith('.ytdl')]
+        if not downloaded_files:
+            raise DownloadFailed('Download failed. No file was created.', retryable=True)
+
+        # Get the file path and extension
+        downloaded_file = os.path.join(temp_dir, downloaded_files[0])
+        _, ext = os.path.splitext(downloaded_file)
+
+        # Create a better final filename
+        sanitized_title = sanitize_filename(title)
+        if clip:
+            final_filename = f"{sanitized_title}_audio_{_clip_label(clip)}_{timestamp}{ext}"
+        else:
+            final_filename = f"{sanitized_title}_audio_{timestamp}{ext}"
+        final_path = os.path.join(TEMP_DIR, final_filename)
+
+        # Move the file to the final location
+        os.rename(downloaded_file, final_path)
+
+        # Verify the file exists and has a size
+        if not os.path.exists(final_path):
+            raise DownloadFailed('Download failed. The file was not created.', retryable=True)
+
+        # Get file size
+        file_size = os.path.getsize(final_path)
+        if file_size == 0:
+            os.remove(final_path)  # Clean up empty file
+            raise DownloadFailed('Download failed. The file is empty.', retryable=True)
+
+        # Clean up temp directory
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+        logger.debug("Audio download successful. File size: %d bytes", file_size)
+        return {
+            'file_path': final_path,
+            'filename': final_filename,
+            'title': title,
+            'resolution': None,
+            'file_size': file_size,
+            'full_size': whole_size
+        }
+
+    return PendingDownload(ydl, phases, complete)
@@ -0,0 +1,82 @@
+import uuid
+import hashlib
+from datetime import datetime
+from flask import current_app, request, session
+from sqlalchemy import func, select
+
+from models import db, DownloadJob
+from utils import parse_overrides
+
+# Flask session key holding a browser's stable client id
+CLIENT_ID_KEY = '_client_id'
+
+
+def client_identity():
+    """Identify the client behind this request: API key, then browser session, then IP"""
+    api_key = request.headers.get('X-API-Key')
+    if api_key:
+        # Never store the key itself
+        return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+    # Clients that drop cookies would get a fresh id per request, so fall back to their IP
+    if request.cookies.get(current_app.config.get('SESSION_COOKIE_NAME', 'session')):
+        if CLIENT_ID_KEY not in session:
+            session[CLIENT_ID_KEY] = uuid.uuid4().hex[:16]
+        return 'session:' + session[CLIENT_ID_KEY]
+
+    return f"ip:{request.remote_addr}"
+
+
+def next_tag(virtual_time, client_last_tag, weight, cost=1.0):
+    """Virtual finish tag of a new job (start-time fair queueing).
+
+    A client's jobs are spaced cost/weight apart starting from the later of
+    the queue's virtual time and the client's own last tag, so a heavy
+    client's backlog stretches far ahead while a newcomer's job lands near
+    the front of the queue.
+    """
+    return max(virtual_time, client_last_tag or 0.0) + cost / weight
+
+
+class FairPolicy:
+    """Per-client weights and concurrency caps for the shared download queue"""
+
+    def __init__(self, config):
+        self.default_weight = config.get('FAIR_DEFAULT_WEIGHT', 1)
+        self.weights = parse_overrides(config.get('FAIR_WEIGHTS'))
+        self.default_cap = config.get('FAIR_MAX_PER_CLIENT', 4)
+        self.caps = parse_overrides(config.get('FAIR_CLIENT_CAPS'))
+
+    def weight(self, client_id):
+        return max(1, self.weights.get(client_id, self.default_weight))
+
+    def cap(self, client_id):
+        return self.caps.get(client_id, self.default_cap)
+
+    def tag_for(self, client_id):
+        """Tag of the next job of this client, from the queue state in the database"""
+        # Virtual time is the tag at the head of the queue (or of the work in progress);
+        # an idle queue starts every client from zero again
+        virtual_time = db.session.execute(
+            select(func.min(DownloadJob.fair_tag)).where(DownloadJob.status == 'queued')
+        ).scalar()
+        if virtual_time is None:
+            virtual_time = db.session.execute(
+                select(func.max(DownloadJob.fair_tag)).where(DownloadJob.status == 'running')
+            ).scalar() or 0.0
+        client_last_tag = db.session.execute(
+            select(func.max(DownloadJob.fair_tag))
+            .where(DownloadJob.client_id == client_id, DownloadJob.status.in_(('queued', 'running')))
+        ).scalar()
+        return next_tag(virtual_time, client_last_tag, self.weight(client_id))
+
+    def saturated_clients(self):
+        """Clients already running as many jobs as their cap allows"""
+        # Jobs of a dead node stay 'running' until its lease lapses and they are requeued; they run nowhere
+        rows = db.session.execute(
+            select(DownloadJob.client_id, func.count())
+            .where(DownloadJob.status == 'running', DownloadJob.lease_expires_at > datetime.utcnow(),
+                   DownloadJob.client_id.is_not(None))
+            .group_by(DownloadJob.client_id)
+        ).all()
+        return {client_id for client_id, running in rows if running >= self.cap(client_id)}
@@ -0,0 +1,220 @@
+import os
+import glob
+import json
+import time
+import uuid
+import atexit
+import logging
+import tempfile
+import threading
+from datetime import datetime
+from sqlalchemy import insert
+
+import metrics
+from replica import mark_write
+from membership import membership_index
+from response_cache import bump_versions
+from models import db, VideoDownload
+from utils import pid_alive
+
+logger = logging.getLogger(__name__)
+
+# Columns written for every history row; executemany needs identical keys per row
+HISTORY_FIELDS = ('video_id', 'title', 'url', 'source', 'resolution', 'file_size', 'format_type', 'download_date',
+                  'trace_id', 'validate_ms', 'queue_ms', 'extract_ms', 'transfer_ms', 'postprocess_ms', 'commit_ms',
+                  'clip_start', 'clip_end', 'full_file_size')
+
+
+class HistoryRecorder:
+    """Write-behind recorder for VideoDownload rows.
+
+    Rows are appended to a local spool file and buffered in memory, then
+    inserted with a single multi-row INSERT once the batch is full or the
+    flush interval has passed. Spool files left behind by a crashed worker
+    are replayed on the next start, so delivery is at-least-once.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._buffer = []
+        self._pending_files = []
+        self._spool = None
+        self._seq = 0
+        # A reused pid must not pick up a dead predecessor's spool as its own
+        self._name = f"history-{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        self._oldest = None
+        self._thread = None
+        self._closed = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Open the spool, replay orphaned spools and start the flush thread"""
+        self.app = app
+        self.batch_size = app.config.get('HISTORY_BATCH_SIZE', 50)
+        self.flush_interval = app.config.get('HISTORY_FLUSH_INTERVAL', 2.0)
+        self.fsync = app.config.get('HISTORY_SPOOL_FSYNC', True)
+        self.spool_dir = app.config.get('HISTORY_SPOOL_DIR') or os.path.join(
+            tempfile.gettempdir(), 'videoharvester-history')
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        self._recover()
+        self._open_spool()
+
+        self._thread = threading.Thread(target=self._run, name='history-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, **fields):
+        """Queue a history row; returns as soon as it is spooled locally"""
+        row = {name: fields.get(name) for name in HISTORY_FIELDS}
+        row['source'] = row['source'] or 'youtube'
+        row['format_type'] = row['format_type'] or 'video'
+        row['download_date'] = row['download_date'] or datetime.utcnow()
+
+        line = json.dumps(row, default=lambda value: value.isoformat()) + '\n'
+        with self._lock:
+            self._spool.write(line)
+            self._spool.flush()
+            if self.fsync:
+                os.fsync(self._spool.fileno())
+            self._buffer.append(row)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            pending = len(self._buffer)
+
+        # The row reaches the replica only after the flush, so read it from the primary
+        mark_write()
+        if row['clip_end'] is None:
+            # A clip does not make the whole media count as downloaded
+            membership_index.add(row['source'], row['video_id'], row['format_type'])
+
+        metrics.set_gauge('history.pending', pending)
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write all buffered rows to the database in one transaction"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return 0
+                rows, self._buffer = self._buffer, []
+                self._oldest = None
+                self._rotate_spool()
+                spooled = list(self._pending_files)
+
+            started = time.perf_counter()
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as conn:
+                        conn.execute(insert(VideoDownload.__table__), rows)
+                        bump_versions(conn, ('video_download',))
+            except Exception as e:
+                # Keep the rows (and their spool files) for the next attempt
+                with self._lock:
+                    self._buffer[:0] = rows
+                    self._oldest = self._oldest or time.monotonic()
+                metrics.inc('history.flush_errors')
+                logger.error("Error flushing download history: %s: %s", type(e).__name__, e)
+                return 0
+
+            elapsed = time.perf_counter() - started
+            metrics.observe('history.flush_seconds', elapsed)
+            metrics.observe('history.batch_size', len(rows))
+            metrics.inc('history.rows_written', len(rows))
+
+            with self._lock:
+                self._pending_files = [path for path in self._pending_files if path not in spooled]
+                metrics.set_gauge('history.pending', len(self._buffer))
+            for path in spooled:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.error("Error removing history spool %s: %s", path, e)
+
+            logger.debug("Flushed %s history rows in %.1f ms", len(rows), elapsed * 1000)
+            return len(rows)
+
+    def close(self):
+        """Stop the flush thread and write out whatever is still buffered"""
+        if self._closed or self.app is None:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+        with self._lock:
+            self._spool.close()
+            if not self._buffer and os.path.getsize(self._spool.name) == 0:
+                os.remove(self._spool.name)
+
+    def _run(self):
+        """Flush loop: wake on a full batch or once the oldest row is due"""
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            with self._lock:
+                due = self._buffer and (len(self._buffer) >= self.batch_size or
+                                        time.monotonic() - self._oldest >= self.flush_interval)
+            if due:
+                self.flush()
+
+    def _open_spool(self):
+        path = os.path.join(self.spool_dir, f"{self._name}.jsonl")
+        self._spool = open(path, 'a', encoding='utf-8')
+
+    def _rotate_spool(self):
+        """Move the active spool aside so it can be deleted once its rows commit"""
+        self._spool.close()
+        self._seq += 1
+        rotated = f"{self._spool.name}.{self._seq}.flushing"
+        os.replace(self._spool.name, rotated)
+        self._pending_files.append(rotated)
+        self._open_spool()
+
+    def _recover(self):
+        """Claim spool files of dead processes and buffer their rows"""
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, 'history-*'))):
+            try:
+                pid = int(os.path.basename(path).split('-')[1].split('.')[0])
+            except (IndexError, ValueError):
+                continue
+            if os.path.basename(path).startswith(self._name):
+                continue
+            # Same pid under another name: a dead process whose pid was reused by this one
+            if pid != os.getpid() and pid_alive(pid):
+                continue
+
+            # Renaming is atomic, so only one worker wins each orphaned file
+            self._seq += 1
+            claimed = os.path.join(self.spool_dir, f"{self._name}.jsonl.{self._seq}.flushing")
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+
+            recovered = 0
+            with open(claimed, encoding='utf-8') as spool:
+                for line in spool:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        continue  # Torn write from the crash
+                    # Spools written by older versions lack the newer columns
+                    row = {name: row.get(name) for name in HISTORY_FIELDS}
+                    if row['download_date']:
+                        row['download_date'] = datetime.fromisoformat(row['download_date'])
+                    self._buffer.append(row)
+                    recovered += 1
+            self._pending_files.append(claimed)
+            logger.info("Recovered %s history rows from %s", recovered, path)
+
+        if self._buffer:
+            self._oldest = time.monotonic()
+            metrics.inc('history.rows_recovered', len(self._buffer))
+
+
+history_recorder = HistoryRecorder()
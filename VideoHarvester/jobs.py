@@ -0,0 +1,640 @@
+import os
+import hmac
+import time
+import uuid
+import random
+import socket
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from flask import Response, current_app, redirect, stream_with_context
+from sqlalchemy import or_, select, update
+import requests
+
+import metrics
+import downloader
+from downloader import DownloadFailed
+from history import history_recorder
+from storage import create_storage
+from source_limits import source_limiter, SourceUnavailable
+from fair_queue import FairPolicy
+from sections import SectionPolicy
+from pipeline import Stage, StageMeter, start_monitor
+from tracing import tracer, activate
+from utils import pid_alive
+from models import db, DownloadJob
+
+logger = logging.getLogger(__name__)
+
+# Chunk size used when proxying a file from the node that holds it
+PROXY_CHUNK_SIZE = 256 * 1024
+
+
+def internal_token(job_id):
+    """Token other nodes present to fetch a job's file from this node"""
+    secret = current_app.secret_key.encode('utf-8')
+    return hmac.new(secret, job_id.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def check_internal_token(job_id, token):
+    return bool(token) and hmac.compare_digest(internal_token(job_id), token)
+
+
+def content_type(job):
+    return 'audio/mpeg' if job.kind == 'audio' else 'video/mp4'
+
+
+def _upload_hook(upload):
+    """yt-dlp progress hook that feeds the partial file to a streaming upload"""
+    def hook(progress):
+        if progress.get('status') == 'downloading' and progress.get('tmpfilename'):
+            upload.feed(progress['tmpfilename'], progress.get('downloaded_bytes') or 0)
+    return hook
+
+
+def _runner_alive(runner):
+    """Whether the worker process behind a runner id of this node still runs"""
+    try:
+        pid = int(runner.rsplit(':', 2)[1])
+    except (IndexError, ValueError):
+        return True  # Not ours to judge; its lease still covers it
+    # Same pid under another token: a dead process whose pid was reused by this one
+    return pid != os.getpid() and pid_alive(pid)
+
+
+def _epoch_ns(moment):
+    """Unix time in nanoseconds of a naive UTC datetime"""
+    return int(moment.replace(tzinfo=timezone.utc).timestamp() * 1e9)
+
+
+class Attempt:
+    """One attempt at a claimed job, handed from stage to stage"""
+    __slots__ = ('job_id', 'number', 'trace', 'started', 'work_id', 'resumable_bytes', 'upload', 'clip', 'pending',
+                 'result', 'error')
+
+    def __init__(self, job_id, number, trace):
+        self.job_id = job_id
+        self.number = number
+        self.trace = trace
+        self.started = time.perf_counter()
+        self.work_id = None
+        self.resumable_bytes = 0
+        self.upload = None
+        self.clip = None
+        self.pending = None
+        self.result = None
+        self.error = None
+
+
+class JobRunner:
+    """Pulls download jobs from the shared queue table and runs them on this node.
+
+    Every app instance runs DOWNLOAD_WORKERS threads. A job is claimed with
+    a conditional UPDATE (behind SELECT ... FOR UPDATE SKIP LOCKED where the
+    database supports it), so each job runs exactly once across the cluster,
+    and the claiming node records itself as the owner of the output file.
+    The claim is a lease of JOB_LEASE_SECONDS that a heartbeat thread keeps
+    renewing while the job is on this node; every node requeues running
+    jobs whose lease has lapsed, so the jobs of a crashed node run again.
+    The row also names the worker process holding the job and the stage it
+    is in; on startup a node requeues the jobs of its own dead processes
+    right away instead of waiting for their leases to lapse.
+
+    Jobs then move through a pipeline: the claiming thread only transfers
+    the media; ffmpeg postprocessing (merging, fixups, mp3 extraction) runs
+    on the postprocess pool, and storing the outcome (upload to object
+    storage, job row, history) on the publish pool. Bounded queues between
+    the stages let transfers and transcodes of different jobs overlap
+    without either side running far ahead of the other.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._leased = set()
+        self._leased_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.node_id = app.config.get('NODE_ID') or socket.gethostname()
+        self.runner_id = f"{self.node_id}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.node_url = app.config.get('NODE_URL')
+        self.poll_interval = app.config.get('JOB_POLL_INTERVAL', 1.0)
+        self.lease_seconds = app.config.get('JOB_LEASE_SECONDS', 60.0)
+        self.storage = create_storage(app.config)
+        self.max_attempts = app.config.get('JOB_MAX_ATTEMPTS', 4)
+        self.retry_base_delay = app.config.get('JOB_RETRY_BASE_DELAY', 5.0)
+        self.retry_max_delay = app.config.get('JOB_RETRY_MAX_DELAY', 300.0)
+        self.retry_affinity = app.config.get('JOB_RETRY_AFFINITY', 120.0)
+        self.fair = FairPolicy(app.config)
+        self.sections = SectionPolicy(app.config)
+
+        workers = app.config.get('DOWNLOAD_WORKERS', 2)
+        queue_size = app.config.get('PIPELINE_QUEUE_SIZE', 4)
+        self.transfer_meter = StageMeter('transfer', workers)
+        self.postprocess_stage = Stage('postprocess', app, self._postprocess_and_publish,
+                                       app.config.get('PIPELINE_POSTPROCESS_WORKERS', 2), queue_size,
+                                       on_error=self._stage_failed)
+        self.publish_stage = Stage('publish', app, self._publish,
+                                   app.config.get('PIPELINE_PUBLISH_WORKERS', 2), queue_size,
+                                   on_error=self._stage_failed)
+        if workers:
+            try:
+                with app.app_context():
+                    self.recover()
+            except Exception as e:
+                logger.error("Error recovering interrupted jobs: %s: %s", type(e).__name__, e)
+            self.postprocess_stage.start()
+            self.publish_stage.start()
+            start_monitor((self.transfer_meter, self.postprocess_stage, self.publish_stage),
+                          app.config.get('PIPELINE_METRICS_INTERVAL', 5.0))
+            threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True).start()
+
+        for index in range(workers):
+            thread = threading.Thread(target=self._run, name=f"download-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def enqueue(self, kind, url, format_id, client_id=None, **fields):
+        """Add a download to the shared queue and return the job"""
+        job_id = uuid.uuid4()
+        # Jobs queued outside a traced request start their own trace
+        fields['trace_id'] = fields.get('trace_id') or job_id.hex
+        job = DownloadJob(id=str(job_id), kind=kind, url=url, format_id=format_id,
+                          status='queued', created_at=datetime.utcnow(), client_id=client_id,
+                          fair_tag=self.fair.tag_for(client_id), **fields)
+        db.session.add(job)
+        db.session.commit()
+        metrics.inc('jobs.enqueued', kind=kind)
+        self._wakeup.set()
+        return job
+
+    def claim(self):
+        """Take the queued job with the lowest fair queueing tag for this node; returns its id or None"""
+        # Leave jobs of tripped or saturated sources, and of clients at their cap, in the queue for now
+        blocked = source_limiter.blocked_sources()
+        capped = self.fair.saturated_clients()
+        while True:
+            now = datetime.utcnow()
+            query = (
+                select(DownloadJob.id)
+                .where(DownloadJob.status == 'queued',
+                       or_(DownloadJob.next_attempt_at.is_(None), DownloadJob.next_attempt_at <= now),
+                       # Retries stay on the node holding their partial data for a while
+                       or_(DownloadJob.node.is_(None), DownloadJob.node == self.node_id,
+                           DownloadJob.next_attempt_at <= now - timedelta(seconds=self.retry_affinity)))
+            )
+            if blocked:
+                query = query.where(or_(DownloadJob.source.is_(None), DownloadJob.source.notin_(blocked)))
+            if capped:
+                query = query.where(or_(DownloadJob.client_id.is_(None), DownloadJob.client_id.notin_(capped)))
+            job_id = db.session.execute(
+                query.order_by(DownloadJob.fair_tag, DownloadJob.created_at).limit(1).with_for_update(skip_locked=True)
+            ).scalar()
+            if job_id is None:
+                db.session.rollback()
+                return None
+
+            result = db.session.execute(
+                update(DownloadJob)
+                .where(DownloadJob.id == job_id, DownloadJob.status == 'queued')
+                .values(status='running', node=self.node_id, node_url=self.node_url,
+                        started_at=now, attempts=DownloadJob.attempts + 1,
+                        lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                        stage='transfer', runner=self.runner_id)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            if result.rowcount == 1:
+                with self._leased_lock:
+                    self._leased.add(job_id)
+                return job_id
+            # Another node won the race for this job; try the next one
+
+    def run(self, job_id):
+        """Run a claimed job through every stage on this thread and store its outcome"""
+        attempt = self._transfer(job_id)
+        if attempt.pending is not None:
+            self._postprocess(attempt)
+        self._publish(attempt)
+
+    def _transfer(self, job_id):
+        """Transfer stage: fetch the media of a claimed job, leaving postprocessing for later"""
+        job = db.session.get(DownloadJob, job_id)
+        trace = tracer.start('job.attempt', job.trace_id, job_id=job.id, kind=job.kind, source=job.source,
+                             attempt=job.attempts, node=self.node_id)
+        attempt = Attempt(job.id, job.attempts, trace)
+        with activate(trace):
+            queued_at = job.next_attempt_at or job.created_at
+            metrics.observe('jobs.queue_wait_seconds', (job.started_at - queued_at).total_seconds(), kind=job.kind)
+            trace.add('queue', _epoch_ns(queued_at), _epoch_ns(job.started_at))
+
+            # Retries reuse the job's work id, so yt-dlp resumes the partial file of the last attempt
+            attempt.work_id = job.id.replace('-', '')[:16]
+            attempt.resumable_bytes = downloader.partial_bytes(attempt.work_id) if job.attempts > 1 else 0
+
+            # Single-file video downloads can be uploaded while yt-dlp is still writing;
+            # merged formats and audio conversions only exist once postprocessing is done
+            progress_hook = None
+            if self.storage and job.kind == 'video' and '+' not in job.format_id:
+                attempt.upload = self._start_upload(job)
+                if attempt.upload:
+                    progress_hook = _upload_hook(attempt.upload)
+
+            attempt.clip = (job.clip_start or 0.0, job.clip_end) if job.clip_end is not None else None
+            try:
+                with source_limiter.guard(job.source):
+                    if job.kind == 'audio':
+                        attempt.pending = downloader.fetch_audio(job.url, job.format_id, job.title or 'Unknown Title',
+                                                                 work_id=attempt.work_id, clip=attempt.clip)
+                    else:
+                        attempt.pending = downloader.fetch_video(job.url, job.format_id, progress_hook=progress_hook,
+                                                                 work_id=attempt.work_id, sections=self.sections,
+                                                                 clip=attempt.clip,
+                                                                 precise_cuts=bool(job.clip_precise))
+            except (SourceUnavailable, DownloadFailed) as e:
+                attempt.error = e
+            except Exception as e:
+                logger.error("Error running job %s: %s: %s", job.id, type(e).__name__, e)
+                attempt.error = e
+        return attempt
+
+    def _postprocess(self, attempt):
+        """Postprocess stage: run the deferred ffmpeg steps and check the finished file"""
+        pending, attempt.pending = attempt.pending, None
+        with activate(attempt.trace):
+            try:
+                attempt.result = pending.finish()
+            except DownloadFailed as e:
+                attempt.error = e
+            except Exception as e:
+                logger.error("Error postprocessing job %s: %s: %s", attempt.job_id, type(e).__name__, e)
+                attempt.error = e
+
+    def _postprocess_and_publish(self, attempt):
+        self._postprocess(attempt)
+        self._set_stage(attempt, 'publish')
+        self.publish_stage.put(attempt)
+
+    def _hand_off(self, attempt):
+        """Queue a transferred job for the next stage; a file that only needs moving is finished here"""
+        if attempt.pending is not None and attempt.pending.needs_postprocessing:
+            self._set_stage(attempt, 'postprocess')
+            self.postprocess_stage.put(attempt)
+            return
+        if attempt.pending is not None:
+            self._postprocess(attempt)
+        self._set_stage(attempt, 'publish')
+        self.publish_stage.put(attempt)
+
+    def _set_stage(self, attempt, stage):
+        """Record the stage a running job moves to"""
+        db.session.execute(
+            update(DownloadJob)
+            .where(DownloadJob.id == attempt.job_id, DownloadJob.status == 'running',
+                   DownloadJob.runner == self.runner_id)
+            .values(stage=stage)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+    def _stage_failed(self, attempt, error):
+        """A stage raised on an attempt: fail it like any unexpected error instead of leaving it running"""
+        try:
+            db.session.rollback()
+            job = db.session.get(DownloadJob, attempt.job_id)
+            if job is None or not self._holds_lease(job, attempt):
+                # Its outcome was stored before the error, or the job has moved on
+                attempt.trace.finish(error=f"{type(error).__name__}: {str(error)}"[:200])
+                return
+            attempt.pending = None
+            attempt.result = None
+            attempt.error = error
+            self._publish(attempt)
+        finally:
+            # Should even this fail, the lease lapses and the heartbeat requeues the job
+            self._release(attempt.job_id)
+
+    def _release(self, job_id):
+        """Stop renewing the lease of a job that this process is done with"""
+        with self._leased_lock:
+            self._leased.discard(job_id)
+
+    def _publish(self, attempt):
+        """Publish stage: store the outcome of an attempt, offload its file and record it in the history"""
+        job = db.session.get(DownloadJob, attempt.job_id)
+        trace = attempt.trace
+        error = None
+        try:
+            if not self._holds_lease(job, attempt):
+                self._drop_attempt(job, attempt)
+                error = 'Lease lost'
+                return
+            with activate(trace):
+                history = self._store_outcome(job, attempt)
+        except Exception as e:
+            error = f"{type(e).__name__}: {str(e)}"[:200]
+            raise
+        finally:
+            trace.finish(error=error)
+            self._release(attempt.job_id)
+
+        if history:
+            # Recorded once the job is committed, so the row carries the commit time as well
+            timings = dict(trace.phase_millis(), validate_ms=job.validate_ms)
+            history_recorder.record(trace_id=job.trace_id, **history, **timings)
+
+    def _store_outcome(self, job, attempt):
+        """Update and commit the job row; returns the history fields of a finished download"""
+        trace = attempt.trace
+        result = attempt.result
+        upload = attempt.upload
+        history = None
+
+        if isinstance(attempt.error, SourceUnavailable):
+            self._defer(job, attempt.error)
+        elif isinstance(attempt.error, DownloadFailed):
+            self._fail(job, attempt.work_id, str(attempt.error), attempt.error.retryable)
+        elif attempt.error is not None or result is None:
+            self._fail(job, attempt.work_id, 'An unexpected error occurred during download. Please try again later.',
+                       True)
+        else:
+            job.status = 'done'
+            job.error = None
+            job.next_attempt_at = None
+            if attempt.resumable_bytes:
+                job.bytes_recovered += attempt.resumable_bytes
+                metrics.inc('jobs.bytes_recovered', attempt.resumable_bytes, kind=job.kind)
+            job.title = result['title']
+            job.file_path = result['file_path']
+            job.filename = result['filename']
+            job.file_size = result['file_size']
+            job.full_size = result.get('full_size')
+            if attempt.clip:
+                metrics.inc('downloads.clip_bytes', result['file_size'], kind=job.kind)
+                if job.full_size:
+                    metrics.inc('downloads.clip_bytes_saved', max(job.full_size - result['file_size'], 0),
+                                kind=job.kind)
+
+            if self.storage:
+                with trace.span('offload'):
+                    self._offload(job, upload or self._start_upload(job))
+                upload = None
+
+            history = dict(
+                video_id=job.video_id or 'unknown',
+                title=result['title'],
+                url=job.url,
+                source=job.source,
+                resolution=result['resolution'],
+                format_type=job.kind,
+                file_size=round(result['file_size'] / (1024 * 1024), 2),
+                clip_start=job.clip_start,
+                clip_end=job.clip_end,
+                full_file_size=round(job.full_size / (1024 * 1024), 2) if job.full_size else None
+            )
+
+        if upload:
+            upload.abort()
+
+        job.lease_expires_at = None
+        job.stage = None
+        job.runner = None
+        if job.status != 'queued':
+            job.finished_at = datetime.utcnow()
+            metrics.inc('jobs.finished', kind=job.kind, status=job.status)
+        with trace.span('commit'):
+            db.session.commit()
+        metrics.observe('jobs.run_seconds', time.perf_counter() - attempt.started, kind=job.kind)
+        trace.attributes.update(status=job.status, error=job.error)
+        return history
+
+    def _holds_lease(self, job, attempt):
+        """Whether the job is still this attempt's, i.e. its lease was not requeued or taken over"""
+        return job.status == 'running' and job.runner == self.runner_id and job.attempts == attempt.number
+
+    def _drop_attempt(self, job, attempt):
+        """Discard the outcome of an attempt whose lease lapsed; the job's current holder owns it now"""
+        logger.warning("Job %s attempt %s lost its lease, discarding its outcome", job.id, attempt.number)
+        metrics.inc('jobs.lease_lost', kind=job.kind)
+        db.session.rollback()
+        if attempt.upload:
+            attempt.upload.abort()
+        # A retry on this node resumes from the same files, so only clean up after another node took over
+        if attempt.result and job.node != self.node_id:
+            try:
+                os.remove(attempt.result['file_path'])
+            except OSError:
+                pass
+
+    def requeue_expired(self):
+        """Requeue running jobs whose node stopped renewing their lease; returns how many were released"""
+        now = datetime.utcnow()
+        expired = (DownloadJob.status == 'running', DownloadJob.lease_expires_at < now)
+        # A job that keeps taking its worker down with it must not be retried forever
+        failed = db.session.execute(
+            update(DownloadJob)
+            .where(*expired, DownloadJob.attempts >= self.max_attempts)
+            .values(status='failed', error='The download stopped responding. Please try again later.',
+                    lease_expires_at=None, stage=None, runner=None, finished_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        requeued = db.session.execute(
+            update(DownloadJob)
+            .where(*expired)
+            .values(status='queued', next_attempt_at=now, lease_expires_at=None, stage=None, runner=None)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if failed or requeued:
+            metrics.inc('jobs.lease_expired', failed + requeued)
+            logger.warning("Released %d jobs with expired leases (%d requeued, %d failed)",
+                           failed + requeued, requeued, failed)
+            self._wakeup.set()
+        return failed + requeued
+
+    def recover(self):
+        """Requeue this node's running jobs whose worker process is gone; returns how many were released.
+
+        Their attempts were lost with that process's stage queues. Requeued
+        at once and still pinned to this node, they resume from whatever
+        files the attempt left, as retries do. Like lapsed leases, these
+        interruptions count as attempts.
+        """
+        rows = db.session.execute(
+            select(DownloadJob.runner, DownloadJob.stage)
+            .where(DownloadJob.status == 'running', DownloadJob.node == self.node_id,
+                   DownloadJob.runner.isnot(None))
+        ).all()
+        dead = {runner for runner, _ in rows if runner != self.runner_id and not _runner_alive(runner)}
+        if not dead:
+            db.session.rollback()
+            return 0
+
+        now = datetime.utcnow()
+        orphaned = (DownloadJob.status == 'running', DownloadJob.runner.in_(dead))
+        failed = db.session.execute(
+            update(DownloadJob)
+            .where(*orphaned, DownloadJob.attempts >= self.max_attempts)
+            .values(status='failed', error='The download was interrupted. Please try again later.',
+                    lease_expires_at=None, stage=None, runner=None, finished_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        requeued = db.session.execute(
+            update(DownloadJob)
+            .where(*orphaned)
+            .values(status='queued', next_attempt_at=now, lease_expires_at=None, stage=None, runner=None)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        for runner, stage in rows:
+            if runner in dead:
+                metrics.inc('jobs.recovered', stage=stage or 'unknown')
+        logger.warning("Recovered %d jobs interrupted in a previous process (%d requeued, %d failed)",
+                       failed + requeued, requeued, failed)
+        self._wakeup.set()
+        return failed + requeued
+
+    def _renew_leases(self):
+        """Extend the lease of every job this process is working on, in any stage"""
+        with self._leased_lock:
+            job_ids = list(self._leased)
+        if not job_ids:
+            return
+        db.session.execute(
+            update(DownloadJob)
+            .where(DownloadJob.id.in_(job_ids), DownloadJob.status == 'running',
+                   DownloadJob.runner == self.runner_id)
+            .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=self.lease_seconds))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+    def _heartbeat(self):
+        """Renew this node's leases and release lapsed ones, three times per lease period"""
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                with self.app.app_context():
+                    self._renew_leases()
+                    self.requeue_expired()
+            except Exception as e:
+                logger.error("Job heartbeat error: %s: %s", type(e).__name__, e)
+
+    def retry_delay(self, attempt):
+        """Exponential backoff with equal jitter for the given (1-based) attempt"""
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _fail(self, job, work_id, message, retryable):
+        """Requeue a retryable failure with backoff, or fail the job for good"""
+        job.error = message
+        if retryable and job.attempts < self.max_attempts:
+            job.status = 'queued'
+            job.next_attempt_at = datetime.utcnow() + timedelta(seconds=self.retry_delay(job.attempts))
+            metrics.inc('jobs.retries', kind=job.kind)
+            logger.info("Job %s attempt %s failed, retrying at %s", job.id, job.attempts, job.next_attempt_at)
+            return
+
+        job.status = 'failed'
+        metrics.inc('jobs.permanent_failures' if not retryable else 'jobs.retries_exhausted', kind=job.kind)
+        downloader.discard_partial(work_id)
+
+    def _defer(self, job, unavailable):
+        """Put a job back in the queue until its source can take it; this was not an attempt"""
+        job.status = 'queued'
+        job.attempts -= 1
+        job.next_attempt_at = datetime.utcnow() + timedelta(seconds=unavailable.retry_after)
+        metrics.inc('jobs.deferred', source=unavailable.source, reason=unavailable.reason)
+
+    def _start_upload(self, job):
+        try:
+            return self.storage.start_upload(self.storage.key_for(job.id), content_type(job))
+        except Exception as e:
+            logger.error("Error starting upload for job %s: %s: %s", job.id, type(e).__name__, e)
+            return None
+
+    def _offload(self, job, upload):
+        """Move a finished file to object storage; on failure it stays on this node"""
+        if upload is None:
+            return
+        started = time.perf_counter()
+        try:
+            upload.finish(job.file_path)
+        except Exception as e:
+            logger.error("Error uploading job %s to object storage: %s: %s", job.id, type(e).__name__, e)
+            metrics.inc('storage.upload_errors')
+            return
+        metrics.observe('storage.finish_seconds', time.perf_counter() - started)
+
+        job.storage_key = upload.key
+        try:
+            os.remove(job.file_path)
+        except OSError as e:
+            logger.error("Error removing offloaded file: %s", e)
+        job.file_path = None
+
+    def _run(self):
+        """Transfer worker loop: claim and transfer jobs, sleeping while the queue is empty"""
+        while True:
+            try:
+                with self.app.app_context():
+                    job_id = self.claim()
+                    if job_id is not None:
+                        self._run_transfer(job_id)
+                        continue
+            except Exception as e:
+                logger.error("Download worker error: %s: %s", type(e).__name__, e)
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _run_transfer(self, job_id):
+        attempt = None
+        try:
+            with self.transfer_meter.working():
+                attempt = self._transfer(job_id)
+            # Blocks while the next stage is full, which holds back further claims
+            self._hand_off(attempt)
+        except Exception as e:
+            logger.error("Error transferring job %s: %s: %s", job_id, type(e).__name__, e)
+            metrics.inc('pipeline.errors', stage='transfer')
+            if attempt is None:
+                # Nothing to record it with; the lease lapses and the job is requeued
+                self._release(job_id)
+            else:
+                self._stage_failed(attempt, e)
+
+    def is_local(self, job):
+        return job.node == self.node_id
+
+    def route_to_owner(self, job):
+        """Redirect or proxy a file request to the node that holds the job's file"""
+        if not job.node_url:
+            return "File is stored on another server", 404
+
+        url = f"{job.node_url.rstrip('/')}/internal/file/{job.id}"
+        token = internal_token(job.id)
+        metrics.inc('jobs.routed_file_requests', mode=current_app.config.get('FILE_ROUTING', 'proxy'))
+
+        if current_app.config.get('FILE_ROUTING', 'proxy') == 'redirect':
+            return redirect(f"{url}?token={token}")
+
+        upstream = requests.get(url, headers={'X-Internal-Token': token}, stream=True, timeout=(5, 60))
+        headers = {name: upstream.headers[name]
+                   for name in ('Content-Type', 'Content-Length', 'Content-Disposition')
+                   if name in upstream.headers}
+
+        def stream():
+            try:
+                yield from upstream.iter_content(PROXY_CHUNK_SIZE)
+            finally:
+                upstream.close()
+
+        return Response(stream_with_context(stream()), status=upstream.status_code, headers=headers)
+
+
+job_runner = JobRunner()
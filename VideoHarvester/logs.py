@@ -0,0 +1,155 @@
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import contextvars
+import logging.handlers
+from uuid import uuid4
+from datetime import datetime, timezone
+from flask import g, request
+
+import metrics
+from tracing import current_trace
+
+# Request id of the request being handled, and whether its debug lines are kept
+_request_id = contextvars.ContextVar('request_id', default=None)
+_sampled = contextvars.ContextVar('log_sampled', default=None)
+
+# Attributes every LogRecord has; anything else was passed in extra= and is logged as a field
+STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id', 'trace_id'}
+
+# Incoming request ids longer than this are replaced rather than trusted
+MAX_REQUEST_ID = 64
+
+
+def request_id():
+    return _request_id.get()
+
+
+class ContextFilter(logging.Filter):
+    """Tags records with the request and trace they belong to, and samples debug records.
+
+    Runs in the thread that logs, before the record is queued, because
+    the context it reads is per thread. Debug records are kept for a sampled
+    share of requests (all of a request's lines or none of them); outside
+    a request each debug record is sampled on its own.
+    """
+
+    def __init__(self, debug_sample_rate=1.0):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and self.debug_sample_rate < 1.0:
+            sampled = _sampled.get()
+            if sampled is None:
+                sampled = random.random() < self.debug_sample_rate
+            if not sampled:
+                return False
+        record.request_id = _request_id.get()
+        trace = current_trace()
+        record.trace_id = trace.trace_id if trace else None
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread and drops records when full.
+
+    The stock handler formats every record in the calling thread. Here the
+    message, its arguments and any traceback are only rendered by the
+    listener, so a logging call costs the caller a queue put; arguments
+    must therefore not be mutated after they are logged. The queue is a
+    SimpleQueue (a C-level put), bounded by checking its size first.
+    """
+
+    def __init__(self, max_size):
+        super().__init__(queue.SimpleQueue())
+        self.max_size = max_size
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.max_size:
+            metrics.inc('logs.dropped')
+            return
+        self.queue.put_nowait(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, correlation ids and extra fields"""
+
+    def __init__(self, max_message=2000):
+        super().__init__()
+        self.max_message = max_message
+
+    def format(self, record):
+        message = record.getMessage()
+        if len(message) > self.max_message:
+            # yt-dlp errors can carry whole pages of output
+            message = message[:self.max_message] + '...'
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': message,
+            'thread': record.threadName,
+            'pid': record.process,
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        if getattr(record, 'trace_id', None):
+            entry['trace_id'] = record.trace_id
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def init_app(app):
+    """Route all logging through a queue to a background writer; tag records with request ids"""
+    level = app.config.get('LOG_LEVEL', 'INFO').upper()
+    if app.config.get('LOG_FORMAT', 'json') == 'json':
+        formatter = JsonFormatter(app.config.get('LOG_MAX_MESSAGE', 2000))
+    else:
+        formatter = logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(request_id)s %(message)s')
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(formatter)
+    handler = LazyQueueHandler(app.config.get('LOG_QUEUE_SIZE', 10000))
+    handler.addFilter(ContextFilter(app.config.get('LOG_DEBUG_SAMPLE_RATE', 1.0)))
+    listener = logging.handlers.QueueListener(handler.queue, stream)
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+
+    sample_rate = app.config.get('LOG_DEBUG_SAMPLE_RATE', 1.0)
+
+    @app.before_request
+    def bind_request_id():
+        """Adopt the caller's X-Request-ID (or make one) for every line this request logs"""
+        incoming = request.headers.get('X-Request-ID', '')
+        value = incoming if 0 < len(incoming) <= MAX_REQUEST_ID and incoming.isprintable() else uuid4().hex
+        g.log_tokens = (_request_id.set(value), _sampled.set(random.random() < sample_rate))
+
+    @app.after_request
+    def return_request_id(response):
+        if _request_id.get():
+            response.headers['X-Request-ID'] = _request_id.get()
+        return response
+
+    @app.teardown_request
+    def unbind_request_id(error=None):
+        tokens = g.pop('log_tokens', None)
+        if tokens:
+            _request_id.reset(tokens[0])
+            _sampled.reset(tokens[1])
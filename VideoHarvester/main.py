@@ -1,5 +1,6 @@
 import os
 from flask import Flask
+from flask_migrate import Migrate
 
 # Create app instance
 app = Flask(__name__)
@@ -12,6 +13,151 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_pre_ping": True,
 }
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Set to 0 to apply migrations as a release step ("flask --app main db upgrade") instead of on startup
+app.config["DB_MIGRATE_ON_START"] = os.environ.get("DB_MIGRATE_ON_START", "1") != "0"
+
+# Optional read replica used for read-only queries
+if os.environ.get("DATABASE_REPLICA_URL"):
+    app.config["SQLALCHEMY_BINDS"] = {"replica": os.environ["DATABASE_REPLICA_URL"]}
+app.config["REPLICA_MAX_LAG"] = float(os.environ.get("REPLICA_MAX_LAG", "5.0"))
+app.config["REPLICA_CHECK_INTERVAL"] = float(os.environ.get("REPLICA_CHECK_INTERVAL", "5.0"))
+app.config["REPLICA_STICKY_SECONDS"] = float(os.environ.get("REPLICA_STICKY_SECONDS", "10.0"))
+
+# Write-behind download history
+app.config["HISTORY_BATCH_SIZE"] = int(os.environ.get("HISTORY_BATCH_SIZE", "50"))
+app.config["HISTORY_FLUSH_INTERVAL"] = float(os.environ.get("HISTORY_FLUSH_INTERVAL", "2.0"))
+app.config["HISTORY_SPOOL_DIR"] = os.environ.get("HISTORY_SPOOL_DIR")
+
+# Rendered /history and /scheduled pages, shared by all workers
+app.config["RESPONSE_CACHE_DIR"] = os.environ.get("RESPONSE_CACHE_DIR")
+app.config["RESPONSE_CACHE_MAX_BYTES"] = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Precompressed variants of fingerprinted static files
+app.config["ASSET_CACHE_DIR"] = os.environ.get("ASSET_CACHE_DIR")
+
+# Resized thumbnail cache
+app.config["THUMB_CACHE_DIR"] = os.environ.get("THUMB_CACHE_DIR")
+app.config["THUMB_CACHE_MAX_BYTES"] = int(os.environ.get("THUMB_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# Metadata and captions served by /metadata and /subtitles, shared by all workers; caption URLs expire
+app.config["METADATA_CACHE_DIR"] = os.environ.get("METADATA_CACHE_DIR")
+app.config["METADATA_CACHE_TTL"] = float(os.environ.get("METADATA_CACHE_TTL", "3600"))
+app.config["METADATA_CACHE_MAX_BYTES"] = int(os.environ.get("METADATA_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+
+# Shared download queue; NODE_URL is how other nodes reach this one for files it holds
+app.config["NODE_ID"] = os.environ.get("NODE_ID")
+app.config["NODE_URL"] = os.environ.get("NODE_URL")
+app.config["DOWNLOAD_WORKERS"] = int(os.environ.get("DOWNLOAD_WORKERS", "2"))
+app.config["JOB_POLL_INTERVAL"] = float(os.environ.get("JOB_POLL_INTERVAL", "1.0"))
+# Nodes renew the lease of their running jobs every lease/3 seconds; jobs of a dead node are requeued once it lapses
+app.config["JOB_LEASE_SECONDS"] = float(os.environ.get("JOB_LEASE_SECONDS", "60.0"))
+app.config["FILE_ROUTING"] = os.environ.get("FILE_ROUTING", "proxy")  # proxy or redirect
+
+# Pipelined jobs: DOWNLOAD_WORKERS only transfer; ffmpeg postprocessing and publishing have pools of their own
+app.config["PIPELINE_POSTPROCESS_WORKERS"] = int(os.environ.get("PIPELINE_POSTPROCESS_WORKERS",
+                                                                str(max(1, (os.cpu_count() or 2) // 2))))
+app.config["PIPELINE_PUBLISH_WORKERS"] = int(os.environ.get("PIPELINE_PUBLISH_WORKERS", "2"))
+app.config["PIPELINE_QUEUE_SIZE"] = int(os.environ.get("PIPELINE_QUEUE_SIZE", "4"))  # Jobs waiting per stage
+app.config["PIPELINE_METRICS_INTERVAL"] = float(os.environ.get("PIPELINE_METRICS_INTERVAL", "5.0"))
+
+# Retries of failed jobs: exponential backoff with jitter, resuming partial files
+app.config["JOB_MAX_ATTEMPTS"] = int(os.environ.get("JOB_MAX_ATTEMPTS", "4"))
+app.config["JOB_RETRY_BASE_DELAY"] = float(os.environ.get("JOB_RETRY_BASE_DELAY", "5.0"))
+app.config["JOB_RETRY_MAX_DELAY"] = float(os.environ.get("JOB_RETRY_MAX_DELAY", "300.0"))
+app.config["JOB_RETRY_AFFINITY"] = float(os.environ.get("JOB_RETRY_AFFINITY", "120.0"))
+
+# Per-source concurrency limits and circuit breakers, shared by all workers
+app.config["SOURCE_MAX_CONCURRENCY"] = int(os.environ.get("SOURCE_MAX_CONCURRENCY", "4"))
+app.config["SOURCE_CONCURRENCY"] = os.environ.get("SOURCE_CONCURRENCY")  # e.g. "youtube=8,vimeo=2"
+app.config["SOURCE_BREAKER_THRESHOLD"] = int(os.environ.get("SOURCE_BREAKER_THRESHOLD", "5"))
+app.config["SOURCE_BREAKER_COOLDOWN"] = float(os.environ.get("SOURCE_BREAKER_COOLDOWN", "30.0"))
+app.config["SOURCE_BREAKER_PROBES"] = int(os.environ.get("SOURCE_BREAKER_PROBES", "1"))
+app.config["SOURCE_BUSY_RETRY_AFTER"] = int(os.environ.get("SOURCE_BUSY_RETRY_AFTER", "5"))
+app.config["SOURCE_LEASE_TTL"] = int(os.environ.get("SOURCE_LEASE_TTL", "3600"))
+
+# Admission control for new downloads: queue depth, p95 job latency, load and free TEMP_DIR space
+app.config["ADMISSION_MAX_QUEUE"] = int(os.environ.get("ADMISSION_MAX_QUEUE", "50"))
+app.config["ADMISSION_TARGET_P95"] = float(os.environ.get("ADMISSION_TARGET_P95", "300.0"))
+app.config["ADMISSION_MAX_LOAD"] = float(os.environ.get("ADMISSION_MAX_LOAD", "2.0"))  # load average per CPU
+app.config["ADMISSION_MIN_FREE_BYTES"] = int(os.environ.get("ADMISSION_MIN_FREE_BYTES", str(1024 * 1024 * 1024)))
+app.config["ADMISSION_HARD_FACTOR"] = float(os.environ.get("ADMISSION_HARD_FACTOR", "1.5"))
+app.config["ADMISSION_WINDOW"] = float(os.environ.get("ADMISSION_WINDOW", "300.0"))
+app.config["ADMISSION_CHECK_INTERVAL"] = float(os.environ.get("ADMISSION_CHECK_INTERVAL", "1.0"))
+
+# Weighted fair queueing between clients (API key hash, browser session or IP, as shown in job rows)
+app.config["FAIR_DEFAULT_WEIGHT"] = int(os.environ.get("FAIR_DEFAULT_WEIGHT", "1"))
+app.config["FAIR_WEIGHTS"] = os.environ.get("FAIR_WEIGHTS")  # e.g. "key:3f2a9c0d1b4e5f60=4"
+app.config["FAIR_MAX_PER_CLIENT"] = int(os.environ.get("FAIR_MAX_PER_CLIENT", "4"))
+app.config["FAIR_CLIENT_CAPS"] = os.environ.get("FAIR_CLIENT_CAPS")
+
+# Recurring channel and playlist subscriptions (cron expressions are evaluated in UTC)
+app.config["SUBSCRIPTION_POLL_INTERVAL"] = float(os.environ.get("SUBSCRIPTION_POLL_INTERVAL", "30.0"))
+app.config["SUBSCRIPTION_MAX_ENTRIES"] = int(os.environ.get("SUBSCRIPTION_MAX_ENTRIES", "200"))
+app.config["SUBSCRIPTION_BACKFILL"] = int(os.environ.get("SUBSCRIPTION_BACKFILL", "0"))  # Existing uploads queued by the first sync
+
+# In-memory index of media already in the download history
+app.config["MEMBERSHIP_ERROR_RATE"] = float(os.environ.get("MEMBERSHIP_ERROR_RATE", "0.01"))
+app.config["MEMBERSHIP_REFRESH_INTERVAL"] = float(os.environ.get("MEMBERSHIP_REFRESH_INTERVAL", "5.0"))
+app.config["MEMBERSHIP_MIN_CAPACITY"] = int(os.environ.get("MEMBERSHIP_MIN_CAPACITY", "100000"))
+
+# Dispatch of scheduled downloads: smoothed to a cluster-wide rate, with bounded jitter and delay
+app.config["SCHEDULE_DISPATCH_RATE"] = float(os.environ.get("SCHEDULE_DISPATCH_RATE", "5.0"))  # jobs per second
+app.config["SCHEDULE_JITTER"] = float(os.environ.get("SCHEDULE_JITTER", "30.0"))
+app.config["SCHEDULE_MAX_DELAY"] = float(os.environ.get("SCHEDULE_MAX_DELAY", "300.0"))
+app.config["SCHEDULE_PLAN_AHEAD"] = float(os.environ.get("SCHEDULE_PLAN_AHEAD", "60.0"))
+app.config["SCHEDULE_POLL_INTERVAL"] = float(os.environ.get("SCHEDULE_POLL_INTERVAL", "0.5"))
+
+# Metadata prefetch: resolve title and format this long before a scheduled download is due
+app.config["SCHEDULE_PREFETCH_LEAD"] = float(os.environ.get("SCHEDULE_PREFETCH_LEAD", "600.0"))
+app.config["SCHEDULE_PREFETCH_POLL_INTERVAL"] = float(os.environ.get("SCHEDULE_PREFETCH_POLL_INTERVAL", "5.0"))
+
+# Download tracing: spans exported as OTLP/JSON to a file or an OTLP/HTTP collector
+app.config["TRACE_EXPORT"] = os.environ.get("TRACE_EXPORT", "")  # empty (metrics only), file or otlp
+app.config["TRACE_FILE"] = os.environ.get("TRACE_FILE")
+app.config["TRACE_OTLP_ENDPOINT"] = os.environ.get("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+app.config["TRACE_SERVICE_NAME"] = os.environ.get("TRACE_SERVICE_NAME", "videoharvester")
+
+# Admin-only profiling: request profiles and tracemalloc snapshots, all disabled without a token
+app.config["PROFILING_TOKEN"] = os.environ.get("PROFILING_TOKEN")  # sent as the X-Admin-Token header
+app.config["PROFILE_DIR"] = os.environ.get("PROFILE_DIR")
+app.config["PROFILE_INTERVAL"] = float(os.environ.get("PROFILE_INTERVAL", "0.005"))  # seconds between samples
+app.config["PROFILE_KEEP"] = int(os.environ.get("PROFILE_KEEP", "50"))
+app.config["TRACEMALLOC_FRAMES"] = int(os.environ.get("TRACEMALLOC_FRAMES", "25"))
+
+# Logging: JSON lines written by a background thread, with request ids and sampled debug output
+app.config["LOG_LEVEL"] = os.environ.get("LOG_LEVEL", "INFO")
+app.config["LOG_FORMAT"] = os.environ.get("LOG_FORMAT", "json")  # json or text
+app.config["LOG_DEBUG_SAMPLE_RATE"] = float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", "0.01"))  # share of requests
+app.config["LOG_QUEUE_SIZE"] = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+app.config["LOG_MAX_MESSAGE"] = int(os.environ.get("LOG_MAX_MESSAGE", "2000"))
+
+# Parallel sectioned downloads of long progressive videos (PARALLEL_MAX_SECTIONS=1 turns them off)
+app.config["PARALLEL_MAX_SECTIONS"] = int(os.environ.get("PARALLEL_MAX_SECTIONS", "1"))
+app.config["PARALLEL_MIN_DURATION"] = float(os.environ.get("PARALLEL_MIN_DURATION", "1200.0"))  # seconds of media
+app.config["PARALLEL_SECTION_SECONDS"] = float(os.environ.get("PARALLEL_SECTION_SECONDS", "30.0"))  # target per section
+app.config["PARALLEL_MIN_SECTION_DURATION"] = float(os.environ.get("PARALLEL_MIN_SECTION_DURATION", "300.0"))
+app.config["PARALLEL_MIN_SECTION_BYTES"] = int(os.environ.get("PARALLEL_MIN_SECTION_BYTES", str(8 * 1024 * 1024)))
+app.config["PARALLEL_PROBE_BYTES"] = int(os.environ.get("PARALLEL_PROBE_BYTES", str(2 * 1024 * 1024)))
+
+# ZIP bundles of several finished downloads, streamed without a temporary archive
+app.config["BUNDLE_MAX_FILES"] = int(os.environ.get("BUNDLE_MAX_FILES", "200"))
+# Bundles and the local files they hold on to expire after BUNDLE_TTL seconds
+app.config["BUNDLE_TTL"] = float(os.environ.get("BUNDLE_TTL", str(24 * 3600)))
+app.config["BUNDLE_SWEEP_INTERVAL"] = float(os.environ.get("BUNDLE_SWEEP_INTERVAL", "300.0"))
+
+# Optional object storage for finished files (S3, MinIO, ...)
+app.config["STORAGE_BACKEND"] = os.environ.get("STORAGE_BACKEND", "local")  # local or s3
+app.config["S3_BUCKET"] = os.environ.get("S3_BUCKET")
+app.config["S3_PREFIX"] = os.environ.get("S3_PREFIX", "downloads/")
+app.config["S3_ENDPOINT_URL"] = os.environ.get("S3_ENDPOINT_URL")
+app.config["S3_REGION"] = os.environ.get("S3_REGION")
+app.config["S3_PART_SIZE"] = int(os.environ.get("S3_PART_SIZE", str(16 * 1024 * 1024)))
+app.config["S3_UPLOAD_CONCURRENCY"] = int(os.environ.get("S3_UPLOAD_CONCURRENCY", "4"))
+app.config["S3_URL_TTL"] = int(os.environ.get("S3_URL_TTL", "300"))
+
+# Configure logging before anything else starts logging
+import logs
+logs.init_app(app)
 
 # Import models and initialize database
 from models import db
@@ -19,15 +165,62 @@ from models import db
 # Initialize database with app
 db.init_app(app)
 
+# Schema migrations live in migrations/ (run "flask --app main db upgrade" to apply by hand)
+migrate = Migrate(app, db, directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations"))
+
+# Bring the database schema up to date; workers take turns on a database lock
+import schema
+schema.init_app(app)
+
+# Load the membership index of downloaded media before anything records new downloads
+from membership import membership_index
+membership_index.init_app(app)
+
+# Start the history recorder once the tables exist
+from history import history_recorder
+history_recorder.init_app(app)
+
+# Source limits must be configured before the workers start
+from source_limits import source_limiter
+source_limiter.init_app(app)
+
+# Admission control for the download endpoints
+from admission import admission_controller
+admission_controller.init_app(app)
+
+# Tracing exporter, before anything starts tracing downloads
+from tracing import tracer
+tracer.init_app(app)
+
+# Start this node's download workers
+from jobs import job_runner
+job_runner.init_app(app)
+
+# Expire ZIP bundles and the files this node kept for them
+import bundles
+bundles.init_app(app)
+
+# Sync channel subscriptions into the download queue
+from subscriptions import subscription_runner
+subscription_runner.init_app(app)
+
+# Dispatch due scheduled downloads into the download queue
+from scheduler import schedule_dispatcher
+schedule_dispatcher.init_app(app)
+
+# Serve static files under content-hashed URLs
+import assets
+assets.init_app(app)
+
+# Admin profiling hooks and endpoints, only when PROFILING_TOKEN is set
+import profiling
+profiling.init_app(app)
+
 # Import routes after app and db created
 from routes import register_routes
 
 # Register routes
 register_routes(app)
 
-# Create database tables
-with app.app_context():
-    db.create_all()
-
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,132 @@
+import sys
+
+
+def _interned(value):
+    """Codec, extension and note strings repeat across formats and videos; keep one copy of each"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _thumbnail(info):
+    if info.get('thumbnail'):
+        return info['thumbnail']
+    # Unprocessed results only carry the list; prefer the largest
+    thumbnails = [thumb for thumb in info.get('thumbnails') or () if thumb.get('url')]
+    if not thumbnails:
+        return None
+    return max(thumbnails, key=lambda thumb: (thumb.get('preference') or 0, thumb.get('width') or 0))['url']
+
+
+def _chapters(info):
+    chapters = info.get('chapters') or ()
+    duration = info.get('duration')
+    result = []
+    for index, chapter in enumerate(chapters):
+        end = chapter.get('end_time')
+        if end is None:
+            end = chapters[index + 1].get('start_time') if index + 1 < len(chapters) else duration
+        result.append({'title': chapter.get('title'), 'start_time': chapter.get('start_time'), 'end_time': end})
+    return result
+
+
+def _languages(captions):
+    """Languages with at least one usable caption track"""
+    return sorted(lang for lang, tracks in (captions or {}).items()
+                  if lang != 'live_chat' and any(track.get('ext') and track.get('url') for track in tracks))
+
+
+class FormatEntry:
+    """The fields of one yt-dlp format that the app reads"""
+    __slots__ = ('format_id', 'ext', 'height', 'vcodec', 'acodec', 'abr', 'filesize', 'format_note')
+
+    def __init__(self, format_id, ext=None, height=None, vcodec=None, acodec=None, abr=None,
+                 filesize=None, format_note=None):
+        self.format_id = format_id
+        self.ext = _interned(ext)
+        self.height = height
+        self.vcodec = _interned(vcodec)
+        self.acodec = _interned(acodec)
+        self.abr = abr
+        self.filesize = filesize
+        self.format_note = _interned(format_note)
+
+    @classmethod
+    def from_info(cls, fmt):
+        return cls(fmt.get('format_id'), fmt.get('ext'), fmt.get('height'), fmt.get('vcodec'), fmt.get('acodec'),
+                   fmt.get('abr'), fmt.get('filesize'), fmt.get('format_note'))
+
+    @property
+    def has_video(self):
+        return bool(self.height) and self.vcodec != 'none'
+
+    @property
+    def has_audio(self):
+        return bool(self.acodec) and self.acodec != 'none'
+
+    def to_list(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def __repr__(self):
+        return f'<FormatEntry {self.format_id} {self.ext} {self.height or "audio"}>'
+
+
+class MediaInfo:
+    """Compact stand-in for a yt-dlp info dict, built right after extraction.
+
+    A raw info dict carries every format's HTTP headers and fragment list,
+    all thumbnails, subtitles and automatic captions, often hundreds of KB
+    per video. Only the fields the app reads are kept here, and the raw
+    dict can be dropped as soon as this is built. to_dict()/from_dict()
+    give the JSON form the metadata cache stores, with formats as plain
+    lists.
+    """
+    __slots__ = ('id', 'title', 'uploader', 'duration', 'thumbnail', 'webpage_url', 'format_id', 'height',
+                 'formats', 'upload_date', 'chapters', 'subtitles', 'automatic_captions')
+
+    # Fields served by /metadata
+    METADATA_FIELDS = ('id', 'title', 'uploader', 'duration', 'upload_date', 'webpage_url', 'thumbnail', 'chapters',
+                       'subtitles', 'automatic_captions')
+
+    def __init__(self, id=None, title=None, uploader=None, duration=None, thumbnail=None, webpage_url=None,
+                 format_id=None, height=None, formats=(), upload_date=None, chapters=(), subtitles=(),
+                 automatic_captions=()):
+        self.id = id
+        self.title = title
+        self.uploader = uploader
+        self.duration = duration
+        self.thumbnail = thumbnail
+        self.webpage_url = webpage_url
+        self.format_id = format_id  # What the format selector resolved to, e.g. '137+140'
+        self.height = height
+        self.formats = tuple(formats)
+        self.upload_date = upload_date
+        self.chapters = list(chapters)
+        self.subtitles = list(subtitles)  # Languages with uploaded subtitles
+        self.automatic_captions = list(automatic_captions)
+
+    @classmethod
+    def from_info(cls, info):
+        """Build from an extract_info() result, processed or not; None stays None"""
+        if not info:
+            return None
+        return cls(info.get('id'), info.get('title'), info.get('uploader') or info.get('channel'),
+                   info.get('duration'), _thumbnail(info), info.get('webpage_url'), info.get('format_id'),
+                   info.get('height'), (FormatEntry.from_info(fmt) for fmt in info.get('formats') or ()),
+                   info.get('upload_date'), _chapters(info), _languages(info.get('subtitles')),
+                   _languages(info.get('automatic_captions')))
+
+    def to_dict(self):
+        fields = {name: getattr(self, name) for name in self.__slots__ if name != 'formats'}
+        fields['formats'] = [fmt.to_list() for fmt in self.formats]
+        return fields
+
+    def metadata(self):
+        return {name: getattr(self, name) for name in self.METADATA_FIELDS}
+
+    @classmethod
+    def from_dict(cls, fields):
+        fields = dict(fields)
+        formats = [FormatEntry(*values) for values in fields.pop('formats', ())]
+        return cls(formats=formats, **fields)
+
+    def __repr__(self):
+        return f'<MediaInfo {self.id} {len(self.formats)} formats>'
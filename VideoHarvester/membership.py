@@ -0,0 +1,207 @@
+import math
+import time
+import hashlib
+import logging
+import threading
+from sqlalchemy import and_, or_, select
+
+import metrics
+from models import db, VideoDownload
+
+logger = logging.getLogger(__name__)
+
+# Rows read per round trip while loading the history table
+LOAD_BATCH = 10000
+
+# Items confirmed per query
+CONFIRM_BATCH = 500
+
+# Refreshes re-read this many ids below the last one seen, since concurrent history
+# flushes can commit a lower id after a higher one was already read
+REFRESH_OVERLAP = 1000
+
+# Keys added by this process are trusted without a database check for this long,
+# which covers rows still waiting in the history write-behind buffer
+PENDING_TTL = 600
+
+
+def media_key(source, video_id, format_type):
+    return f"{source}\x1f{video_id}\x1f{format_type or 'video'}".encode('utf-8')
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over one blake2b digest"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class MembershipIndex:
+    """Per-process index of media already in the download history.
+
+    A Bloom filter answers "not downloaded" without touching the database;
+    the rare positives are confirmed with one indexed query per batch.
+    Rows written by other workers are picked up by reading history rows
+    with a higher id than the last one seen, at most once per
+    MEMBERSHIP_REFRESH_INTERVAL, and the filter is rebuilt at twice the
+    size once it holds more keys than it was sized for.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._count = 0
+        self._last_id = 0
+        self._refreshed_at = 0.0
+        self._pending = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.error_rate = app.config.get('MEMBERSHIP_ERROR_RATE', 0.01)
+        self.refresh_interval = app.config.get('MEMBERSHIP_REFRESH_INTERVAL', 5.0)
+        self.min_capacity = app.config.get('MEMBERSHIP_MIN_CAPACITY', 100000)
+        with app.app_context():
+            started = time.perf_counter()
+            self._rebuild()
+            logger.info("Membership index loaded %s items in %.2fs", self._count, time.perf_counter() - started)
+
+    def add(self, source, video_id, format_type):
+        """Record media that was just downloaded by this process"""
+        if not video_id or video_id == 'unknown':
+            return
+        key = media_key(source, video_id, format_type)
+        with self._lock:
+            if self._bloom is None:
+                return
+            self._bloom.add(key)
+            self._count += 1
+            self._pending[key] = time.monotonic()
+
+    def contains(self, source, video_id, format_type):
+        return not self.filter_new([(source, video_id, format_type)])
+
+    def filter_new(self, items):
+        """Return the (source, video_id, format_type) items that are not in the history yet"""
+        if self._bloom is None:
+            return list(items)
+        self._refresh_if_stale()
+
+        now = time.monotonic()
+        new = []
+        maybe = []
+        with self._lock:
+            for item in items:
+                key = media_key(*item)
+                if key not in self._bloom:
+                    new.append(item)
+                elif now - self._pending.get(key, -PENDING_TTL) < PENDING_TTL:
+                    metrics.inc('membership.pending_hits')
+                else:
+                    maybe.append(item)
+        metrics.inc('membership.negatives', len(new))
+
+        if maybe:
+            confirmed = self._in_history(maybe)
+            metrics.inc('membership.confirmed', len(confirmed))
+            metrics.inc('membership.false_positives', len(maybe) - len(confirmed))
+            new.extend(item for item in maybe if item not in confirmed)
+        return new
+
+    def _in_history(self, items):
+        """Which of the items really are in the history table (one query per batch)"""
+        found = set()
+        for start in range(0, len(items), CONFIRM_BATCH):
+            conditions = [and_(VideoDownload.source == source, VideoDownload.video_id == video_id,
+                               VideoDownload.format_type == format_type)
+                          for source, video_id, format_type in items[start:start + CONFIRM_BATCH]]
+            rows = db.session.execute(
+                select(VideoDownload.source, VideoDownload.video_id, VideoDownload.format_type)
+                .where(or_(*conditions), VideoDownload.clip_end.is_(None))
+            ).all()
+            found.update(tuple(row) for row in rows)
+        return found
+
+    def _load(self, after_id):
+        """Read the keys of history rows with id > after_id; returns (keys, last id)"""
+        keys = []
+        last_id = after_id
+        rows = db.session.execute(
+            select(VideoDownload.id, VideoDownload.source, VideoDownload.video_id, VideoDownload.format_type,
+                   VideoDownload.clip_end)
+            .where(VideoDownload.id > after_id)
+            .order_by(VideoDownload.id)
+            .execution_options(yield_per=LOAD_BATCH)
+        )
+        for row_id, source, video_id, format_type, clip_end in rows:
+            last_id = row_id
+            if video_id and video_id != 'unknown' and clip_end is None:
+                keys.append(media_key(source, video_id, format_type))
+        return keys, last_id
+
+    def _rebuild(self):
+        """Build a new filter with room for twice the current history"""
+        count = db.session.query(VideoDownload).count()
+        bloom = BloomFilter(max(self.min_capacity, count * 2), self.error_rate)
+        keys, last_id = self._load(0)
+        db.session.rollback()
+        for key in keys:
+            bloom.add(key)
+        with self._lock:
+            # Keys added while the new filter was being built
+            for key in self._pending:
+                bloom.add(key)
+            self._bloom = bloom
+            self._count = len(keys) + len(self._pending)
+            self._last_id = last_id
+            self._refreshed_at = time.monotonic()
+        metrics.inc('membership.rebuilds')
+        metrics.set_gauge('membership.items', self._count)
+        metrics.set_gauge('membership.filter_bytes', len(bloom.bits))
+
+    def _refresh_if_stale(self):
+        """Catch up with rows other workers wrote since the last refresh"""
+        with self._lock:
+            if time.monotonic() - self._refreshed_at < self.refresh_interval:
+                return
+            self._refreshed_at = time.monotonic()
+            last_id = self._last_id
+            cutoff = time.monotonic() - PENDING_TTL
+            self._pending = {key: added for key, added in self._pending.items() if added > cutoff}
+
+        try:
+            keys, new_last_id = self._load(max(0, last_id - REFRESH_OVERLAP))
+        except Exception as e:
+            logger.error("Error refreshing membership index: %s: %s", type(e).__name__, e)
+            return
+        with self._lock:
+            added = sum(key not in self._bloom for key in keys)
+            for key in keys:
+                self._bloom.add(key)
+            self._count += added
+            self._last_id = max(self._last_id, new_last_id)
+            overfull = self._count > self._bloom.capacity
+        metrics.set_gauge('membership.items', self._count)
+        if overfull:
+            self._rebuild()
+
+
+membership_index = MembershipIndex()
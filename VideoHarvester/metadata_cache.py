@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import tempfile
+import threading
+from flask import current_app
+import requests
+import yt_dlp
+
+import metrics
+from media_info import MediaInfo
+from source_limits import source_limiter
+
+logger = logging.getLogger(__name__)
+
+# Metadata-only extraction: no download, no format selection, and on YouTube no
+# DASH/HLS manifests or machine-translated caption tracks
+EXTRACT_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    'noplaylist': True,
+    'extractor_args': {'youtube': {'skip': ['dash', 'hls', 'translated_subs']}},
+}
+
+# References to other pages (short links, embeds) followed before giving up
+MAX_REDIRECTS = 3
+
+# Refuse caption files larger than this from the origin
+MAX_CAPTION_BYTES = 5 * 1024 * 1024
+
+# Caption formats tried, in order, when the requested one is not offered
+CAPTION_FORMATS = ('vtt', 'srt', 'ttml', 'srv3', 'json3')
+
+# Each process trims the cache after writing this share of METADATA_CACHE_MAX_BYTES, not on every write
+EVICT_SLICE = 0.02
+
+CAPTION_MIMETYPES = {
+    'vtt': 'text/vtt',
+    'srt': 'application/x-subrip',
+    'ttml': 'application/ttml+xml',
+    'srv3': 'application/xml',
+    'json3': 'application/json',
+}
+
+
+_written = 0
+_evict_lock = threading.Lock()
+
+
+class MetadataUnavailable(Exception):
+    """The URL does not resolve to a single media item"""
+
+
+def _cache_dir():
+    path = current_app.config.get('METADATA_CACHE_DIR') or os.path.join(
+        tempfile.gettempdir(), 'videoharvester-metadata')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _write_atomic(path, data):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as output:
+        output.write(data)
+    os.replace(temp_path, path)
+
+
+def _read_fresh(path):
+    """Contents of a cache file younger than METADATA_CACHE_TTL, or None"""
+    try:
+        if time.time() - os.path.getmtime(path) > current_app.config.get('METADATA_CACHE_TTL', 3600):
+            return None
+        with open(path, 'rb') as cached:
+            return cached.read()
+    except OSError:
+        return None
+
+
+def _read_metadata(directory, key):
+    """A fresh cached metadata record; only valid while its track URLs are still cached too"""
+    if not os.path.exists(os.path.join(directory, f"{key}.tracks")):
+        return None
+    return _read_fresh(os.path.join(directory, f"{key}.json"))
+
+
+def cache_key(source, video_id, url):
+    identity = video_id if video_id and video_id != 'unknown' else url
+    return hashlib.sha1(f"{source}:{identity}".encode('utf-8')).hexdigest()[:20]
+
+
+def _tracks(captions):
+    """lang -> ext -> URL for the caption tracks of one kind"""
+    return {lang: {track['ext']: track['url'] for track in tracks if track.get('ext') and track.get('url')}
+            for lang, tracks in (captions or {}).items() if lang != 'live_chat'}
+
+
+def store(key, info):
+    """Cache an info dict as a MediaInfo plus its caption track URLs; returns the MediaInfo.
+
+    /video_info and /audio_info pass their full extractions here, so
+    /metadata and /subtitles can answer from them.
+    """
+    media = MediaInfo.from_info(info)
+    tracks = {'subtitles': _tracks(info.get('subtitles')),
+              'automatic_captions': _tracks(info.get('automatic_captions'))}
+    try:
+        directory = _cache_dir()
+        # Tracks first: a fresh metadata file promises fresh track URLs
+        tracks_data = json.dumps(tracks).encode('utf-8')
+        media_data = json.dumps(media.to_dict()).encode('utf-8')
+        _write_atomic(os.path.join(directory, f"{key}.tracks"), tracks_data)
+        _write_atomic(os.path.join(directory, f"{key}.json"), media_data)
+        _evict(directory, len(tracks_data) + len(media_data))
+    except OSError as e:
+        logger.error("Error writing metadata cache: %s", e)
+    return media
+
+
+def _extract(url, source):
+    """Run the extractor alone, following references to other pages, without processing formats"""
+    with source_limiter.guard(source), yt_dlp.YoutubeDL(EXTRACT_OPTIONS) as ydl:
+        info = ydl.extract_info(url, download=False, process=False)
+        for _ in range(MAX_REDIRECTS):
+            if not info or info.get('_type') not in ('url', 'url_transparent'):
+                break
+            outer = info
+            info = ydl.extract_info(outer['url'], download=False, process=False, ie_key=outer.get('ie_key'))
+            if info and outer.get('_type') == 'url_transparent':
+                # The embedding page may know better titles or durations than the embedded player
+                info = dict(info, **{name: value for name, value in outer.items()
+                                     if value is not None and name not in ('_type', 'url', 'ie_key', 'id')})
+    if not info or info.get('_type', 'video') != 'video':
+        raise MetadataUnavailable('This URL is not a single video.')
+    return info
+
+
+def lookup(source, video_id, url):
+    """Return (MediaInfo, cached) for a media URL, extracting it on a miss.
+
+    Concurrent misses for the same media wait on a file lock and share one
+    extraction. Raises what the extractor raises, plus MetadataUnavailable.
+    """
+    key = cache_key(source, video_id, url)
+    directory = _cache_dir()
+    cached = _read_metadata(directory, key)
+    if cached is not None:
+        metrics.inc('metadata_cache.hits', source=source)
+        return MediaInfo.from_dict(json.loads(cached)), True
+
+    with open(os.path.join(directory, f"{key}.lock"), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        cached = _read_metadata(directory, key)
+        if cached is not None:
+            metrics.inc('metadata_cache.hits', source=source)
+            return MediaInfo.from_dict(json.loads(cached)), True
+
+        metrics.inc('metadata_cache.misses', source=source)
+        started = time.perf_counter()
+        info = _extract(url, source)
+        metrics.observe('metadata_cache.extract_seconds', time.perf_counter() - started, source=source)
+        return store(key, info), False
+
+
+def pick_track(source, video_id, url, lang, ext, automatic=True):
+    """Return (URL, ext, automatic) of the best caption track for lang, or None if there is none.
+
+    Uploaded subtitles win over automatic captions. The requested format is
+    used when offered, otherwise the first of CAPTION_FORMATS that is.
+    """
+    lookup(source, video_id, url)
+    try:
+        with open(os.path.join(_cache_dir(), f"{cache_key(source, video_id, url)}.tracks"), encoding='utf-8') as f:
+            tracks = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    kinds = ('subtitles', 'automatic_captions') if automatic else ('subtitles',)
+    for kind in kinds:
+        formats = tracks[kind].get(lang)
+        if not formats:
+            continue
+        for candidate in (ext,) + CAPTION_FORMATS:
+            if candidate in formats:
+                return formats[candidate], candidate, kind == 'automatic_captions'
+        chosen = next(iter(formats))
+        return formats[chosen], chosen, kind == 'automatic_captions'
+    return None
+
+
+def caption(source, video_id, url, lang, ext, automatic=True):
+    """Return (body, ext, automatic) of a caption file, or None; bodies are cached alongside the metadata"""
+    track = pick_track(source, video_id, url, lang, ext, automatic)
+    if track is None:
+        return None
+    track_url, track_ext, is_automatic = track
+
+    directory = _cache_dir()
+    # Language codes come from the site; hash them rather than trust them in a file name
+    lang_hash = hashlib.sha1(lang.encode('utf-8')).hexdigest()[:8]
+    kind = 'auto' if is_automatic else 'subs'
+    path = os.path.join(directory, f"{cache_key(source, video_id, url)}.{kind}.{lang_hash}.{track_ext}")
+    body = _read_fresh(path)
+    if body is not None:
+        metrics.inc('metadata_cache.caption_hits', source=source)
+        return body, track_ext, is_automatic
+
+    metrics.inc('metadata_cache.caption_misses', source=source)
+    with source_limiter.guard(source):
+        response = requests.get(track_url, timeout=10, stream=True)
+        try:
+            response.raise_for_status()
+            body = response.raw.read(MAX_CAPTION_BYTES + 1, decode_content=True)
+        finally:
+            response.close()
+    if len(body) > MAX_CAPTION_BYTES:
+        raise ValueError(f"Caption file larger than {MAX_CAPTION_BYTES} bytes")
+    try:
+        _write_atomic(path, body)
+        _evict(directory, len(body))
+    except OSError as e:
+        logger.error("Error writing caption cache: %s", e)
+    return body, track_ext, is_automatic
+
+
+def _evict(directory, written):
+    """Count bytes written to the cache and trim it once this process has written a slice of the budget"""
+    global _written
+    max_bytes = current_app.config.get('METADATA_CACHE_MAX_BYTES', 100 * 1024 * 1024)
+    with _evict_lock:
+        _written += written
+        if _written < max_bytes * EVICT_SLICE:
+            return
+        _written = 0
+    _trim(directory, max_bytes)
+
+
+def _trim(directory, max_bytes):
+    """Trim the cache to max_bytes, least recently written media first.
+
+    A media item's files (metadata, track URLs, caption bodies and its lock
+    file) go together, and lock files left by failed extractions are
+    removed once they are older than the TTL.
+    """
+    ttl = current_app.config.get('METADATA_CACHE_TTL', 3600)
+    now = time.time()
+    groups = {}
+    total = 0
+    for name in os.listdir(directory):
+        if name.endswith('.tmp'):
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        group = groups.setdefault(name[:20], [0, 0, []])
+        group[0] = max(group[0], stat.st_mtime)
+        group[1] += stat.st_size
+        group[2].append(name)
+        total += stat.st_size
+
+    for key, (mtime, size, names) in sorted(groups.items(), key=lambda item: item[1][0]):
+        # A lone lock file may belong to an extraction in progress until it is that old
+        stale_lock = names == [f"{key}.lock"] and now - mtime > ttl
+        if not stale_lock and (total <= max_bytes or not size):
+            continue
+        for name in names:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+        total -= size
+        metrics.inc('metadata_cache.evictions')
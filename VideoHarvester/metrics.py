@@ -0,0 +1,82 @@
+import threading
+from collections import deque
+
+# Number of recent samples kept per timing series for percentile estimates
+SAMPLE_WINDOW = 1024
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_samples = {}
+
+
+def _key(name, labels):
+    """Build a flat series name like 'jobs.done{source=youtube}'"""
+    if not labels:
+        return name
+    label_str = ','.join(f"{k}={v}" for k, v in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+def inc(name, value=1, **labels):
+    """Increment a counter"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to the given value"""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name, value, **labels):
+    """Record a sample (a duration, a batch size, ...) for a distribution"""
+    key = _key(name, labels)
+    with _lock:
+        series = _samples.get(key)
+        if series is None:
+            series = _samples[key] = {'count': 0, 'sum': 0.0, 'recent': deque(maxlen=SAMPLE_WINDOW)}
+        series['count'] += 1
+        series['sum'] += value
+        series['recent'].append(value)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def recent(name, **labels):
+    """Return the recent samples of a distribution"""
+    key = _key(name, labels)
+    with _lock:
+        series = _samples.get(key)
+        return list(series['recent']) if series else []
+
+
+def snapshot():
+    """Return all metrics of this process as a JSON-serializable dict"""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        samples = {key: (s['count'], s['sum'], list(s['recent'])) for key, s in _samples.items()}
+
+    distributions = {}
+    for key, (count, total, values) in samples.items():
+        distributions[key] = {
+            'count': count,
+            'sum': round(total, 6),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'max': max(values) if values else None,
+        }
+
+    return {'counters': counters, 'gauges': gauges, 'distributions': distributions}
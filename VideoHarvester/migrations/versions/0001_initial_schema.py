@@ -0,0 +1,58 @@
+"""Initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 10:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created earlier by db.create_all() already have these tables
+    existing = sa.inspect(op.get_bind()).get_table_names()
+
+    if 'video_download' not in existing:
+        op.create_table(
+            'video_download',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('video_id', sa.String(length=50), nullable=False),
+            sa.Column('title', sa.String(length=255), nullable=False),
+            sa.Column('url', sa.String(length=500), nullable=False),
+            sa.Column('source', sa.String(length=50), nullable=True),
+            sa.Column('resolution', sa.String(length=20), nullable=True),
+            sa.Column('file_size', sa.Float(), nullable=True),
+            sa.Column('format_type', sa.String(length=20), nullable=True),
+            sa.Column('download_date', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if 'scheduled_download' not in existing:
+        op.create_table(
+            'scheduled_download',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('video_id', sa.String(length=50), nullable=False),
+            sa.Column('title', sa.String(length=255), nullable=True),
+            sa.Column('url', sa.String(length=500), nullable=False),
+            sa.Column('source', sa.String(length=50), nullable=True),
+            sa.Column('format_id', sa.String(length=20), nullable=True),
+            sa.Column('format_type', sa.String(length=20), nullable=True),
+            sa.Column('scheduled_time', sa.DateTime(), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('completed_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('scheduled_download')
+    op.drop_table('video_download')
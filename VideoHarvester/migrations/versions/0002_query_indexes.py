@@ -0,0 +1,41 @@
+"""Indexes for history, scheduler and lookup queries
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 10:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # /history: ORDER BY download_date DESC
+    op.create_index('ix_video_download_download_date', 'video_download', ['download_date'])
+    # Already-downloaded checks by (source, video_id, format_type)
+    op.create_index('ix_video_download_lookup', 'video_download', ['source', 'video_id', 'format_type'])
+    op.create_index('ix_video_download_url', 'video_download', ['url'])
+
+    # /scheduled: ORDER BY scheduled_time
+    op.create_index('ix_scheduled_download_scheduled_time', 'scheduled_download', ['scheduled_time'])
+    # Scheduler: status = 'pending' AND scheduled_time <= now, without indexing finished rows
+    op.create_index('ix_scheduled_download_pending', 'scheduled_download', ['scheduled_time'],
+                    postgresql_where=sa.text("status = 'pending'"),
+                    sqlite_where=sa.text("status = 'pending'"))
+    op.create_index('ix_scheduled_download_video_id', 'scheduled_download', ['video_id'])
+
+
+def downgrade():
+    op.drop_index('ix_scheduled_download_video_id', table_name='scheduled_download')
+    op.drop_index('ix_scheduled_download_pending', table_name='scheduled_download')
+    op.drop_index('ix_scheduled_download_scheduled_time', table_name='scheduled_download')
+    op.drop_index('ix_video_download_url', table_name='video_download')
+    op.drop_index('ix_video_download_lookup', table_name='video_download')
+    op.drop_index('ix_video_download_download_date', table_name='video_download')
@@ -0,0 +1,36 @@
+"""Per-table write counters for the response cache
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 11:20:00.000000
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_version = op.create_table(
+        'table_version',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('name')
+    )
+    now = datetime.utcnow()
+    op.bulk_insert(table_version, [
+        {'name': 'video_download', 'version': 1, 'updated_at': now},
+        {'name': 'scheduled_download', 'version': 1, 'updated_at': now},
+    ])
+
+
+def downgrade():
+    op.drop_table('table_version')
@@ -0,0 +1,48 @@
+"""Shared download job queue
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 11:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'download_job',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('kind', sa.String(length=10), nullable=False),
+        sa.Column('url', sa.String(length=500), nullable=False),
+        sa.Column('video_id', sa.String(length=50), nullable=True),
+        sa.Column('title', sa.String(length=255), nullable=True),
+        sa.Column('source', sa.String(length=50), nullable=True),
+        sa.Column('format_id', sa.String(length=50), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('node', sa.String(length=100), nullable=True),
+        sa.Column('node_url', sa.String(length=255), nullable=True),
+        sa.Column('file_path', sa.String(length=1000), nullable=True),
+        sa.Column('filename', sa.String(length=255), nullable=True),
+        sa.Column('file_size', sa.BigInteger(), nullable=True),
+        sa.Column('error', sa.String(length=500), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_download_job_queued', 'download_job', ['created_at'],
+                    postgresql_where=sa.text("status = 'queued'"),
+                    sqlite_where=sa.text("status = 'queued'"))
+
+
+def downgrade():
+    op.drop_index('ix_download_job_queued', table_name='download_job')
+    op.drop_table('download_job')
@@ -0,0 +1,26 @@
+"""Object storage key of offloaded job output
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 12:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.add_column(sa.Column('storage_key', sa.String(length=500), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.drop_column('storage_key')
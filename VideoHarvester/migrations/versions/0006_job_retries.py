@@ -0,0 +1,30 @@
+"""Retry bookkeeping for download jobs
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 12:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.add_column(sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('next_attempt_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('bytes_recovered', sa.BigInteger(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.drop_column('bytes_recovered')
+        batch_op.drop_column('next_attempt_at')
+        batch_op.drop_column('attempts')
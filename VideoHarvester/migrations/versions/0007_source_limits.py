@@ -0,0 +1,44 @@
+"""Per-source circuit breakers and concurrency leases
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 13:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'source_circuit',
+        sa.Column('source', sa.String(length=50), nullable=False),
+        sa.Column('state', sa.String(length=20), nullable=False),
+        sa.Column('failures', sa.Integer(), nullable=False),
+        sa.Column('opened_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('source')
+    )
+    op.create_table(
+        'source_lease',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('source', sa.String(length=50), nullable=False),
+        sa.Column('holder', sa.String(length=100), nullable=True),
+        sa.Column('acquired_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_source_lease_source', 'source_lease', ['source', 'expires_at'])
+
+
+def downgrade():
+    op.drop_index('ix_source_lease_source', table_name='source_lease')
+    op.drop_table('source_lease')
+    op.drop_table('source_circuit')
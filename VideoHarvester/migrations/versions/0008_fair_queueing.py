@@ -0,0 +1,42 @@
+"""Weighted fair queueing of download jobs by client
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19 13:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.add_column(sa.Column('client_id', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('fair_tag', sa.Float(), nullable=False, server_default='0'))
+
+    # Claims are now ordered by fair tag first
+    op.drop_index('ix_download_job_queued', table_name='download_job')
+    op.create_index('ix_download_job_queued', 'download_job', ['fair_tag', 'created_at'],
+                    postgresql_where=sa.text("status = 'queued'"),
+                    sqlite_where=sa.text("status = 'queued'"))
+    op.create_index('ix_download_job_client', 'download_job', ['client_id', 'status'])
+    op.create_index('ix_download_job_status', 'download_job', ['status'])
+
+
+def downgrade():
+    op.drop_index('ix_download_job_status', table_name='download_job')
+    op.drop_index('ix_download_job_client', table_name='download_job')
+    op.drop_index('ix_download_job_queued', table_name='download_job')
+    op.create_index('ix_download_job_queued', 'download_job', ['created_at'],
+                    postgresql_where=sa.text("status = 'queued'"),
+                    sqlite_where=sa.text("status = 'queued'"))
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.drop_column('fair_tag')
+        batch_op.drop_column('client_id')
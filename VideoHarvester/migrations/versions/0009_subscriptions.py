@@ -0,0 +1,55 @@
+"""Recurring channel subscriptions and their download archive
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19 14:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'subscription',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('url', sa.String(length=500), nullable=False),
+        sa.Column('source', sa.String(length=50), nullable=True),
+        sa.Column('title', sa.String(length=255), nullable=True),
+        sa.Column('format_type', sa.String(length=20), nullable=True),
+        sa.Column('format_id', sa.String(length=50), nullable=False),
+        sa.Column('cron', sa.String(length=100), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('last_seen_id', sa.String(length=100), nullable=True),
+        sa.Column('next_run_at', sa.DateTime(), nullable=False),
+        sa.Column('last_run_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.String(length=500), nullable=True),
+        sa.Column('items_queued', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_subscription_due', 'subscription', ['next_run_at'],
+                    postgresql_where=sa.text("status = 'active'"),
+                    sqlite_where=sa.text("status = 'active'"))
+    op.create_table(
+        'download_archive',
+        sa.Column('source', sa.String(length=50), nullable=False),
+        sa.Column('video_id', sa.String(length=100), nullable=False),
+        sa.Column('format_type', sa.String(length=20), nullable=False),
+        sa.Column('subscription_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('source', 'video_id', 'format_type')
+    )
+
+
+def downgrade():
+    op.drop_table('download_archive')
+    op.drop_index('ix_subscription_due', table_name='subscription')
+    op.drop_table('subscription')
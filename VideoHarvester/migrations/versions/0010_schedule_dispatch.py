@@ -0,0 +1,39 @@
+"""Rate-smoothed dispatch of scheduled downloads
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('scheduled_download') as batch_op:
+        batch_op.add_column(sa.Column('dispatch_slot', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('dispatch_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('dispatched_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('job_id', sa.String(length=36), nullable=True))
+
+    op.create_index('ix_scheduled_download_dispatch', 'scheduled_download', ['dispatch_at'],
+                    postgresql_where=sa.text("status = 'pending'"),
+                    sqlite_where=sa.text("status = 'pending'"))
+    op.create_index('ix_scheduled_download_slot', 'scheduled_download', ['dispatch_slot'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_scheduled_download_slot', table_name='scheduled_download')
+    op.drop_index('ix_scheduled_download_dispatch', table_name='scheduled_download')
+    with op.batch_alter_table('scheduled_download') as batch_op:
+        batch_op.drop_column('job_id')
+        batch_op.drop_column('dispatched_at')
+        batch_op.drop_column('dispatch_at')
+        batch_op.drop_column('dispatch_slot')
@@ -0,0 +1,36 @@
+"""Metadata prefetch for scheduled downloads
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-19 15:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('scheduled_download') as batch_op:
+        batch_op.add_column(sa.Column('prefetched_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('error', sa.String(length=500), nullable=True))
+        # Resolved selections such as '137+140' can exceed the old width
+        batch_op.alter_column('format_id', existing_type=sa.String(length=20), type_=sa.String(length=50))
+
+    op.create_index('ix_scheduled_download_prefetch', 'scheduled_download', ['scheduled_time'],
+                    postgresql_where=sa.text("status = 'pending' AND prefetched_at IS NULL"),
+                    sqlite_where=sa.text("status = 'pending' AND prefetched_at IS NULL"))
+
+
+def downgrade():
+    op.drop_index('ix_scheduled_download_prefetch', table_name='scheduled_download')
+    with op.batch_alter_table('scheduled_download') as batch_op:
+        batch_op.alter_column('format_id', existing_type=sa.String(length=50), type_=sa.String(length=20))
+        batch_op.drop_column('error')
+        batch_op.drop_column('prefetched_at')
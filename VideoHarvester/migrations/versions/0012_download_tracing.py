@@ -0,0 +1,40 @@
+"""Per-phase download timings
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0012'
+down_revision = '0011'
+branch_labels = None
+depends_on = None
+
+PHASE_COLUMNS = ('validate_ms', 'queue_ms', 'extract_ms', 'transfer_ms', 'postprocess_ms', 'commit_ms')
+
+
+def upgrade():
+    with op.batch_alter_table('video_download') as batch_op:
+        batch_op.add_column(sa.Column('trace_id', sa.String(length=32), nullable=True))
+        for name in PHASE_COLUMNS:
+            batch_op.add_column(sa.Column(name, sa.Integer(), nullable=True))
+
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.add_column(sa.Column('trace_id', sa.String(length=32), nullable=True))
+        batch_op.add_column(sa.Column('validate_ms', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.drop_column('validate_ms')
+        batch_op.drop_column('trace_id')
+
+    with op.batch_alter_table('video_download') as batch_op:
+        for name in reversed(PHASE_COLUMNS):
+            batch_op.drop_column(name)
+        batch_op.drop_column('trace_id')
@@ -0,0 +1,26 @@
+"""Checksums of finished files for ZIP bundles
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-19 16:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0013'
+down_revision = '0012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.add_column(sa.Column('crc32', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.drop_column('crc32')
@@ -0,0 +1,42 @@
+"""Time-range clip downloads
+
+Revision ID: 0014
+Revises: 0013
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0014'
+down_revision = '0013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.add_column(sa.Column('clip_start', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('clip_end', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('clip_precise', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('full_size', sa.BigInteger(), nullable=True))
+
+    with op.batch_alter_table('video_download') as batch_op:
+        batch_op.add_column(sa.Column('clip_start', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('clip_end', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('full_file_size', sa.Float(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('video_download') as batch_op:
+        batch_op.drop_column('full_file_size')
+        batch_op.drop_column('clip_end')
+        batch_op.drop_column('clip_start')
+
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.drop_column('full_size')
+        batch_op.drop_column('clip_precise')
+        batch_op.drop_column('clip_end')
+        batch_op.drop_column('clip_start')
@@ -0,0 +1,32 @@
+"""Leases on running download jobs
+
+Revision ID: 0015
+Revises: 0014
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0015'
+down_revision = '0014'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.add_column(sa.Column('lease_expires_at', sa.DateTime(), nullable=True))
+
+    # Nodes still on the previous release do not heartbeat; give their running jobs an hour to finish
+    op.execute(sa.text("UPDATE download_job SET lease_expires_at = :grace WHERE status = 'running'")
+               .bindparams(grace=datetime.utcnow() + timedelta(hours=1)))
+
+
+def downgrade():
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.drop_column('lease_expires_at')
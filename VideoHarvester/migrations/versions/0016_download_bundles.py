@@ -0,0 +1,41 @@
+"""Server-side ZIP bundles and retention of bundled files
+
+Revision ID: 0016
+Revises: 0015
+Create Date: 2026-10-19 18:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0016'
+down_revision = '0015'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'download_bundle',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('job_ids', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_download_bundle_expires_at', 'download_bundle', ['expires_at'])
+
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.add_column(sa.Column('keep_until', sa.DateTime(), nullable=True))
+    op.create_index('ix_download_job_keep_until', 'download_job', ['node', 'keep_until'])
+
+
+def downgrade():
+    op.drop_index('ix_download_job_keep_until', table_name='download_job')
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.drop_column('keep_until')
+
+    op.drop_index('ix_download_bundle_expires_at', table_name='download_bundle')
+    op.drop_table('download_bundle')
@@ -0,0 +1,28 @@
+"""Pipeline stage and worker process of running download jobs
+
+Revision ID: 0017
+Revises: 0016
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0017'
+down_revision = '0016'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.add_column(sa.Column('stage', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('runner', sa.String(length=150), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('download_job') as batch_op:
+        batch_op.drop_column('runner')
+        batch_op.drop_column('stage')
@@ -0,0 +1,39 @@
+"""Record successful metadata prefetches apart from their claims
+
+Revision ID: 0018
+Revises: 0017
+Create Date: 2026-10-19 19:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0018'
+down_revision = '0017'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('scheduled_download') as batch_op:
+        batch_op.add_column(sa.Column('resolved_at', sa.DateTime(), nullable=True))
+    # Claims and results were not told apart before; keep treating finished claims as prefetched
+    op.execute("UPDATE scheduled_download SET resolved_at = prefetched_at "
+               "WHERE prefetched_at IS NOT NULL AND error IS NULL")
+
+    # Claims can now be taken over, so the prefetch lookup covers every unresolved pending row
+    op.drop_index('ix_scheduled_download_prefetch', table_name='scheduled_download')
+    op.create_index('ix_scheduled_download_prefetch', 'scheduled_download', ['scheduled_time'],
+                    postgresql_where=sa.text("status = 'pending' AND resolved_at IS NULL AND error IS NULL"),
+                    sqlite_where=sa.text("status = 'pending' AND resolved_at IS NULL AND error IS NULL"))
+
+
+def downgrade():
+    op.drop_index('ix_scheduled_download_prefetch', table_name='scheduled_download')
+    op.create_index('ix_scheduled_download_prefetch', 'scheduled_download', ['scheduled_time'],
+                    postgresql_where=sa.text("status = 'pending' AND prefetched_at IS NULL"),
+                    sqlite_where=sa.text("status = 'pending' AND prefetched_at IS NULL"))
+    with op.batch_alter_table('scheduled_download') as batch_op:
+        batch_op.drop_column('resolved_at')
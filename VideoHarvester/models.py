@@ -1,8 +1,10 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 
-# Initialize database
-db = SQLAlchemy()
+from replica import RoutingSession
+
+# Initialize database; read-only queries may be routed to a replica bind
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class VideoDownload(db.Model):
     """Model to track video downloads"""
@@ -15,6 +17,24 @@ class VideoDownload(db.Model):
     file_size = db.Column(db.Float)  # Size in MB
     format_type = db.Column(db.String(20), default='video')  # video or audio
     download_date = db.Column(db.DateTime, default=datetime.utcnow)
+    # Per-phase timings of the job that produced the file, in milliseconds; spans share trace_id
+    trace_id = db.Column(db.String(32), nullable=True)
+    validate_ms = db.Column(db.Integer, nullable=True)
+    queue_ms = db.Column(db.Integer, nullable=True)
+    extract_ms = db.Column(db.Integer, nullable=True)
+    transfer_ms = db.Column(db.Integer, nullable=True)
+    postprocess_ms = db.Column(db.Integer, nullable=True)
+    commit_ms = db.Column(db.Integer, nullable=True)
+    clip_start = db.Column(db.Float, nullable=True)  # Seconds; set only for clip downloads
+    clip_end = db.Column(db.Float, nullable=True)
+    full_file_size = db.Column(db.Float, nullable=True)  # Size in MB of the whole format a clip was cut from
+
+    # Indexes are created by the migrations in migrations/versions
+    __table_args__ = (
+        db.Index('ix_video_download_download_date', 'download_date'),  # /history ordering
+        db.Index('ix_video_download_lookup', 'source', 'video_id', 'format_type'),  # already-downloaded checks
+        db.Index('ix_video_download_url', 'url'),
+    )
     
     def __repr__(self):
         return f'<VideoDownload {self.title}>'
@@ -30,6 +50,9 @@ class VideoDownload(db.Model):
             'resolution': self.resolution,
             'format_type': self.format_type,
             'file_size': self.file_size,
+            'clip_start': self.clip_start,
+            'clip_end': self.clip_end,
+            'full_file_size': self.full_file_size,
             'download_date': self.download_date.strftime("%Y-%m-%d %H:%M:%S")
         }
 
@@ -40,12 +63,35 @@ class ScheduledDownload(db.Model):
     title = db.Column(db.String(255))  # Optional until processed
     url = db.Column(db.String(500), nullable=False)
     source = db.Column(db.String(50), default='youtube')
-    format_id = db.Column(db.String(20))  # Format ID to download
+    format_id = db.Column(db.String(50))  # Format ID to download; resolved by the metadata prefetch
     format_type = db.Column(db.String(20), default='video')  # video or audio
     scheduled_time = db.Column(db.DateTime, nullable=False)
-    status = db.Column(db.String(20), default='pending')  # pending, completed, failed
+    status = db.Column(db.String(20), default='pending')  # pending, queued, completed, failed, cancelled, unavailable
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     completed_at = db.Column(db.DateTime, nullable=True)
+    prefetched_at = db.Column(db.DateTime, nullable=True)  # Metadata prefetch claimed at
+    resolved_at = db.Column(db.DateTime, nullable=True)  # Metadata prefetch succeeded at
+    error = db.Column(db.String(500), nullable=True)  # Why the prefetch failed or the item is unavailable
+    dispatch_slot = db.Column(db.BigInteger, nullable=True)  # Rate-limited dispatch slot, unique across nodes
+    dispatch_at = db.Column(db.DateTime, nullable=True)  # Jittered, rate-smoothed start time
+    dispatched_at = db.Column(db.DateTime, nullable=True)
+    job_id = db.Column(db.String(36), nullable=True)  # Download job queued for this schedule
+
+    __table_args__ = (
+        db.Index('ix_scheduled_download_scheduled_time', 'scheduled_time'),  # /scheduled ordering
+        # Scheduler lookups only ever touch pending rows, so keep that index small
+        db.Index('ix_scheduled_download_pending', 'scheduled_time',
+                 postgresql_where=db.text("status = 'pending'"),
+                 sqlite_where=db.text("status = 'pending'")),
+        db.Index('ix_scheduled_download_dispatch', 'dispatch_at',
+                 postgresql_where=db.text("status = 'pending'"),
+                 sqlite_where=db.text("status = 'pending'")),
+        db.Index('ix_scheduled_download_slot', 'dispatch_slot', unique=True),
+        db.Index('ix_scheduled_download_prefetch', 'scheduled_time',
+                 postgresql_where=db.text("status = 'pending' AND resolved_at IS NULL AND error IS NULL"),
+                 sqlite_where=db.text("status = 'pending' AND resolved_at IS NULL AND error IS NULL")),
+        db.Index('ix_scheduled_download_video_id', 'video_id'),
+    )
     
     def __repr__(self):
         return f'<ScheduledDownload {self.url}>'
@@ -63,5 +109,194 @@ class ScheduledDownload(db.Model):
             'scheduled_time': self.scheduled_time.strftime("%Y-%m-%d %H:%M:%S"),
             'status': self.status,
             'created_at': self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-            'completed_at': self.completed_at.strftime("%Y-%m-%d %H:%M:%S") if self.completed_at else None
-        }
\ No newline at end of file
+            'completed_at': self.completed_at.strftime("%Y-%m-%d %H:%M:%S") if self.completed_at else None,
+            'dispatched_at': self.dispatched_at.strftime("%Y-%m-%d %H:%M:%S") if self.dispatched_at else None,
+            'error': self.error
+        }
+
+class TableVersion(db.Model):
+    """Write counter per table, used to validate cached pages"""
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<TableVersion {self.name}={self.version}>'
+
+
+class DownloadJob(db.Model):
+    """Download queued for any node's workers; the node that ran it holds the file"""
+    # Job state is polled while it changes, so never read it from a lagging replica
+    __read_from_primary__ = True
+
+    id = db.Column(db.String(36), primary_key=True)
+    kind = db.Column(db.String(10), nullable=False, default='video')  # video or audio
+    url = db.Column(db.String(500), nullable=False)
+    video_id = db.Column(db.String(50))
+    title = db.Column(db.String(255))
+    source = db.Column(db.String(50), default='youtube')
+    format_id = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    node = db.Column(db.String(100))  # Node that claimed the job and holds its output
+    node_url = db.Column(db.String(255))  # Internal base URL of that node
+    file_path = db.Column(db.String(1000))
+    filename = db.Column(db.String(255))
+    file_size = db.Column(db.BigInteger)
+    storage_key = db.Column(db.String(500))  # Object key once offloaded to object storage
+    error = db.Column(db.String(500))
+    client_id = db.Column(db.String(64))  # API key hash, browser session or IP that asked for it
+    fair_tag = db.Column(db.Float, nullable=False, default=0.0)  # Weighted fair queueing order
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)  # Backoff: not claimable before this
+    bytes_recovered = db.Column(db.BigInteger, nullable=False, default=0)  # Partial data reused by retries
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)  # Running jobs: requeued unless the node heartbeats by then
+    stage = db.Column(db.String(20), nullable=True)  # Running jobs: transfer, postprocess or publish
+    runner = db.Column(db.String(150), nullable=True)  # Running jobs: node:pid:token of the worker process
+    finished_at = db.Column(db.DateTime, nullable=True)
+    trace_id = db.Column(db.String(32), nullable=True)  # Shared by the spans of the request and every attempt
+    validate_ms = db.Column(db.Integer, nullable=True)  # Time the queueing request spent before the enqueue
+    crc32 = db.Column(db.BigInteger, nullable=True)  # CRC-32 of the file, saved once a ZIP bundle has read it
+    clip_start = db.Column(db.Float, nullable=True)  # Clip downloads: only [clip_start, clip_end) seconds are fetched
+    clip_end = db.Column(db.Float, nullable=True)
+    clip_precise = db.Column(db.Boolean, nullable=True)  # Re-encode for exact cuts instead of cutting at keyframes
+    full_size = db.Column(db.BigInteger, nullable=True)  # Bytes of the whole format, for clips
+    keep_until = db.Column(db.DateTime, nullable=True)  # Local file kept for ZIP bundles until then, then removed
+
+    __table_args__ = (
+        # Workers claim the queued job with the lowest fair queueing tag
+        db.Index('ix_download_job_queued', 'fair_tag', 'created_at',
+                 postgresql_where=db.text("status = 'queued'"),
+                 sqlite_where=db.text("status = 'queued'")),
+        db.Index('ix_download_job_client', 'client_id', 'status'),  # Per-client caps and tags
+        db.Index('ix_download_job_status', 'status'),
+        db.Index('ix_download_job_keep_until', 'node', 'keep_until'),  # Each node's expired bundle files
+    )
+
+    def __repr__(self):
+        return f'<DownloadJob {self.id} {self.status}>'
+
+    def to_dict(self):
+        """Convert model to dictionary for API responses"""
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'title': self.title,
+            'status': self.status,
+            'stage': self.stage,
+            'filename': self.filename,
+            'error': self.error,
+            'file_size': self.file_size,
+            'clip_start': self.clip_start,
+            'clip_end': self.clip_end,
+            'full_size': self.full_size,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at.strftime("%Y-%m-%d %H:%M:%S") if self.next_attempt_at else None,
+            'created_at': self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            'finished_at': self.finished_at.strftime("%Y-%m-%d %H:%M:%S") if self.finished_at else None
+        }
+
+
+class SourceCircuit(db.Model):
+    """Circuit breaker state of one source platform, shared by all workers"""
+    source = db.Column(db.String(50), primary_key=True)
+    state = db.Column(db.String(20), nullable=False, default='closed')  # closed, open, half_open
+    failures = db.Column(db.Integer, nullable=False, default=0)  # Consecutive transient failures
+    opened_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SourceCircuit {self.source} {self.state}>'
+
+
+class SourceLease(db.Model):
+    """One in-flight request to a source platform, counted against its concurrency limit"""
+    id = db.Column(db.String(32), primary_key=True)
+    source = db.Column(db.String(50), nullable=False)
+    holder = db.Column(db.String(100))  # Node holding the lease
+    acquired_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)  # Leases of crashed workers lapse
+
+    __table_args__ = (
+        db.Index('ix_source_lease_source', 'source', 'expires_at'),
+    )
+
+    def __repr__(self):
+        return f'<SourceLease {self.source} {self.id}>'
+
+
+class Subscription(db.Model):
+    """Channel or playlist synced on a cron schedule; new entries are queued as downloads"""
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(500), nullable=False)
+    source = db.Column(db.String(50), default='youtube')
+    title = db.Column(db.String(255))  # Channel or playlist name, filled in by the first sync
+    format_type = db.Column(db.String(20), default='video')  # video or audio
+    format_id = db.Column(db.String(50), nullable=False)  # yt-dlp format selector for every entry
+    cron = db.Column(db.String(100), nullable=False)  # e.g. "0 * * * *" or "@hourly"
+    status = db.Column(db.String(20), nullable=False, default='active')  # active or cancelled
+    last_seen_id = db.Column(db.String(100))  # Newest entry seen by the last sync
+    next_run_at = db.Column(db.DateTime, nullable=False)
+    last_run_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.String(500))
+    items_queued = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # The sync loop only looks at active subscriptions that are due
+        db.Index('ix_subscription_due', 'next_run_at',
+                 postgresql_where=db.text("status = 'active'"),
+                 sqlite_where=db.text("status = 'active'")),
+    )
+
+    def __repr__(self):
+        return f'<Subscription {self.url}>'
+
+    def to_dict(self):
+        """Convert model to dictionary for API responses"""
+        return {
+            'id': self.id,
+            'url': self.url,
+            'source': self.source,
+            'title': self.title,
+            'format_type': self.format_type,
+            'format_id': self.format_id,
+            'cron': self.cron,
+            'status': self.status,
+            'next_run_at': self.next_run_at.strftime("%Y-%m-%d %H:%M:%S"),
+            'last_run_at': self.last_run_at.strftime("%Y-%m-%d %H:%M:%S") if self.last_run_at else None,
+            'last_error': self.last_error,
+            'items_queued': self.items_queued,
+            'created_at': self.created_at.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+
+class DownloadArchive(db.Model):
+    """Media already taken by a subscription sync, like yt-dlp's --download-archive"""
+    source = db.Column(db.String(50), primary_key=True)
+    video_id = db.Column(db.String(100), primary_key=True)
+    format_type = db.Column(db.String(20), primary_key=True)
+    subscription_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<DownloadArchive {self.source}:{self.video_id}>'
+
+
+class DownloadBundle(db.Model):
+    """Finished downloads grouped into one ZIP download; the browser session only holds its id"""
+    # Fetched right after it is created, possibly through another node
+    __read_from_primary__ = True
+
+    id = db.Column(db.String(36), primary_key=True)
+    job_ids = db.Column(db.JSON, nullable=False)  # Members in archive order
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_download_bundle_expires_at', 'expires_at'),
+    )
+
+    def __repr__(self):
+        return f'<DownloadBundle {self.id} {len(self.job_ids)} files>'
@@ -0,0 +1,120 @@
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class StageMeter:
+    """Busy time of one stage's workers, sampled into a utilization gauge"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._active = {}
+        self._busy_total = 0.0
+        self._last_sample = (time.perf_counter(), 0.0)
+        metrics.set_gauge('pipeline.workers', workers, stage=name)
+
+    @contextmanager
+    def working(self):
+        """Count the block as busy time of the calling worker"""
+        ident = threading.get_ident()
+        started = time.perf_counter()
+        with self._lock:
+            self._active[ident] = started
+            active = len(self._active)
+        metrics.set_gauge('pipeline.active', active, stage=self.name)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                del self._active[ident]
+                self._busy_total += elapsed
+                active = len(self._active)
+            metrics.set_gauge('pipeline.active', active, stage=self.name)
+            metrics.inc('pipeline.processed', stage=self.name)
+            metrics.observe('pipeline.service_seconds', elapsed, stage=self.name)
+
+    def busy_seconds(self):
+        """Busy time so far, including the running part of items still in progress"""
+        now = time.perf_counter()
+        with self._lock:
+            return self._busy_total + sum(now - started for started in self._active.values())
+
+    def sample(self):
+        """Set pipeline.utilization to the busy share of the workers since the last sample"""
+        now, busy = time.perf_counter(), self.busy_seconds()
+        last_time, last_busy = self._last_sample
+        self._last_sample = (now, busy)
+        if now > last_time and self.workers:
+            utilization = (busy - last_busy) / ((now - last_time) * self.workers)
+            metrics.set_gauge('pipeline.utilization', round(min(utilization, 1.0), 3), stage=self.name)
+
+
+class Stage(StageMeter):
+    """A bounded queue in front of a pool of worker threads that run handler(item) in an app context.
+
+    put() blocks while the queue is full, so a stage that falls behind
+    holds back the one feeding it instead of letting work pile up in
+    memory. The time from put() to a worker taking the item, blocking
+    included, is the stage's queue wait. If the handler raises,
+    on_error(item, error) runs so the item is not silently dropped.
+    """
+
+    def __init__(self, name, app, handler, workers, queue_size, on_error=None):
+        super().__init__(name, workers)
+        self.app = app
+        self.handler = handler
+        self.on_error = on_error
+        self._queue = queue.Queue(queue_size)
+
+    def start(self):
+        for index in range(self.workers):
+            threading.Thread(target=self._run, name=f"{self.name}-worker-{index}", daemon=True).start()
+
+    def put(self, item):
+        started = time.perf_counter()
+        self._queue.put((started, item))
+        blocked = time.perf_counter() - started
+        if blocked > 0.001:
+            metrics.inc('pipeline.put_blocked_seconds', blocked, stage=self.name)
+        metrics.set_gauge('pipeline.queue_depth', self._queue.qsize(), stage=self.name)
+
+    def _run(self):
+        while True:
+            queued_at, item = self._queue.get()
+            metrics.observe('pipeline.queue_wait_seconds', time.perf_counter() - queued_at, stage=self.name)
+            metrics.set_gauge('pipeline.queue_depth', self._queue.qsize(), stage=self.name)
+            try:
+                with self.app.app_context(), self.working():
+                    self.handler(item)
+            except Exception as e:
+                logger.error("Pipeline %s worker error: %s: %s", self.name, type(e).__name__, e)
+                metrics.inc('pipeline.errors', stage=self.name)
+                if self.on_error is not None:
+                    self._handle_error(item, e)
+
+    def _handle_error(self, item, error):
+        try:
+            with self.app.app_context():
+                self.on_error(item, error)
+        except Exception as e:
+            logger.error("Pipeline %s error handler failed: %s: %s", self.name, type(e).__name__, e)
+
+
+def start_monitor(meters, interval):
+    """Sample the utilization of each stage every interval seconds"""
+    def run():
+        while True:
+            time.sleep(interval)
+            for meter in meters:
+                meter.sample()
+
+    threading.Thread(target=run, name='pipeline-monitor', daemon=True).start()
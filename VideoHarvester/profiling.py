@@ -0,0 +1,189 @@
+import os
+import sys
+import glob
+import hmac
+import time
+import uuid
+import logging
+import tempfile
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from flask import g, jsonify, request, send_from_directory
+
+logger = logging.getLogger(__name__)
+
+# Query flag (or X-Profile header) that asks for a profile of the request it is on
+PROFILE_FLAG = '_profile'
+
+# Frames of the profiler and tracemalloc themselves are left out of their own output
+IGNORED_FILES = (__file__, tracemalloc.__file__, '<frozen importlib._bootstrap>',
+                 '<frozen importlib._bootstrap_external>', '<unknown>')
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """Samples one thread's stack at a fixed interval and counts the collapsed stacks"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def folded(self):
+        """Stacks in the collapsed format read by flamegraph.pl, speedscope and inferno"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _snapshot_stats(snapshot, key_type, limit, previous=None):
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, name) for name in IGNORED_FILES])
+    if previous is not None:
+        stats = snapshot.compare_to(previous, key_type)
+        return snapshot, [{'where': str(stat.traceback), 'size_kb': round(stat.size / 1024, 1),
+                           'size_diff_kb': round(stat.size_diff / 1024, 1), 'count': stat.count,
+                           'count_diff': stat.count_diff} for stat in stats[:limit]]
+    stats = snapshot.statistics(key_type)
+    return snapshot, [{'where': str(stat.traceback), 'size_kb': round(stat.size / 1024, 1), 'count': stat.count}
+                      for stat in stats[:limit]]
+
+
+def init_app(app):
+    """Admin-only request profiling and tracemalloc snapshots; nothing is registered without PROFILING_TOKEN"""
+    token = app.config.get('PROFILING_TOKEN')
+    if not token:
+        return
+    profile_dir = app.config.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'videoharvester-profiles')
+    interval = app.config.get('PROFILE_INTERVAL', 0.005)
+    keep = app.config.get('PROFILE_KEEP', 50)
+    frames = app.config.get('TRACEMALLOC_FRAMES', 25)
+    os.makedirs(profile_dir, exist_ok=True)
+    # This worker's last tracemalloc snapshot, the baseline of the next diff
+    state = {'snapshot': None}
+
+    def authorized():
+        return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+
+    def forbidden():
+        return jsonify({'error': 'Admin token required'}), 403
+
+    def worker():
+        return {'pid': os.getpid(), 'node': app.config.get('NODE_ID')}
+
+    @app.before_request
+    def start_profile():
+        """Profile this request if it carries the profile flag and the admin token"""
+        if request.headers.get('X-Profile') != '1' and request.args.get(PROFILE_FLAG) != '1':
+            return
+        if not authorized():
+            return forbidden()
+        g.profile_sampler = Sampler(threading.get_ident(), interval)
+        g.profile_sampler.start()
+
+    def finish_profile():
+        """Stop the sampler and write its stacks; returns the profile's file name"""
+        sampler = g.pop('profile_sampler', None)
+        if sampler is None:
+            return None
+        sampler.stop()
+        endpoint = (request.endpoint or 'unknown').replace('.', '_')
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{os.getpid()}-{endpoint}-{uuid.uuid4().hex[:6]}.folded"
+        with open(os.path.join(profile_dir, name), 'w', encoding='utf-8') as profile:
+            profile.write(sampler.folded())
+        for stale in sorted(glob.glob(os.path.join(profile_dir, '*.folded')), key=os.path.getmtime)[:-keep]:
+            os.remove(stale)
+        logger.info("Profiled %s: %s samples in %.3fs -> %s", request.path, sampler.samples, sampler.elapsed, name)
+        return name
+
+    @app.after_request
+    def attach_profile(response):
+        name = finish_profile()
+        if name:
+            # Streamed bodies are produced after this point and are not part of the profile
+            response.headers['X-Profile-Id'] = name
+        return response
+
+    @app.teardown_request
+    def abandon_profile(error=None):
+        # A view that raised skips after_request; keep its profile anyway
+        finish_profile()
+
+    @app.route('/admin/profiles')
+    def profiles():
+        """List the stored request profiles, newest first"""
+        if not authorized():
+            return forbidden()
+        paths = sorted(glob.glob(os.path.join(profile_dir, '*.folded')), key=os.path.getmtime, reverse=True)
+        return jsonify(dict(worker(), profiles=[{'id': os.path.basename(path), 'bytes': os.path.getsize(path)}
+                                                for path in paths]))
+
+    @app.route('/admin/profiles/<profile_id>')
+    def profile_file(profile_id):
+        """Download one profile as collapsed stacks"""
+        if not authorized():
+            return forbidden()
+        return send_from_directory(profile_dir, profile_id, mimetype='text/plain', as_attachment=True)
+
+    @app.route('/admin/tracemalloc/<action>', methods=['POST'])
+    def tracemalloc_control(action):
+        """Start or stop allocation tracing in the worker that serves the request"""
+        if not authorized():
+            return forbidden()
+        if action == 'start':
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(request.args.get('frames', frames, type=int))
+        elif action == 'stop':
+            tracemalloc.stop()
+            state['snapshot'] = None
+        else:
+            return jsonify({'error': "Use 'start' or 'stop'"}), 400
+        return jsonify(dict(worker(), tracing=tracemalloc.is_tracing()))
+
+    @app.route('/admin/tracemalloc/snapshot')
+    def tracemalloc_snapshot():
+        """Top allocation sites now; with ?diff=1, the change since this worker's last snapshot"""
+        if not authorized():
+            return forbidden()
+        if not tracemalloc.is_tracing():
+            return jsonify(dict(worker(), error='tracemalloc is not running; POST /admin/tracemalloc/start')), 409
+        key_type = request.args.get('group', 'lineno')
+        if key_type not in ('lineno', 'filename', 'traceback'):
+            return jsonify({'error': "group must be lineno, filename or traceback"}), 400
+        limit = request.args.get('limit', 25, type=int)
+        # The first snapshot of a worker has nothing to diff against and returns totals
+        previous = state['snapshot'] if request.args.get('diff') == '1' else None
+
+        started = time.perf_counter()
+        snapshot, stats = _snapshot_stats(tracemalloc.take_snapshot(), key_type, limit, previous)
+        state['snapshot'] = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        return jsonify(dict(worker(), stats=stats, diff=previous is not None,
+                            traced_kb=round(current / 1024, 1), peak_kb=round(peak / 1024, 1),
+                            snapshot_seconds=round(time.perf_counter() - started, 3)))
@@ -0,0 +1,127 @@
+import time
+import logging
+import threading
+import sqlalchemy as sa
+from flask import current_app, has_request_context, session
+from flask_sqlalchemy.session import Session
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bind key of the read replica in SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+# Flask session key holding the time of this client's last write
+LAST_WRITE_KEY = '_db_last_write'
+
+# Seconds the replica trails the primary; 0 when it has replayed everything it received
+LAG_QUERY = sa.text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+    "THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+def mark_write():
+    """Pin this client's reads to the primary for a while so it reads its own writes"""
+    if has_request_context():
+        session[LAST_WRITE_KEY] = time.time()
+
+
+class ReplicaMonitor:
+    """Cached view of replica health and lag, refreshed at most once per interval"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._lag = None
+
+    def lag(self, engine, interval):
+        """Return the replica lag in seconds, or None if the replica is unreachable"""
+        now = time.monotonic()
+        if now - self._checked_at < interval:
+            return self._lag
+
+        with self._lock:
+            if now - self._checked_at < interval:
+                return self._lag
+            try:
+                with engine.connect() as conn:
+                    if engine.dialect.name == 'postgresql':
+                        self._lag = float(conn.execute(LAG_QUERY).scalar() or 0)
+                    else:
+                        conn.execute(sa.text('SELECT 1'))
+                        self._lag = 0.0
+                metrics.set_gauge('db.replica_lag_seconds', self._lag)
+            except Exception as e:
+                logger.error("Replica health check failed: %s: %s", type(e).__name__, e)
+                metrics.inc('db.replica_check_errors')
+                self._lag = None
+            self._checked_at = time.monotonic()
+            return self._lag
+
+
+replica_monitor = ReplicaMonitor()
+
+
+class RoutingSession(Session):
+    """Session that sends read-only statements to the replica bind when it is safe.
+
+    Writes, flushes and anything inside a session that has already written go
+    to the primary. Reads fall back to the primary when no replica is
+    configured, the replica lags more than REPLICA_MAX_LAG, or the client
+    wrote within the last REPLICA_STICKY_SECONDS.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        primary = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None:
+            return primary
+
+        engines = self._db.engines
+        if REPLICA_BIND not in engines or primary is not engines.get(None):
+            return primary
+
+        if not self._is_read(clause) or self._primary_only(mapper):
+            return primary
+
+        replica = engines[REPLICA_BIND]
+        config = current_app.config
+        if self._pinned_to_primary(config.get('REPLICA_STICKY_SECONDS', 10.0)):
+            metrics.inc('db.reads', target='primary', reason='read_your_writes')
+            return primary
+
+        lag = replica_monitor.lag(replica, config.get('REPLICA_CHECK_INTERVAL', 5.0))
+        if lag is None or lag > config.get('REPLICA_MAX_LAG', 5.0):
+            metrics.inc('db.reads', target='primary', reason='replica_unavailable' if lag is None else 'replica_lag')
+            return primary
+
+        metrics.inc('db.reads', target='replica')
+        return replica
+
+    def _is_read(self, clause):
+        """Only plain SELECTs outside a flush, in a session with no pending writes"""
+        if self._flushing or self.info.get('wrote'):
+            return False
+        if self.new or self.dirty or self.deleted:
+            return False
+        return isinstance(clause, sa.Select) and not clause._for_update_arg
+
+    def _primary_only(self, mapper):
+        """Models whose rows change under the reader (job state) set __read_from_primary__"""
+        if mapper is None:
+            return False
+        return getattr(sa.inspect(mapper).class_, '__read_from_primary__', False)
+
+    def _pinned_to_primary(self, sticky_seconds):
+        if not has_request_context():
+            return False
+        last_write = session.get(LAST_WRITE_KEY)
+        return last_write is not None and time.time() - last_write < sticky_seconds
+
+
+@sa.event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(db_session, flush_context):
+    """Remember that this session (and this client) wrote something"""
+    db_session.info['wrote'] = True
+    mark_write()
@@ -0,0 +1,155 @@
+import os
+import hashlib
+import logging
+import tempfile
+from datetime import datetime, timezone
+from flask import current_app, request, make_response, Response
+from sqlalchemy import event, insert, select, update
+
+import metrics
+from models import db, TableVersion
+from replica import RoutingSession
+
+logger = logging.getLogger(__name__)
+
+# Tables whose writes invalidate cached pages
+CACHED_TABLES = ('video_download', 'scheduled_download')
+
+
+def bump_versions(conn, tables):
+    """Increment the write counter of each table inside the caller's transaction"""
+    now = datetime.utcnow()
+    version_table = TableVersion.__table__
+    for name in sorted(tables):
+        result = conn.execute(
+            update(version_table)
+            .where(version_table.c.name == name)
+            .values(version=version_table.c.version + 1, updated_at=now)
+        )
+        if result.rowcount == 0:
+            conn.execute(insert(version_table).values(name=name, version=1, updated_at=now))
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _bump_after_flush(db_session, flush_context):
+    """Bump the versions of cached tables touched by an ORM flush"""
+    touched = {
+        obj.__table__.name
+        for obj in list(db_session.new) + list(db_session.dirty) + list(db_session.deleted)
+        if getattr(obj, '__table__', None) is not None and obj.__table__.name in CACHED_TABLES
+    }
+    if touched:
+        bump_versions(db_session.connection(), touched)
+
+
+def _cache_dir():
+    path = current_app.config.get('RESPONSE_CACHE_DIR') or os.path.join(
+        tempfile.gettempdir(), 'videoharvester-pages')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as cached:
+            mimetype = cached.readline().decode('ascii').strip()
+            return mimetype, cached.read()
+    except OSError:
+        return None
+
+
+def _write(directory, key_hash, path, mimetype, body):
+    """Store a rendered body atomically, drop bodies of older versions and trim the cache"""
+    max_bytes = current_app.config.get('RESPONSE_CACHE_MAX_BYTES', 50 * 1024 * 1024)
+    entries = []
+    total = len(body)
+    for name in os.listdir(directory):
+        if name.endswith('.tmp'):
+            continue
+        entry = os.path.join(directory, name)
+        if name.startswith(key_hash + '-'):
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+            continue
+        try:
+            stat = os.stat(entry)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry))
+        total += stat.st_size
+
+    # Least recently written first; hits do not touch the file
+    entries.sort()
+    for _, size, entry in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(entry)
+            total -= size
+            metrics.inc('response_cache.evictions')
+        except OSError:
+            pass
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as cached:
+        cached.write(mimetype.encode('ascii') + b'\n')
+        cached.write(body)
+    os.replace(temp_path, path)
+
+
+def serve(tables, render, params=None):
+    """Serve a page rendered from the given tables, reusing cached output.
+
+    The cache key is the endpoint plus the query parameters the view reads,
+    given as a mapping of name to type in params; anything else in the
+    query string does not split the cache. The ETag adds the current write
+    counters of the tables, so any write to them produces a new ETag.
+    Bodies are stored on disk, shared by all workers and trimmed to
+    RESPONSE_CACHE_MAX_BYTES.
+    """
+    rows = db.session.execute(
+        select(TableVersion.name, TableVersion.version, TableVersion.updated_at)
+        .where(TableVersion.name.in_(tables))
+        .order_by(TableVersion.name)
+    ).all()
+    versions = ','.join(f"{name}:{version}" for name, version, _ in rows)
+    updated = [updated_at for _, _, updated_at in rows if updated_at]
+    last_modified = max(updated).replace(microsecond=0, tzinfo=timezone.utc) if updated else None
+
+    args = sorted((name, request.args.get(name, type=kind)) for name, kind in (params or {}).items())
+    key = f"{request.endpoint}?{args!r}"
+    key_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    etag = f"{key_hash}-{hashlib.sha1(versions.encode('utf-8')).hexdigest()[:16]}"
+
+    # Revalidation: nothing to render or read
+    if request.if_none_match.contains(etag) or (
+            not request.if_none_match and last_modified and request.if_modified_since
+            and last_modified <= request.if_modified_since):
+        metrics.inc('response_cache.not_modified', endpoint=request.endpoint)
+        response = Response(status=304)
+    else:
+        directory = _cache_dir()
+        path = os.path.join(directory, etag)
+        cached = _read(path)
+        if cached is not None:
+            metrics.inc('response_cache.hits', endpoint=request.endpoint)
+            mimetype, body = cached
+            response = Response(body, mimetype=mimetype)
+        else:
+            metrics.inc('response_cache.misses', endpoint=request.endpoint)
+            response = make_response(render())
+            if response.status_code != 200:
+                return response
+            try:
+                _write(directory, key_hash, path, response.mimetype, response.get_data())
+            except OSError as e:
+                logger.error("Error writing response cache: %s", e)
+
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # Always revalidate; unchanged pages cost a 304
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -1,24 +1,33 @@
 import os
+import time
 import logging
-import tempfile
 import uuid
 import re
 from urllib.parse import urlparse
-from datetime import datetime
-from flask import render_template, request, jsonify, send_file, session, redirect, url_for
+from datetime import datetime, timedelta
+from flask import render_template, request, jsonify, send_file, session, redirect, url_for, stream_with_context
+from werkzeug.wsgi import ClosingIterator
 import yt_dlp
 import requests
 
-from models import db, VideoDownload, ScheduledDownload
-from utils import detect_source, is_valid_url, extract_video_id, get_best_audio_format, sanitize_filename
+import metrics
+import bundles
+import metadata_cache
+import response_cache
+import thumbnails
+from models import db, VideoDownload, ScheduledDownload, DownloadJob, Subscription
+from admission import admission_controller
+from fair_queue import client_identity
+from jobs import job_runner, check_internal_token, content_type
+from replica import mark_write
+from subscriptions import subscription_runner
+from source_limits import source_limiter, SourceUnavailable
+from tracing import tracer
+from utils import (detect_source, is_valid_url, extract_video_id, get_best_audio_format, sanitize_filename,
+                   parse_timestamp)
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Directory for temporary storage of downloads
-TEMP_DIR = tempfile.gettempdir()
-
 def register_routes(app):
     @app.route('/')
     def index():
@@ -28,15 +37,43 @@ def register_routes(app):
     @app.route('/history')
     def history():
         """Show download history"""
-        downloads = VideoDownload.query.order_by(VideoDownload.download_date.desc()).all()
-        return render_template('history.html', downloads=downloads)
+        # Rows still in the write-behind buffer appear within HISTORY_FLUSH_INTERVAL
+        return response_cache.serve(('video_download',), lambda: render_template(
+            'history.html',
+            downloads=VideoDownload.query.order_by(VideoDownload.download_date.desc()).all()
+        ))
+
+    @app.route('/api/history')
+    def history_json():
+        """Download history as JSON"""
+        limit = request.args.get('limit', type=int)
+        return response_cache.serve(('video_download',), lambda: jsonify({
+            'downloads': [d.to_dict() for d in
+                          VideoDownload.query.order_by(VideoDownload.download_date.desc()).limit(limit).all()]
+        }), params={'limit': int})
         
     @app.route('/scheduled')
     def scheduled():
         """Show scheduled downloads"""
-        downloads = ScheduledDownload.query.order_by(ScheduledDownload.scheduled_time).all()
-        return render_template('scheduled.html', downloads=downloads)
+        return response_cache.serve(('scheduled_download',), lambda: render_template(
+            'scheduled.html',
+            downloads=ScheduledDownload.query.order_by(ScheduledDownload.scheduled_time).all()
+        ))
+
+    @app.route('/api/scheduled')
+    def scheduled_json():
+        """Scheduled downloads as JSON"""
+        limit = request.args.get('limit', type=int)
+        return response_cache.serve(('scheduled_download',), lambda: jsonify({
+            'downloads': [d.to_dict() for d in
+                          ScheduledDownload.query.order_by(ScheduledDownload.scheduled_time).limit(limit).all()]
+        }), params={'limit': int})
         
+    @app.route('/metrics')
+    def metrics_view():
+        """Expose this worker's metrics, plus the cluster-wide state of each source, as JSON"""
+        return jsonify(dict(metrics.snapshot(), sources=source_limiter.status()))
+
     @app.route('/cancel_schedule/<int:schedule_id>')
     def cancel_schedule(schedule_id):
         """Cancel a scheduled download"""
@@ -74,7 +111,7 @@ def register_routes(app):
             # Extract video ID for logging
             video_id = extract_video_id(video_url, source)
             if video_id:
-                logger.debug(f"Attempting to fetch audio for video ID: {video_id}")
+                logger.debug("Attempting to fetch audio for video ID: %s", video_id)
             
             # Set up yt-dlp options to extract audio information
             ydl_opts = {
@@ -89,55 +126,48 @@ def register_routes(app):
                 'dump_single_json': True
             }
             
-            # Use yt-dlp to extract audio information
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # Use yt-dlp to extract audio information, keeping only the fields used below
+            with source_limiter.guard(source), yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 info = ydl.extract_info(video_url, download=False)
+                media = None
+                if info:
+                    # /metadata and /subtitles can answer from this extraction
+                    media = metadata_cache.store(metadata_cache.cache_key(source, video_id, video_url), info)
+                del info
                 
-                if not info:
+                if not media:
                     return jsonify({'error': 'Could not retrieve audio information. The content might be unavailable.'}), 400
                     
                 # Extract essential information
-                title = info.get('title', 'Unknown Title')
-                author = info.get('uploader', 'Unknown Author')
-                duration = info.get('duration', 0)
-                thumbnail = info.get('thumbnail', '')
+                title = media.title or 'Unknown Title'
+                author = media.uploader or 'Unknown Author'
+                duration = media.duration or 0
+                thumbnail = media.thumbnail or ''
                 
                 # Generate formats list with audio options
                 stream_options = []
-                formats = info.get('formats', [])
                 
-                # Filter for audio formats
-                audio_formats = []
-                for fmt in formats:
-                    # Skip video-only formats
-                    if fmt.get('acodec') == 'none':
-                        continue
-                        
-                    # Skip formats without audio
-                    if not fmt.get('acodec'):
-                        continue
-                        
-                    audio_formats.append(fmt)
+                # Filter for audio formats (skipping video-only ones)
+                audio_formats = [fmt for fmt in media.formats if fmt.has_audio]
                 
                 # Get unique audio formats
                 seen_formats = set()
                 for fmt in audio_formats:
-                    format_id = fmt.get('format_id')
-                    acodec = fmt.get('acodec')
-                    ext = fmt.get('ext')
-                    abr = fmt.get('abr', 0)  # Audio bitrate
+                    format_id = fmt.format_id
+                    ext = fmt.ext or ''
+                    abr = fmt.abr  # Audio bitrate
                     
-                    format_key = f"{acodec}_{ext}"
+                    format_key = f"{fmt.acodec}_{ext}"
                     if format_key not in seen_formats and format_id:
                         seen_formats.add(format_key)
                         
                         # Get format description
-                        format_name = fmt.get('format_note', ext.upper())
+                        format_name = fmt.format_note or ext.upper()
                         if abr:
                             format_name = f"{format_name} ({int(abr)}kbps)"
                         
                         # Get filesize if available
-                        filesize = fmt.get('filesize')
+                        filesize = fmt.filesize
                         if filesize:
                             filesize_mb = round(filesize / (1024 * 1024), 2)
                             filesize_str = f"{filesize_mb} MB"
@@ -160,6 +190,10 @@ def register_routes(app):
                                        key=lambda x: x.get('format', '').lower(), 
                                        reverse=True)
                 
+                # Serve the thumbnail through the local resize cache
+                if thumbnail:
+                    thumbnail = url_for('thumbnail', media_key=thumbnails.register(source, video_id, thumbnail))
+                
                 # Generate a session ID for this download
                 download_id = str(uuid.uuid4())
                 session[download_id] = {
@@ -167,6 +201,7 @@ def register_routes(app):
                     'video_id': video_id if video_id else 'unknown',
                     'title': title,
                     'source': source,
+                    'duration': duration,
                     'is_audio': True
                 }
                 
@@ -180,137 +215,76 @@ def register_routes(app):
                     'download_id': download_id
                 })
         
+        except SourceUnavailable as e:
+            return _source_unavailable(e)
         except yt_dlp.utils.DownloadError as e:
-            logger.error(f"Download error: {str(e)}")
+            logger.error("Download error: %s", e)
             return jsonify({'error': 'This content is unavailable or restricted. Please try another URL.'}), 400
         except Exception as e:
-            logger.error(f"Error getting audio info: {type(e).__name__}: {str(e)}")
+            logger.error("Error getting audio info: %s: %s", type(e).__name__, e)
             return jsonify({'error': 'An unexpected error occurred while processing your request. Please try again later.'}), 500
     
     @app.route('/download_audio', methods=['POST'])
     def download_audio():
-        """Download the audio with the selected format"""
-        if not request.is_json:
-            return jsonify({'error': 'Invalid request format. JSON required.'}), 400
+        """Queue a download of the audio with the selected format"""
+        # The with block finishes the trace on every return, rejected requests included
+        with tracer.trace('POST /download_audio', kind='audio') as trace:
+            if not request.is_json:
+                return jsonify({'error': 'Invalid request format. JSON required.'}), 400
             
-        data = request.json
-        if not data:
-            return jsonify({'error': 'Invalid request data'}), 400
+            data = request.json
+            if not data:
+                return jsonify({'error': 'Invalid request data'}), 400
             
-        download_id = data.get('download_id')
-        format_id = data.get('itag')  # Using itag parameter for compatibility with frontend
+            download_id = data.get('download_id')
+            format_id = data.get('itag')  # Using itag parameter for compatibility with frontend
         
-        if not download_id or not format_id:
-            return jsonify({'error': 'Missing download ID or format ID'}), 400
+            if not download_id or not format_id:
+                return jsonify({'error': 'Missing download ID or format ID'}), 400
         
-        # Get the URL from the session
-        if download_id not in session:
-            return jsonify({'error': 'Invalid download session'}), 400
+            # Get the URL from the session
+            if download_id not in session:
+                return jsonify({'error': 'Invalid download session'}), 400
         
-        video_url = session[download_id]['url']
-        video_title = session[download_id].get('title', 'Unknown Title')
-        video_id = session[download_id].get('video_id', 'unknown')
-        source = session[download_id].get('source', 'youtube')
+            download_info = session[download_id]
         
-        try:
-            # Create a unique filename with a timestamp to avoid collisions
-            timestamp = uuid.uuid4().hex[:8]
-            temp_dir = os.path.join(TEMP_DIR, timestamp)
-            os.makedirs(temp_dir, exist_ok=True)
-            
-            # Configure yt-dlp options for downloading audio
-            ydl_opts = {
-                'format': format_id,
-                'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-                'quiet': True,
-                'no_warnings': True,
-                'noplaylist': True,
-                'noprogress': False,
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }]
-            }
-            
-            # Download the audio with yt-dlp
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Extract info first
-                info = ydl.extract_info(video_url, download=False)
-                if not info:
-                    return jsonify({'error': 'Could not retrieve audio information for download'}), 400
-                    
-                # Get proper title
-                title = info.get('title', video_title)
-                
-                # Download
-                logger.debug(f"Downloading audio from: {video_url}")
-                ydl.download([video_url])
-                
-                # Find the downloaded file
-                downloaded_files = os.listdir(temp_dir)
-                if not downloaded_files:
-                    return jsonify({'error': 'Download failed. No file was created.'}), 500
-                
-                # Get the file path and extension
-                downloaded_file = os.path.join(temp_dir, downloaded_files[0])
-                _, ext = os.path.splitext(downloaded_file)
-                
-                # Create a better final filename
-                sanitized_title = sanitize_filename(title)
-                final_filename = f"{sanitized_title}_audio_{timestamp}{ext}"
-                final_path = os.path.join(TEMP_DIR, final_filename)
-                
-                # Move the file to the final location
-                os.rename(downloaded_file, final_path)
-                
-                # Verify the file exists and has a size
-                if not os.path.exists(final_path):
-                    return jsonify({'error': 'Download failed. The file was not created.'}), 500
-                    
-                # Get file size
-                file_size = os.path.getsize(final_path)
-                if file_size == 0:
-                    os.remove(final_path)  # Clean up empty file
-                    return jsonify({'error': 'Download failed. The file is empty.'}), 500
-                
-                # Store the file path and final filename in the session for download
-                session[download_id]['file_path'] = final_path
-                session[download_id]['filename'] = final_filename
-                
-                # Store in the database
-                file_size_mb = round(file_size / (1024 * 1024), 2)
-                
-                # Create new download record
-                video_download = VideoDownload()
-                video_download.video_id = video_id
-                video_download.title = title
-                video_download.url = video_url
-                video_download.source = source
-                video_download.format_type = 'audio'
-                video_download.file_size = file_size_mb
-                db.session.add(video_download)
-                db.session.commit()
-                
-                # Clean up temp directory
-                try:
-                    os.rmdir(temp_dir)
-                except:
-                    pass
-                
-                logger.debug(f"Audio download successful. File size: {file_size} bytes")
-                return jsonify({
-                    'success': True,
-                    'download_id': download_id,
-                    'filename': final_filename
-                })
+            # Optional clip: only the requested time range is fetched
+            try:
+                clip = _clip_fields(data, download_info)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         
-        except yt_dlp.utils.DownloadError as e:
-            logger.error(f"Download error: {str(e)}")
-            return jsonify({'error': 'This audio could not be downloaded. It may be unavailable or restricted.'}), 400
-        except Exception as e:
-            logger.error(f"Error downloading audio: {type(e).__name__}: {str(e)}")
-            return jsonify({'error': 'An unexpected error occurred during download. Please try again later.'}), 500
+            # Under overload shed low-priority work first, and everything past the hard limit
+            decision = admission_controller.check('low' if data.get('priority') == 'low' else 'normal')
+            if not decision.admitted:
+                return _overloaded(decision)
+        
+            trace.add('validate', trace.started, time.time_ns())
+            try:
+                # Downloads from a tripped source wait in the queue until its breaker closes
+                retry_after = source_limiter.retry_after(download_info.get('source', 'youtube'))
+                job = job_runner.enqueue(
+                    'audio',
+                    download_info['url'],
+                    format_id,
+                    video_id=download_info.get('video_id', 'unknown'),
+                    title=download_info.get('title', 'Unknown Title'),
+                    source=download_info.get('source', 'youtube'),
+                    client_id=client_identity(),
+                    next_attempt_at=datetime.utcnow() + timedelta(seconds=retry_after) if retry_after else None,
+                    trace_id=trace.trace_id,
+                    validate_ms=trace.millis('validate'),
+                    **clip
+                )
+            except Exception as e:
+                logger.error("Error queueing audio download: %s: %s", type(e).__name__, e)
+                return jsonify({'error': 'An unexpected error occurred during download. Please try again later.'}), 500
+        
+            # Remember the job so /job_status and /get_file can find it from any node
+            session[download_id] = dict(download_info, job_id=job.id)
+            trace.attributes['job_id'] = job.id
+        
+            return _queued_response(download_id, job, retry_after)
             
     @app.route('/schedule_download', methods=['POST'])
     def schedule_download():
@@ -367,12 +341,63 @@ def register_routes(app):
             })
                 
         except ValueError as e:
-            logger.error(f"Invalid date format: {str(e)}")
+            logger.error("Invalid date format: %s", e)
             return jsonify({'error': 'Invalid date format. Please use YYYY-MM-DDTHH:MM:SS format.'}), 400
         except Exception as e:
-            logger.error(f"Error scheduling download: {type(e).__name__}: {str(e)}")
+            logger.error("Error scheduling download: %s: %s", type(e).__name__, e)
             return jsonify({'error': 'An unexpected error occurred while scheduling the download.'}), 500
 
+    @app.route('/subscribe', methods=['POST'])
+    def subscribe():
+        """Subscribe to a channel or playlist; new uploads are downloaded on a cron schedule"""
+        if not request.is_json:
+            return jsonify({'error': 'Invalid request format. JSON required.'}), 400
+            
+        data = request.json
+        if not data:
+            return jsonify({'error': 'Invalid request data'}), 400
+            
+        url = data.get('url')
+        source = data.get('source', 'auto')
+        format_type = data.get('format_type', 'video')
+        cron = data.get('cron', '@hourly')
+        
+        if not url:
+            return jsonify({'error': 'Missing channel or playlist URL'}), 400
+        if not is_valid_url(url, source):
+            return jsonify({'error': 'Invalid URL for the selected source.'}), 400
+        if format_type not in ('video', 'audio'):
+            return jsonify({'error': 'format_type must be video or audio'}), 400
+        
+        # Auto-detect source if not specified
+        if source == 'auto':
+            source = detect_source(url)
+        
+        try:
+            subscription = subscription_runner.create(url, source, format_type, cron, data.get('format_id'))
+        except ValueError as e:
+            return jsonify({'error': f'Invalid schedule: {str(e)}'}), 400
+        except Exception as e:
+            logger.error("Error creating subscription: %s: %s", type(e).__name__, e)
+            return jsonify({'error': 'An unexpected error occurred while creating the subscription.'}), 500
+        
+        return jsonify({'success': True, 'subscription': subscription.to_dict()}), 201
+
+    @app.route('/api/subscriptions')
+    def subscriptions_json():
+        """Subscriptions as JSON"""
+        return jsonify({
+            'subscriptions': [s.to_dict() for s in Subscription.query.order_by(Subscription.created_at).all()]
+        })
+
+    @app.route('/cancel_subscription/<int:subscription_id>', methods=['POST'])
+    def cancel_subscription(subscription_id):
+        """Stop syncing a subscription; jobs it already queued still run"""
+        subscription = Subscription.query.get_or_404(subscription_id)
+        subscription.status = 'cancelled'
+        db.session.commit()
+        return jsonify({'success': True, 'subscription': subscription.to_dict()})
+
     @app.route('/video_info', methods=['POST'])
     def get_video_info():
         """Get video information based on the URL using yt-dlp"""
@@ -393,9 +418,9 @@ def register_routes(app):
         
         try:
             # Try to extract video ID directly for logging
-            video_id = extract_video_id(video_url)
+            video_id = extract_video_id(video_url, 'youtube')
             if video_id:
-                logger.debug(f"Attempting to fetch video with ID: {video_id}")
+                logger.debug("Attempting to fetch video with ID: %s", video_id)
             
             # Set up yt-dlp options to extract information only (no download)
             ydl_opts = {
@@ -408,45 +433,49 @@ def register_routes(app):
                 'noplaylist': True,     # Single video, not a playlist
             }
             
-            # Use yt-dlp to extract video information
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # Use yt-dlp to extract video information, keeping only the fields used below
+            with source_limiter.guard('youtube'), yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 info = ydl.extract_info(video_url, download=False)
+                media = None
+                if info:
+                    # /metadata and /subtitles can answer from this extraction
+                    media = metadata_cache.store(metadata_cache.cache_key('youtube', video_id, video_url), info)
+                del info
                 
-                if not info:
+                if not media:
                     return jsonify({'error': 'Could not retrieve video information. The video might be unavailable.'}), 400
                     
                 # Extract essential information
-                title = info.get('title', 'Unknown Title')
-                author = info.get('uploader', 'Unknown Author')
-                duration = info.get('duration', 0)
-                thumbnail = info.get('thumbnail', '')
+                title = media.title or 'Unknown Title'
+                author = media.uploader or 'Unknown Author'
+                duration = media.duration or 0
+                thumbnail = media.thumbnail or ''
                 
                 # Check if we have valid data
                 if not all([title, author, duration, thumbnail]):
-                    logger.warning(f"Incomplete video info: title={title}, author={author}, duration={duration}")
+                    logger.warning("Incomplete video info: title=%s, author=%s, duration=%s", title, author, duration)
                     # Continue anyway as we might have some formats
                 
                 # Generate formats list with quality options
                 stream_options = []
-                formats = info.get('formats', [])
                 
                 # Filter for mp4 formats with both video and audio
-                for format_info in formats:
+                for format_info in media.formats:
                     # Skip formats without video
-                    if not format_info.get('height') or format_info.get('vcodec') == 'none':
+                    if not format_info.has_video:
                         continue
                         
                     # Skip audio-only formats
-                    if format_info.get('acodec') == 'none':
+                    if format_info.acodec == 'none':
                         continue
                         
                     # Skip non-mp4 formats for simplicity (we can expand later)
-                    if format_info.get('ext') != 'mp4':
+                    if format_info.ext != 'mp4':
                         continue
                         
-                    format_id = format_info.get('format_id')
-                    height = format_info.get('height')
-                    filesize = format_info.get('filesize')
+                    format_id = format_info.format_id
+                    height = format_info.height
+                    filesize = format_info.filesize
                     
                     # Only add formats with all required information
                     if format_id and height:
@@ -474,13 +503,18 @@ def register_routes(app):
                                        key=lambda x: int(x['resolution'].replace('p', '')) if x['resolution'].replace('p', '').isdigit() else 0, 
                                        reverse=True)
                 
+                # Serve the thumbnail through the local resize cache
+                if thumbnail:
+                    thumbnail = url_for('thumbnail', media_key=thumbnails.register('youtube', video_id, thumbnail))
+                
                 # Generate a session ID for this download
                 download_id = str(uuid.uuid4())
                 session[download_id] = {
                     'url': video_url,
                     'video_id': video_id if video_id else 'unknown',
                     'title': title,
-                    'author': author
+                    'author': author,
+                    'duration': duration
                 }
                 
                 return jsonify({
@@ -493,127 +527,185 @@ def register_routes(app):
                     'download_id': download_id
                 })
         
+        except SourceUnavailable as e:
+            return _source_unavailable(e)
         except yt_dlp.utils.DownloadError as e:
-            logger.error(f"Download error: {str(e)}")
+            logger.error("Download error: %s", e)
             return jsonify({'error': 'This video is unavailable or restricted. Please try another video.'}), 400
         except yt_dlp.utils.ExtractorError as e:
-            logger.error(f"Extractor error: {str(e)}")
+            logger.error("Extractor error: %s", e)
             return jsonify({'error': 'Could not extract video information. The video might be unavailable.'}), 400
         except requests.RequestException as e:
-            logger.error(f"Request error: {str(e)}")
+            logger.error("Request error: %s", e)
             return jsonify({'error': 'Network error when connecting to YouTube. Please check your connection and try again.'}), 500
         except Exception as e:
-            logger.error(f"Error getting video info: {type(e).__name__}: {str(e)}")
+            logger.error("Error getting video info: %s: %s", type(e).__name__, e)
+            return jsonify({'error': 'An unexpected error occurred while processing your request. Please try again later.'}), 500
+
+    @app.route('/metadata', methods=['POST'])
+    def get_metadata():
+        """Title, duration, chapters and caption languages of a video, without resolving its formats"""
+        video_url, source, error = _media_request()
+        if error:
+            return error
+        
+        try:
+            media, cached = metadata_cache.lookup(source, extract_video_id(video_url, source), video_url)
+        except SourceUnavailable as e:
+            return _source_unavailable(e)
+        except metadata_cache.MetadataUnavailable as e:
+            return jsonify({'error': str(e)}), 400
+        except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as e:
+            logger.error("Metadata extraction error: %s", e)
+            return jsonify({'error': 'Could not retrieve video information. The video might be unavailable.'}), 400
+        except Exception as e:
+            logger.error("Error getting metadata: %s: %s", type(e).__name__, e)
+            return jsonify({'error': 'An unexpected error occurred while processing your request. Please try again later.'}), 500
+        
+        metadata = media.metadata()
+        if metadata['thumbnail']:
+            # Serve the thumbnail through the local resize cache
+            thumbnail = url_for('thumbnail', media_key=thumbnails.register(source, metadata['id'], metadata['thumbnail']))
+            metadata = dict(metadata, thumbnail=thumbnail)
+        return jsonify(dict(metadata, success=True, source=source, cached=cached))
+
+    @app.route('/subtitles', methods=['POST'])
+    def get_subtitles():
+        """Serve one caption track of a video (uploaded subtitles first, then automatic captions)"""
+        video_url, source, error = _media_request()
+        if error:
+            return error
+        
+        data = request.json
+        lang = data.get('lang') or 'en'
+        ext = data.get('format') or 'vtt'
+        automatic = data.get('automatic', True) is not False
+        video_id = extract_video_id(video_url, source)
+        
+        try:
+            caption = metadata_cache.caption(source, video_id, video_url, lang, ext, automatic)
+            if caption is None:
+                media, _ = metadata_cache.lookup(source, video_id, video_url)
+                return jsonify({
+                    'error': f"No captions in '{lang}' for this video.",
+                    'subtitles': media.subtitles,
+                    'automatic_captions': media.automatic_captions if automatic else []
+                }), 404
+        except SourceUnavailable as e:
+            return _source_unavailable(e)
+        except metadata_cache.MetadataUnavailable as e:
+            return jsonify({'error': str(e)}), 400
+        except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as e:
+            logger.error("Metadata extraction error: %s", e)
+            return jsonify({'error': 'Could not retrieve video information. The video might be unavailable.'}), 400
+        except (requests.RequestException, ValueError) as e:
+            logger.error("Error fetching captions: %s: %s", type(e).__name__, e)
+            return jsonify({'error': 'The captions could not be fetched from the video platform.'}), 502
+        except Exception as e:
+            logger.error("Error getting subtitles: %s: %s", type(e).__name__, e)
             return jsonify({'error': 'An unexpected error occurred while processing your request. Please try again later.'}), 500
+        
+        body, track_ext, is_automatic = caption
+        response = app.response_class(body, mimetype=metadata_cache.CAPTION_MIMETYPES.get(track_ext, 'text/plain'))
+        response.headers['Content-Language'] = lang
+        response.headers['X-Caption-Format'] = track_ext
+        response.headers['X-Caption-Automatic'] = '1' if is_automatic else '0'
+        return response
 
     @app.route('/download', methods=['POST'])
     def download_video():
-        """Download the video with the selected quality using yt-dlp"""
-        if not request.is_json:
-            return jsonify({'error': 'Invalid request format. JSON required.'}), 400
+        """Queue a download of the video with the selected quality"""
+        # The with block finishes the trace on every return, rejected requests included
+        with tracer.trace('POST /download', kind='video') as trace:
+            if not request.is_json:
+                return jsonify({'error': 'Invalid request format. JSON required.'}), 400
             
-        data = request.json
-        if not data:
-            return jsonify({'error': 'Invalid request data'}), 400
+            data = request.json
+            if not data:
+                return jsonify({'error': 'Invalid request data'}), 400
             
-        download_id = data.get('download_id')
-        format_id = data.get('itag')  # Using itag parameter for compatibility with frontend
+            download_id = data.get('download_id')
+            format_id = data.get('itag')  # Using itag parameter for compatibility with frontend
         
-        if not download_id or not format_id:
-            return jsonify({'error': 'Missing download ID or format ID'}), 400
+            if not download_id or not format_id:
+                return jsonify({'error': 'Missing download ID or format ID'}), 400
         
-        # Get the URL from the session
-        if download_id not in session:
-            return jsonify({'error': 'Invalid download session'}), 400
+            # Get the URL from the session
+            if download_id not in session:
+                return jsonify({'error': 'Invalid download session'}), 400
         
-        video_url = session[download_id]['url']
-        video_title = session[download_id].get('title', 'Unknown Title')
-        video_id = session[download_id].get('video_id', 'unknown')
+            download_info = session[download_id]
         
-        try:
-            # Create a unique filename with a timestamp to avoid collisions
-            timestamp = uuid.uuid4().hex[:8]
-            temp_filename = f"youtube_video_{timestamp}.mp4"
-            file_path = os.path.join(TEMP_DIR, temp_filename)
-            
-            logger.debug(f"Attempting to download video from URL: {video_url} with format ID: {format_id}")
-            
-            # Configure yt-dlp options for downloading
-            ydl_opts = {
-                'format': format_id,
-                'outtmpl': file_path,
-                'quiet': True,
-                'no_warnings': True,
-                'noplaylist': True,     # Single video, not a playlist
-                'noprogress': False     # Show progress
-            }
-            
-            # Download the video with yt-dlp
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Extract info first to get the title
-                info = ydl.extract_info(video_url, download=False)
-                if not info:
-                    return jsonify({'error': 'Could not retrieve video information for download'}), 400
-                    
-                # Get proper video title and create a better filename
-                title = info.get('title', video_title)
-                resolution = next((f"{fmt.get('height')}p" for fmt in info.get('formats', []) 
-                                  if fmt.get('format_id') == format_id and fmt.get('height')), "unknown")
-                
-                # Create a better final filename
-                sanitized_title = sanitize_filename(title)
-                final_filename = f"{sanitized_title}_{resolution}_{timestamp}.mp4"
-                
-                # Download the video
-                logger.debug(f"Downloading video to: {file_path}")
-                ydl.download([video_url])
-                
-                # Verify the file was downloaded successfully
-                if not os.path.exists(file_path):
-                    return jsonify({'error': 'Download failed. The file was not created.'}), 500
-                    
-                # Verify file size
-                file_size = os.path.getsize(file_path)
-                if file_size == 0:
-                    os.remove(file_path)  # Clean up empty file
-                    return jsonify({'error': 'Download failed. The file is empty.'}), 500
-                
-                # Store the file path and final filename in the session for download
-                session[download_id]['file_path'] = file_path
-                session[download_id]['filename'] = final_filename
-                
-                # Store in the database
-                file_size_mb = round(file_size / (1024 * 1024), 2)
-                video_download = VideoDownload(
-                    video_id=video_id,
-                    title=title,
-                    url=video_url,
-                    resolution=resolution,
-                    file_size=file_size_mb,
-                    download_date=datetime.utcnow()
+            # Optional clip: only the requested time range is fetched
+            try:
+                clip = _clip_fields(data, download_info)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        
+            # Under overload shed low-priority work first, and everything past the hard limit
+            decision = admission_controller.check('low' if data.get('priority') == 'low' else 'normal')
+            if not decision.admitted:
+                return _overloaded(decision)
+        
+            trace.add('validate', trace.started, time.time_ns())
+            try:
+                # Downloads from a tripped source wait in the queue until its breaker closes
+                retry_after = source_limiter.retry_after(download_info.get('source', 'youtube'))
+                job = job_runner.enqueue(
+                    'video',
+                    download_info['url'],
+                    format_id,
+                    video_id=download_info.get('video_id', 'unknown'),
+                    title=download_info.get('title'),
+                    source='youtube',
+                    client_id=client_identity(),
+                    next_attempt_at=datetime.utcnow() + timedelta(seconds=retry_after) if retry_after else None,
+                    trace_id=trace.trace_id,
+                    validate_ms=trace.millis('validate'),
+                    **clip
                 )
-                db.session.add(video_download)
-                db.session.commit()
-                
-                logger.debug(f"Download successful. File size: {file_size} bytes")
-                return jsonify({
-                    'success': True,
-                    'download_id': download_id,
-                    'filename': final_filename
-                })
+            except Exception as e:
+                logger.error("Error queueing video download: %s: %s", type(e).__name__, e)
+                return jsonify({'error': 'An unexpected error occurred during download. Please try again later.'}), 500
         
-        except yt_dlp.utils.DownloadError as e:
-            logger.error(f"Download error: {str(e)}")
-            return jsonify({'error': 'This video could not be downloaded. It may be unavailable or restricted.'}), 400
-        except yt_dlp.utils.ExtractorError as e:
-            logger.error(f"Extractor error: {str(e)}")
-            return jsonify({'error': 'Could not extract video information for download.'}), 400
-        except requests.RequestException as e:
-            logger.error(f"Request error: {str(e)}")
-            return jsonify({'error': 'Network error when connecting to YouTube. Please check your connection and try again.'}), 500
+            # Remember the job so /job_status and /get_file can find it from any node
+            session[download_id] = dict(download_info, job_id=job.id)
+            trace.attributes['job_id'] = job.id
+        
+            return _queued_response(download_id, job, retry_after)
+
+    @app.route('/job_status/<download_id>', methods=['GET'])
+    def job_status(download_id):
+        """Report the progress of a queued download"""
+        job = _session_job(download_id)
+        if job is None:
+            return jsonify({'error': 'Download session expired or invalid'}), 404
+        
+        if job.status == 'done':
+            # The history row is written behind; keep this client's next reads on the primary
+            mark_write()
+        
+        return jsonify(dict(job.to_dict(), download_id=download_id))
+
+    @app.route('/thumb/<media_key>', methods=['GET'])
+    def thumbnail(media_key):
+        """Serve a resized, locally cached copy of a media thumbnail"""
+        width = thumbnails.pick_width(request.args.get('w', type=int))
+        accept_webp = request.accept_mimetypes['image/webp'] > 0
+        
+        try:
+            variant = thumbnails.get_variant(media_key, width, accept_webp)
         except Exception as e:
-            logger.error(f"Error downloading video: {type(e).__name__}: {str(e)}")
-            return jsonify({'error': 'An unexpected error occurred during download. Please try again later.'}), 500
+            logger.error("Error fetching thumbnail %s: %s: %s", media_key, type(e).__name__, e)
+            return "Thumbnail unavailable", 502
+        
+        if not variant:
+            return "Thumbnail not found", 404
+        
+        path, mimetype = variant
+        response = send_file(path, mimetype=mimetype, max_age=thumbnails.MAX_AGE)
+        response.vary.add('Accept')
+        return response
 
     @app.route('/get_file/<download_id>', methods=['GET'])
     def get_file(download_id):
@@ -621,56 +713,210 @@ def register_routes(app):
         if download_id not in session:
             return "Download session expired or invalid", 400
         
-        file_info = session.get(download_id, {})
-        file_path = file_info.get('file_path')
-        filename = file_info.get('filename')
+        job = _session_job(download_id)
+        if job is None or job.status != 'done':
+            return "File not found", 404
+        
+        # Offloaded files are fetched straight from object storage
+        if job.storage_key and job_runner.storage:
+            return redirect(job_runner.storage.presigned_url(job.storage_key, job.filename, content_type(job)))
+        
+        if not job_runner.is_local(job):
+            try:
+                return job_runner.route_to_owner(job)
+            except requests.RequestException as e:
+                logger.error("Error fetching file from node %s: %s", job.node, e)
+                return "File is temporarily unavailable", 502
+        
+        return _serve_local_file(job)
+
+    @app.route('/internal/file/<job_id>', methods=['GET'])
+    def internal_file(job_id):
+        """Serve a file held by this node to another node of the cluster"""
+        token = request.headers.get('X-Internal-Token') or request.args.get('token')
+        if not check_internal_token(job_id, token):
+            return "Forbidden", 403
+        
+        job = db.session.get(DownloadJob, job_id)
+        if job is None or job.status != 'done' or not job_runner.is_local(job):
+            return "File not found", 404
+        
+        # Bundles read members by range and may come back for more, so they ask to keep the file
+        return _serve_local_file(job, keep=request.args.get('keep') == '1')
+
+    @app.route('/bundle', methods=['POST'])
+    def create_bundle():
+        """Group finished downloads of this session into one ZIP download"""
+        data = request.get_json(silent=True) or {}
+        download_ids = data.get('download_ids')
+        if not isinstance(download_ids, list) or not download_ids:
+            return jsonify({'error': 'Provide the download_ids to bundle'}), 400
+        if len(download_ids) > app.config.get('BUNDLE_MAX_FILES', 200):
+            return jsonify({'error': f"A bundle can hold at most {app.config.get('BUNDLE_MAX_FILES', 200)} files"}), 400
+        
+        job_ids = []
+        for download_id in dict.fromkeys(download_ids):
+            download_info = session.get(download_id) if isinstance(download_id, str) else None
+            if not isinstance(download_info, dict) or not download_info.get('job_id'):
+                return jsonify({'error': 'Download session expired or invalid'}), 404
+            job_ids.append(download_info['job_id'])
+        
+        # The job list lives in the database; the session only proves the bundle is this client's
+        bundle = bundles.create(job_ids, app.config.get('BUNDLE_TTL', 24 * 3600))
+        session[bundle.id] = {'bundle': True}
+        return jsonify({
+            'success': True,
+            'bundle_id': bundle.id,
+            'url': url_for('get_bundle', bundle_id=bundle.id),
+            'expires_at': bundle.expires_at.strftime("%Y-%m-%d %H:%M:%S")
+        }), 201
+
+    @app.route('/bundle/<bundle_id>', methods=['GET'])
+    def get_bundle(bundle_id):
+        """Stream the files of a bundle as one stored ZIP, without building it on disk"""
+        marker = session.get(bundle_id)
+        bundle = bundles.load(bundle_id) if isinstance(marker, dict) and marker.get('bundle') else None
+        if bundle is None:
+            return "Bundle expired or invalid", 400
+        
+        jobs = [db.session.get(DownloadJob, job_id) for job_id in bundle.job_ids]
+        if any(job is None or job.status != 'done' for job in jobs):
+            return "Some files of this bundle are not ready yet", 409
+        
+        try:
+            layout = bundles.layout_for(jobs)
+        except bundles.BundleError as e:
+            return str(e), 404
+        
+        etag = layout.etag()
+        start, stop, status = 0, layout.size, 200
+        # Single ranges only; a stale If-Range gets the whole archive
+        if request.range and (request.if_range.etag is None and request.if_range.date is None
+                              or request.if_range.etag == etag):
+            span = request.range.range_for_length(layout.size)
+            if span is not None:
+                (start, stop), status = span, 206
+            elif len(request.range.ranges) == 1:
+                response = app.response_class("Requested range not satisfiable", 416)
+                response.headers['Content-Range'] = f"bytes */{layout.size}"
+                return response
         
+        metrics.inc('bundles.requests', status=status)
+        response = app.response_class(stream_with_context(bundles.stream(layout, start, stop)),
+                                      status=status, mimetype='application/zip')
+        response.headers['Content-Length'] = str(stop - start)
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers['Content-Disposition'] = f"attachment; filename=bundle-{bundle_id[:8]}.zip"
+        response.set_etag(etag)
+        if status == 206:
+            response.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{layout.size}"
+        return response
+
+    def _finish_send(trace):
+        trace.add('send', trace.started, time.time_ns())
+        trace.finish()
+
+    def _source_unavailable(unavailable):
+        """Fail fast while a source is tripped or saturated, telling the client when to retry"""
+        if unavailable.reason == 'busy':
+            message = 'Too many requests to this platform right now. Please try again shortly.'
+        else:
+            message = 'The video platform is having trouble right now. Please try again shortly.'
+        response = jsonify({'error': message, 'retry_after': unavailable.retry_after})
+        response.headers['Retry-After'] = str(unavailable.retry_after)
+        return response, 503
+
+    def _overloaded(decision):
+        """Reject a download early, with a Retry-After estimated from the current load"""
+        response = jsonify({
+            'error': 'The server is busy right now. Please try again in a little while.',
+            'retry_after': decision.retry_after
+        })
+        response.headers['Retry-After'] = str(decision.retry_after)
+        return response, 503
+
+    def _queued_response(download_id, job, retry_after):
+        """202 for a queued job; Retry-After when its source's breaker holds it back"""
+        response = jsonify({
+            'success': True,
+            'download_id': download_id,
+            'status': job.status,
+            'retry_after': retry_after
+        })
+        if retry_after:
+            response.headers['Retry-After'] = str(retry_after)
+        return response, 202
+
+    def _media_request():
+        """(url, source, None) from a JSON body with url and optional source, or (None, None, error response)"""
+        data = request.get_json(silent=True) or {}
+        video_url = data.get('url', '')
+        source = data.get('source', 'auto')
+        if not video_url:
+            return None, None, (jsonify({'error': 'Missing video URL'}), 400)
+        if not is_valid_url(video_url, source):
+            return None, None, (jsonify({'error': 'Invalid URL for the selected source. Please provide a valid video URL.'}), 400)
+        if source == 'auto':
+            source = detect_source(video_url)
+        return video_url, source, None
+
+    def _clip_fields(data, download_info):
+        """Job fields for an optional start_time/end_time clip; ValueError says what is wrong with it"""
+        start_time, end_time = data.get('start_time'), data.get('end_time')
+        if start_time in (None, '') and end_time in (None, ''):
+            return {}
+        
+        duration = download_info.get('duration') or None
+        start = parse_timestamp(start_time) if start_time not in (None, '') else 0.0
+        if end_time not in (None, ''):
+            end = parse_timestamp(end_time)
+        elif duration:
+            end = float(duration)
+        else:
+            raise ValueError('end_time is required when the media length is unknown')
+        
+        if duration:
+            if start >= duration:
+                raise ValueError('start_time is past the end of the media')
+            end = min(end, float(duration))
+        if end <= start:
+            raise ValueError('end_time must be after start_time')
+        return {'clip_start': start, 'clip_end': end, 'clip_precise': bool(data.get('precise_cuts'))}
+
+    def _session_job(download_id):
+        """Look up the queued job behind a download session"""
+        job_id = session.get(download_id, {}).get('job_id')
+        return db.session.get(DownloadJob, job_id) if job_id else None
+
+    def _serve_local_file(job, keep=False):
+        file_path = job.file_path
+        # Files of live bundles stay until the bundle sweep removes them
+        keep = keep or (job.keep_until is not None and job.keep_until > datetime.utcnow())
         if not file_path or not os.path.exists(file_path):
             return "File not found", 404
         
+        # The send phase lasts until the last byte is written, after this view has returned
+        trace = tracer.start(f"GET {request.path}", job.trace_id, job_id=job.id, bytes=job.file_size)
         try:
-            return send_file(
+            response = send_file(
                 file_path,
                 as_attachment=True,
-                download_name=filename,
-                mimetype='video/mp4'
+                download_name=job.filename,
+                mimetype=content_type(job)
             )
+            # send_file hands the file straight to the server, which skips call_on_close callbacks
+            response.response = ClosingIterator(response.response, lambda: _finish_send(trace))
+            return response
         except Exception as e:
-            logger.error(f"Error serving file: {str(e)}")
+            logger.error("Error serving file: %s", e)
             return f"Error serving file: {str(e)}", 500
         finally:
             # Clean up the temp file after sending
             try:
-                if os.path.exists(file_path):
+                if not keep and os.path.exists(file_path):
                     os.remove(file_path)
             except Exception as e:
-                logger.error(f"Error removing temp file: {str(e)}")
-
-def extract_video_id(url):
-    """Extract the YouTube video ID from a URL"""
-    try:
-        # Check for youtu.be format
-        if 'youtu.be' in url:
-            return url.split('/')[-1].split('?')[0]
-        
-        # Check for youtube.com format
-        if 'youtube.com' in url:
-            parsed_url = urlparse(url)
-            query_params = parsed_url.query.split('&')
-            for param in query_params:
-                if param.startswith('v='):
-                    return param[2:]
-        
-        # Fallback to regex pattern for more complex URLs
-        pattern = r'(?:v=|\/)([0-9A-Za-z_-]{11}).*'
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
-        
-        return None
-    except Exception as e:
-        logger.error(f"Error extracting video ID: {str(e)}")
-        return None
+                logger.error("Error removing temp file: %s", e)
 
 def is_valid_youtube_url(url):
     """Validate if the URL is a YouTube URL"""
@@ -689,7 +935,7 @@ def is_valid_youtube_url(url):
             return True
         return False
     except Exception as e:
-        logger.error(f"Error validating URL: {str(e)}")
+        logger.error("Error validating URL: %s", e)
         return False
 
 def sanitize_filename(filename):
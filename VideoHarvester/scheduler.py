@@ -0,0 +1,331 @@
+import math
+import time
+import random
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+import yt_dlp
+
+import metrics
+from jobs import job_runner
+from downloader import is_retryable
+from media_info import MediaInfo
+from source_limits import source_limiter, SourceUnavailable
+from response_cache import bump_versions
+from models import db, ScheduledDownload, DownloadJob
+
+logger = logging.getLogger(__name__)
+
+# Scheduled times are naive local times, as entered in the schedule form
+EPOCH = datetime(1970, 1, 1)
+
+# Rows planned or dispatched per pass
+BATCH_SIZE = 500
+
+# A row marked queued without a job (its node died mid-dispatch) goes back to pending after this
+STALE_DISPATCH = timedelta(minutes=5)
+
+# Default yt-dlp format selectors when the schedule did not pick a format
+DEFAULT_FORMATS = {'video': 'best', 'audio': 'bestaudio'}
+
+# Rows prefetched per pass; each one is a full extraction
+PREFETCH_BATCH = 10
+
+# A prefetch claim not resolved by then (its node died mid-extraction) can be taken over
+STALE_PREFETCH = timedelta(minutes=5)
+
+# Resolve formats the way the download will, without downloading anything
+PREFETCH_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    'noplaylist': True,
+}
+
+
+class ScheduleDispatcher:
+    """Turns due ScheduledDownload rows into download jobs at a smoothed rate.
+
+    Rows are planned SCHEDULE_PLAN_AHEAD seconds before they are due. Each
+    row gets a random start within SCHEDULE_JITTER seconds after its
+    scheduled time, then takes the first free dispatch slot from there.
+    Slots are 1/SCHEDULE_DISPATCH_RATE seconds apart and are held in a
+    unique column, so the rate holds across every node without locks. A
+    row that would have to wait more than SCHEDULE_MAX_DELAY for a slot is
+    dispatched at that deadline anyway. Dispatch lag (dispatch time minus
+    scheduled time) is reported as scheduler.dispatch_lag_seconds.
+
+    SCHEDULE_PREFETCH_LEAD seconds ahead, a separate thread extracts each
+    row's metadata, pins the resolved format and marks removed or private
+    videos unavailable. Prefetched rows skip the jitter and start at their
+    scheduled time, since their extraction burst already happened.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._thread = None
+        self._prefetch_thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.rate = app.config.get('SCHEDULE_DISPATCH_RATE', 5.0)
+        self.jitter = app.config.get('SCHEDULE_JITTER', 30.0)
+        self.max_delay = app.config.get('SCHEDULE_MAX_DELAY', 300.0)
+        self.plan_ahead = app.config.get('SCHEDULE_PLAN_AHEAD', 60.0)
+        self.poll_interval = app.config.get('SCHEDULE_POLL_INTERVAL', 0.5)
+        self.prefetch_lead = app.config.get('SCHEDULE_PREFETCH_LEAD', 600.0)
+        self.prefetch_poll_interval = app.config.get('SCHEDULE_PREFETCH_POLL_INTERVAL', 5.0)
+        self._thread = threading.Thread(target=self._run, name='schedule-dispatcher', daemon=True)
+        self._thread.start()
+        self._prefetch_thread = threading.Thread(target=self._run_prefetch, name='schedule-prefetch', daemon=True)
+        self._prefetch_thread.start()
+
+    def slot_for(self, moment):
+        """Index of the first dispatch slot at or after the given time"""
+        return math.ceil((moment - EPOCH).total_seconds() * self.rate)
+
+    def slot_time(self, slot):
+        return EPOCH + timedelta(seconds=slot / self.rate)
+
+    def plan(self):
+        """Give upcoming rows a jittered dispatch time on a free slot; returns the number planned"""
+        now = datetime.now()
+        rows = db.session.execute(
+            select(ScheduledDownload)
+            .where(ScheduledDownload.status == 'pending',
+                   ScheduledDownload.dispatch_at.is_(None),
+                   ScheduledDownload.scheduled_time <= now + timedelta(seconds=self.plan_ahead))
+            .order_by(ScheduledDownload.scheduled_time)
+            .limit(BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not rows:
+            db.session.rollback()
+            return 0
+
+        # Slots already taken in the window this batch can use
+        first = self.slot_for(min(max(row.scheduled_time, now) for row in rows))
+        last = self.slot_for(max(max(row.scheduled_time, now) for row in rows)
+                             + timedelta(seconds=self.max_delay))
+        taken = set(db.session.execute(
+            select(ScheduledDownload.dispatch_slot)
+            .where(ScheduledDownload.dispatch_slot.between(first, last))
+        ).scalars())
+
+        for row in rows:
+            start = max(row.scheduled_time, now)
+            # Rows with their metadata in hand go at their exact time; the rest are spread out
+            jitter = 0.0 if row.resolved_at is not None else random.uniform(0, self.jitter)
+            wanted = self.slot_for(start + timedelta(seconds=jitter))
+            deadline = self.slot_for(start + timedelta(seconds=self.max_delay))
+            slot = next((candidate for candidate in range(wanted, deadline + 1) if candidate not in taken), None)
+            if slot is None:
+                # The rate cannot absorb this burst; bounded lateness wins over the rate
+                row.dispatch_at = self.slot_time(deadline)
+                metrics.inc('scheduler.overflow')
+            else:
+                taken.add(slot)
+                row.dispatch_slot = slot
+                row.dispatch_at = self.slot_time(slot)
+
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another node took one of these slots first; plan again on the next pass
+            db.session.rollback()
+            metrics.inc('scheduler.slot_conflicts')
+            return 0
+        metrics.inc('scheduler.planned', len(rows))
+        return len(rows)
+
+    def dispatch(self):
+        """Queue the rows whose dispatch time has come; returns the number dispatched"""
+        now = datetime.now()
+        due = db.session.execute(
+            select(ScheduledDownload.id)
+            .where(ScheduledDownload.status == 'pending', ScheduledDownload.dispatch_at <= now)
+            .order_by(ScheduledDownload.dispatch_at)
+            .limit(BATCH_SIZE)
+        ).scalars().all()
+
+        dispatched = 0
+        for schedule_id in due:
+            # Mark it first so that exactly one node queues the job
+            result = db.session.execute(
+                update(ScheduledDownload)
+                .where(ScheduledDownload.id == schedule_id, ScheduledDownload.status == 'pending')
+                .values(status='queued', dispatched_at=datetime.now())
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != 1:
+                db.session.rollback()
+                continue
+            bump_versions(db.session.connection(), ('scheduled_download',))
+            db.session.commit()
+
+            schedule = db.session.get(ScheduledDownload, schedule_id)
+            job = job_runner.enqueue(
+                schedule.format_type,
+                schedule.url,
+                schedule.format_id or DEFAULT_FORMATS.get(schedule.format_type, 'best'),
+                video_id=schedule.video_id,
+                title=schedule.title,
+                source=schedule.source,
+                client_id=f"schedule:{schedule.id}"
+            )
+            schedule.job_id = job.id
+            db.session.commit()
+
+            lag = (schedule.dispatched_at - schedule.scheduled_time).total_seconds()
+            metrics.observe('scheduler.dispatch_lag_seconds', lag)
+            metrics.inc('scheduler.dispatched')
+            dispatched += 1
+        return dispatched
+
+    def prefetch(self):
+        """Resolve metadata of rows due within the prefetch lead; returns the number prefetched"""
+        now = datetime.now()
+        claimable = (ScheduledDownload.status == 'pending',
+                     ScheduledDownload.resolved_at.is_(None),
+                     ScheduledDownload.error.is_(None),
+                     or_(ScheduledDownload.prefetched_at.is_(None),
+                         ScheduledDownload.prefetched_at < now - STALE_PREFETCH))
+        upcoming = db.session.execute(
+            select(ScheduledDownload.id)
+            .where(*claimable, ScheduledDownload.scheduled_time <= now + timedelta(seconds=self.prefetch_lead))
+            .order_by(ScheduledDownload.scheduled_time)
+            .limit(PREFETCH_BATCH)
+        ).scalars().all()
+
+        prefetched = 0
+        for schedule_id in upcoming:
+            # Claim it so that exactly one node runs the extraction
+            result = db.session.execute(
+                update(ScheduledDownload)
+                .where(ScheduledDownload.id == schedule_id, *claimable)
+                .values(prefetched_at=datetime.now())
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            if result.rowcount != 1:
+                continue
+            try:
+                prefetched += self._prefetch_one(db.session.get(ScheduledDownload, schedule_id))
+            except Exception as e:
+                # Dispatch it as usual, with jitter, rather than leave it claimed but never resolved
+                db.session.rollback()
+                logger.error("Error prefetching scheduled download %s: %s: %s", schedule_id, type(e).__name__, e)
+                db.session.execute(
+                    update(ScheduledDownload)
+                    .where(ScheduledDownload.id == schedule_id)
+                    .values(error=f"Prefetch failed: {type(e).__name__}: {e}"[:500])
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+                metrics.inc('scheduler.prefetched', result='error')
+                prefetched += 1
+        return prefetched
+
+    def _prefetch_one(self, schedule):
+        """Extract one row's metadata and pin its format, or mark it unavailable; False if deferred"""
+        selector = schedule.format_id or DEFAULT_FORMATS.get(schedule.format_type, 'best')
+        started = time.perf_counter()
+        try:
+            with source_limiter.guard(schedule.source), \
+                    yt_dlp.YoutubeDL(dict(PREFETCH_OPTS, format=selector)) as ydl:
+                media = MediaInfo.from_info(ydl.extract_info(schedule.url, download=False))
+        except SourceUnavailable:
+            # Try again on a later pass, once the source accepts requests
+            schedule.prefetched_at = None
+            db.session.commit()
+            metrics.inc('scheduler.prefetched', result='deferred')
+            return False
+        except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as e:
+            schedule.error = str(e)[:500]
+            if is_retryable(e):
+                # The download retries on its own; dispatch it as usual
+                metrics.inc('scheduler.prefetched', result='error')
+            else:
+                schedule.status = 'unavailable'
+                metrics.inc('scheduler.prefetched', result='unavailable')
+                logger.warning("Scheduled download %s is unavailable: %s", schedule.id, schedule.error)
+            db.session.commit()
+            return True
+
+        schedule.title = schedule.title or ((media and media.title) or '')[:255] or None
+        # A selector such as 'best' becomes the concrete format ids it resolved to
+        schedule.format_id = (media and media.format_id) or selector
+        schedule.error = None
+        schedule.resolved_at = datetime.now()
+        db.session.commit()
+        metrics.inc('scheduler.prefetched', result='ok')
+        metrics.observe('scheduler.prefetch_seconds', time.perf_counter() - started)
+        return True
+
+    def reconcile(self):
+        """Copy the outcome of finished jobs back to their schedules"""
+        rows = db.session.execute(
+            select(ScheduledDownload, DownloadJob.status, DownloadJob.finished_at)
+            .join(DownloadJob, DownloadJob.id == ScheduledDownload.job_id)
+            .where(ScheduledDownload.status == 'queued', DownloadJob.status.in_(('done', 'failed')))
+            .limit(BATCH_SIZE)
+        ).all()
+        for schedule, job_status, finished_at in rows:
+            schedule.status = 'completed' if job_status == 'done' else 'failed'
+            schedule.completed_at = finished_at
+
+        # Rows whose node died between marking and queueing go back to the plan
+        stale = db.session.execute(
+            update(ScheduledDownload)
+            .where(ScheduledDownload.status == 'queued', ScheduledDownload.job_id.is_(None),
+                   ScheduledDownload.dispatched_at < datetime.now() - STALE_DISPATCH)
+            .values(status='pending')
+            .execution_options(synchronize_session=False)
+        )
+        if stale.rowcount:
+            bump_versions(db.session.connection(), ('scheduled_download',))
+            logger.warning("Re-dispatching %s scheduled downloads left without a job", stale.rowcount)
+        db.session.commit()
+
+    def _next_dispatch_delay(self):
+        """Seconds until the next planned dispatch, capped at the poll interval"""
+        next_at = db.session.execute(
+            select(func.min(ScheduledDownload.dispatch_at)).where(ScheduledDownload.status == 'pending')
+        ).scalar()
+        db.session.rollback()
+        if next_at is None:
+            return self.poll_interval
+        return min(self.poll_interval, max(0.0, (next_at - datetime.now()).total_seconds()))
+
+    def _run(self):
+        """Dispatcher loop"""
+        while True:
+            delay = self.poll_interval
+            try:
+                with self.app.app_context():
+                    self.plan()
+                    self.dispatch()
+                    self.reconcile()
+                    # Wake up right at the next dispatch time rather than up to a poll late
+                    delay = self._next_dispatch_delay()
+            except Exception as e:
+                logger.error("Schedule dispatcher error: %s: %s", type(e).__name__, e)
+            time.sleep(delay)
+
+    def _run_prefetch(self):
+        """Prefetch loop; kept off the dispatcher thread so slow extractions never delay a dispatch"""
+        while True:
+            try:
+                with self.app.app_context():
+                    while self.prefetch() == PREFETCH_BATCH:
+                        pass
+            except Exception as e:
+                logger.error("Schedule prefetch error: %s: %s", type(e).__name__, e)
+            time.sleep(self.prefetch_poll_interval)
+
+
+schedule_dispatcher = ScheduleDispatcher()
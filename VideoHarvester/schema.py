@@ -0,0 +1,127 @@
+import os
+import fcntl
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+
+import click
+from alembic.migration import MigrationContext
+from flask_migrate import upgrade
+from sqlalchemy import select, text
+
+from models import db, VideoDownload, ScheduledDownload
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary constant shared by every worker and node taking the migration lock
+MIGRATION_LOCK_KEY = 0x56480027
+MIGRATION_LOCK_NAME = 'videoharvester-migrate'
+
+
+def _hot_queries():
+    """(name, index the plan must use, statement) for the queries the indexes were added for"""
+    now = datetime.now()
+    return [
+        ('history ordering', 'ix_video_download_download_date',
+         select(VideoDownload.id).order_by(VideoDownload.download_date.desc()).limit(50)),
+        ('already-downloaded lookup', 'ix_video_download_lookup',
+         select(VideoDownload.id).where(VideoDownload.source == 'youtube', VideoDownload.video_id == 'x',
+                                        VideoDownload.format_type == 'video')),
+        ('url lookup', 'ix_video_download_url',
+         select(VideoDownload.id).where(VideoDownload.url == 'x')),
+        ('scheduler dispatch', 'ix_scheduled_download_dispatch',
+         select(ScheduledDownload.id)
+         .where(ScheduledDownload.status == 'pending', ScheduledDownload.dispatch_at <= now)
+         .order_by(ScheduledDownload.dispatch_at)),
+    ]
+
+
+def verify_query_plans():
+    """EXPLAIN each hot query; returns (name, index, used, plan) tuples"""
+    dialect = db.engine.dialect.name
+    results = []
+    with db.engine.connect() as conn:
+        if dialect == 'postgresql':
+            # Tiny tables are cheaper to scan, which would hide a missing index
+            conn.execute(text('SET LOCAL enable_seqscan = off'))
+        elif dialect == 'sqlite':
+            # EXPLAIN does not check the schema cookie, so make a pooled connection load the current schema
+            conn.execute(text('SELECT count(*) FROM sqlite_master'))
+        prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+        for name, index, statement in _hot_queries():
+            # Partial indexes only match a literal predicate, not a bound parameter
+            compiled = statement.compile(conn, compile_kwargs={'literal_binds': True})
+            rows = conn.execute(text(prefix + str(compiled))).fetchall()
+            plan = '\n'.join(' '.join(str(value) for value in row) for row in rows)
+            results.append((name, index, index in plan, plan))
+        conn.rollback()
+        if dialect == 'sqlite':
+            # Nor are cached EXPLAIN statements replanned; keep them from answering a later check
+            conn.invalidate()
+    return results
+
+
+@contextmanager
+def _migration_lock():
+    """Hold a database-wide lock so only one worker runs the migrations at a time"""
+    engine = db.engine
+    dialect = engine.dialect.name
+    if dialect == 'postgresql':
+        with engine.connect() as conn:
+            conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+    elif dialect in ('mysql', 'mariadb'):
+        with engine.connect() as conn:
+            conn.execute(text('SELECT GET_LOCK(:name, -1)'), {'name': MIGRATION_LOCK_NAME})
+            try:
+                yield
+            finally:
+                conn.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': MIGRATION_LOCK_NAME})
+    elif dialect == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+        with open(os.path.abspath(engine.url.database) + '.migrate.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+    else:
+        yield
+
+
+def _current_revision():
+    with db.engine.connect() as conn:
+        return MigrationContext.configure(conn).get_current_revision()
+
+
+def migrate():
+    """Apply pending migrations under the migration lock; returns True if the schema changed"""
+    with _migration_lock():
+        before = _current_revision()
+        upgrade()
+        after = _current_revision()
+    if before == after:
+        return False
+    logger.info("Migrated database schema from %s to %s", before, after)
+    for name, index, used, plan in verify_query_plans():
+        if not used:
+            logger.warning("Query plan for %s does not use %s:\n%s", name, index, plan)
+    return True
+
+
+def init_app(app):
+    """Register the check-indexes command and, unless disabled, migrate on startup"""
+    @app.cli.command('check-indexes')
+    def check_indexes():
+        """Verify that the hot queries use their indexes"""
+        missing = 0
+        for name, index, used, plan in verify_query_plans():
+            click.echo(f"{'ok' if used else 'MISSING'}  {name}: {index}")
+            if not used:
+                click.echo(plan)
+                missing += 1
+        if missing:
+            raise SystemExit(1)
+
+    if app.config.get('DB_MIGRATE_ON_START', True):
+        with app.app_context():
+            migrate()
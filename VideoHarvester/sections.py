@@ -0,0 +1,316 @@
+import os
+import re
+import json
+import math
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from yt_dlp.networking import Request
+from yt_dlp.networking.exceptions import RequestError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bytes read per call while a section streams into the file
+READ_SIZE = 256 * 1024
+
+# Requests a section makes for the same bytes before the whole download fails
+SECTION_ATTEMPTS = 3
+
+# Seconds between progress reports while sections run
+PROGRESS_INTERVAL = 0.5
+
+# Seconds between saves of the per-section progress record
+RECORD_INTERVAL = 5.0
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+
+class SectionError(Exception):
+    """A sectioned download could not finish; the job can be retried"""
+
+
+def _load_record(record_path):
+    try:
+        with open(record_path, encoding='utf-8') as record_file:
+            record = json.load(record_file)
+        return record if {'total', 'prefix', 'sections'} <= record.keys() else None
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def recorded_bytes(part_path):
+    """Bytes written to a preallocated .sections.part file, as far as its progress record knows"""
+    record = _load_record(part_path[:-len('.part')] + '.ytdl')
+    if record is None:
+        return 0
+    return record['prefix'] + sum(done for _, _, done in record['sections'])
+
+
+class SectionPolicy:
+    """When to split a download into concurrent byte-range sections, and into how many"""
+
+    def __init__(self, config):
+        self.max_sections = config.get('PARALLEL_MAX_SECTIONS', 1)
+        self.enabled = self.max_sections > 1
+        self.min_duration = config.get('PARALLEL_MIN_DURATION', 1200.0)
+        self.section_seconds = config.get('PARALLEL_SECTION_SECONDS', 30.0)
+        self.min_section_duration = config.get('PARALLEL_MIN_SECTION_DURATION', 300.0)
+        self.min_section_bytes = config.get('PARALLEL_MIN_SECTION_BYTES', 8 * 1024 * 1024)
+        self.probe_bytes = config.get('PARALLEL_PROBE_BYTES', 2 * 1024 * 1024)
+
+    def eligible(self, info):
+        """Long single-file formats served over plain HTTP; merged and fragmented formats are left to yt-dlp"""
+        return (self.enabled and bool(info.get('url')) and not info.get('requested_formats')
+                and info.get('protocol') in ('http', 'https')
+                and (info.get('duration') or 0) >= self.min_duration)
+
+    def count(self, remaining, throughput, duration):
+        """Sections for the bytes left after the probe, given one connection's measured throughput.
+
+        Enough sections that each would take about section_seconds at that
+        throughput, so fast origins stay on one connection; but no section
+        shorter than min_section_bytes or min_section_duration of media.
+        """
+        by_time = math.ceil(remaining / max(throughput, 1.0) / self.section_seconds)
+        by_size = remaining // self.min_section_bytes
+        by_duration = int((duration or 0) // self.min_section_duration)
+        return max(1, min(self.max_sections, by_time, by_size, by_duration))
+
+
+class SectionedDownload:
+    """Downloads one progressive file over several concurrent range requests and joins them in place.
+
+    A probe request for the first bytes checks that the server honours
+    ranges, learns the file size and measures what one connection gets;
+    the policy turns that into a section count. The rest of the file is
+    split into equal byte ranges, each written at its offset of one
+    preallocated .part file, so joining needs no copy and no re-encoding.
+    Requests go through yt-dlp, with the format's headers and cookies, and
+    stay within the format's http_chunk_size where the site sets one.
+    Progress hooks see the contiguous prefix written so far, so a
+    streaming upload can keep reading the file from the start.
+
+    The sections and the bytes each has written are saved next to the
+    part file in a .sections.ytdl record, like yt-dlp's own resume state.
+    A retry of the job finds both, checks that the server still has a file
+    of the same size, and only fetches what is missing.
+    """
+
+    def __init__(self, ydl, info, path, policy, progress_hooks=()):
+        self.ydl = ydl
+        self.url = info['url']
+        self.headers = dict(info.get('http_headers') or {})
+        self.chunk_size = (info.get('downloader_options') or {}).get('http_chunk_size') or None
+        self.duration = info.get('duration')
+        self.path = path
+        self.part_path = path + '.sections.part'
+        self.record_path = path + '.sections.ytdl'
+        self.policy = policy
+        self.progress_hooks = list(progress_hooks)
+        self.total = None
+        self._stop = threading.Event()
+        self._sections = []
+        self._done = []
+        self._prefix = 0
+
+    def run(self):
+        """Download the file to path; False if the server ignores ranges and yt-dlp should take over"""
+        started = time.perf_counter()
+        resumed = self._resume()
+        try:
+            with open(self.part_path, 'r+b' if resumed else 'wb') as part:
+                if resumed:
+                    sections = len(self._sections)
+                    logger.info("Resuming %d bytes in %d sections at %d bytes written",
+                                self.total, sections, self._written())
+                else:
+                    probed, throughput = self._probe(part.fileno())
+                    if probed is None:
+                        self._discard()
+                        return False
+                    sections = self.policy.count(self.total - probed, throughput, self.duration)
+                    logger.info("Downloading %d bytes in %d sections (probe: %.0f KB/s)",
+                                self.total, sections, throughput / 1024)
+                    self._plan(probed, sections)
+                self._transfer(part.fileno())
+            # The part file and its record stay behind on failure, for the next attempt
+            os.replace(self.part_path, self.path)
+            self._discard()
+        finally:
+            self._stop.set()
+
+        elapsed = time.perf_counter() - started
+        metrics.inc('downloads.sectioned')
+        metrics.observe('downloads.sections', sections)
+        metrics.observe('downloads.sectioned_mbps', self.total / max(elapsed, 1e-6) / 1e6)
+        self._report('finished', self.total)
+        return True
+
+    def _resume(self):
+        """Take over the sections of an earlier attempt if the server still has a file of that size"""
+        record = _load_record(self.record_path)
+        if record is None or not os.path.exists(self.part_path):
+            self._discard()
+            return False
+        try:
+            response = self._open(0, 0)
+        except RequestError as e:
+            raise SectionError(f"Resume request failed: {e}") from e
+        try:
+            match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range') or '')
+            total = int(match.group(3)) if response.status == 206 and match else None
+        finally:
+            response.close()
+        if total != record['total'] or os.path.getsize(self.part_path) != total:
+            metrics.inc('downloads.section_resume_mismatches')
+            self._discard()
+            return False
+
+        self.total = total
+        self._prefix = record['prefix']
+        self._sections = [(start, end) for start, end, _ in record['sections']]
+        self._done = [done for _, _, done in record['sections']]
+        metrics.inc('downloads.sections_resumed')
+        metrics.inc('downloads.section_bytes_resumed', self._written())
+        return True
+
+    def _discard(self):
+        for path in (self.part_path, self.record_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _save_record(self):
+        """Write the sections and their progress; only bytes already written are counted"""
+        record = {'total': self.total, 'prefix': self._prefix,
+                  'sections': [[start, end, done] for (start, end), done in zip(self._sections, self._done)]}
+        temp_path = self.record_path + '.part'
+        with open(temp_path, 'w', encoding='utf-8') as record_file:
+            json.dump(record, record_file)
+        os.replace(temp_path, self.record_path)
+
+    def _written(self):
+        return self._prefix + sum(self._done)
+
+    def _open(self, start, end):
+        """Response for bytes [start, end] of the file"""
+        headers = dict(self.headers, Range=f"bytes={start}-{end}")
+        return self.ydl.urlopen(Request(self.url, headers=headers))
+
+    def _probe(self, fd):
+        """Fetch the first bytes; returns (bytes written, bytes per second) or (None, None) without range support"""
+        probe_end = min(self.policy.probe_bytes, self.chunk_size or self.policy.probe_bytes) - 1
+        started = time.perf_counter()
+        try:
+            response = self._open(0, probe_end)
+        except RequestError as e:
+            raise SectionError(f"Probe request failed: {e}") from e
+        try:
+            match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range') or '')
+            if response.status != 206 or not match or int(match.group(1)) != 0:
+                metrics.inc('downloads.sectioned_fallbacks')
+                return None, None
+            self.total = int(match.group(3))
+            os.ftruncate(fd, self.total)
+            written = self._copy(response, fd, 0, int(match.group(2)) + 1)
+        finally:
+            response.close()
+        return written, written / max(time.perf_counter() - started, 1e-6)
+
+    def _plan(self, offset, sections):
+        """Split [offset, total) into equal sections and record them"""
+        self._prefix = offset
+        if offset < self.total:
+            size = math.ceil((self.total - offset) / sections)
+            self._sections = [(start, min(start + size, self.total)) for start in range(offset, self.total, size)]
+            self._done = [0] * len(self._sections)
+        self._save_record()
+
+    def _transfer(self, fd):
+        """Download the unfinished parts of the sections on a thread each"""
+        unfinished = [index for index, (start, end) in enumerate(self._sections) if start + self._done[index] < end]
+        if not unfinished:
+            return
+
+        pool = ThreadPoolExecutor(max_workers=len(unfinished), thread_name_prefix='download-section')
+        saved = time.perf_counter()
+        try:
+            futures = [pool.submit(self._fetch, fd, index) for index in unfinished]
+            pending = futures
+            while pending:
+                finished, pending = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_EXCEPTION)
+                for future in finished:
+                    future.result()
+                self._report('downloading', self._contiguous())
+                if time.perf_counter() - saved >= RECORD_INTERVAL:
+                    # Data first, so the record never counts bytes a crash could lose
+                    os.fdatasync(fd)
+                    self._save_record()
+                    saved = time.perf_counter()
+        except BaseException:
+            self._stop.set()
+            raise
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            try:
+                self._save_record()
+            except OSError as e:
+                logger.error("Error saving section progress: %s", e)
+
+    def _fetch(self, fd, index):
+        """Download one section, in chunk_size requests, resuming after failed requests"""
+        start, end = self._sections[index]
+        failures = 0
+        while start + self._done[index] < end:
+            position = start + self._done[index]
+            request_end = min(end, position + self.chunk_size) if self.chunk_size else end
+            try:
+                response = self._open(position, request_end - 1)
+                try:
+                    if response.status != 206:
+                        raise SectionError(f"Range request answered with HTTP {response.status}")
+                    copied = self._copy(response, fd, position, request_end, index)
+                finally:
+                    response.close()
+                if copied < request_end - position:
+                    raise SectionError(f"Section {index} ended after {copied} of {request_end - position} bytes")
+            except (RequestError, OSError, SectionError) as e:
+                if self._stop.is_set():
+                    return
+                failures += 1
+                metrics.inc('downloads.section_retries')
+                if failures >= SECTION_ATTEMPTS:
+                    raise SectionError(f"Section {index} failed: {e}") from e
+                logger.warning("Retrying section %d at byte %d: %s", index, start + self._done[index], e)
+
+    def _copy(self, response, fd, position, end, index=None):
+        """Write a response body at position, up to end; returns the bytes written"""
+        written = 0
+        while position + written < end and not self._stop.is_set():
+            chunk = response.read(min(READ_SIZE, end - position - written))
+            if not chunk:
+                break
+            os.pwrite(fd, chunk, position + written)
+            written += len(chunk)
+            if index is not None:
+                self._done[index] += len(chunk)
+        return written
+
+    def _contiguous(self):
+        """Bytes from the start of the file that are all written"""
+        prefix = self._prefix
+        for (start, end), done in zip(self._sections, self._done):
+            prefix = start + done
+            if start + done < end:
+                break
+        return prefix
+
+    def _report(self, status, downloaded):
+        progress = {'status': status, 'downloaded_bytes': downloaded, 'total_bytes': self.total,
+                    'filename': self.path, 'tmpfilename': self.part_path}
+        for hook in self.progress_hooks:
+            hook(progress)
@@ -0,0 +1,257 @@
+import time
+import uuid
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+import yt_dlp
+
+import metrics
+import downloader
+from utils import parse_overrides
+from models import db, SourceCircuit, SourceLease
+
+logger = logging.getLogger(__name__)
+
+# Gauge values of sources.breaker_state
+STATE_VALUES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+class SourceUnavailable(Exception):
+    """A source is tripped or at its concurrency limit; try again after retry_after seconds"""
+
+    def __init__(self, source, reason, retry_after):
+        super().__init__(f"{source} is {reason}, retry after {retry_after}s")
+        self.source = source
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class SourceLimiter:
+    """Per-source concurrency limits and circuit breakers shared by every worker.
+
+    Each call to a platform (info extraction or a download) holds a lease row
+    in source_lease while it runs; a source refuses new leases once it has
+    as many live leases as its limit. Outcomes feed the source's row in
+    source_circuit: SOURCE_BREAKER_THRESHOLD consecutive transient failures
+    open the breaker, after SOURCE_BREAKER_COOLDOWN seconds it lets a few
+    probes through (half-open), and the first probe outcome closes or
+    re-opens it. Leases of crashed workers expire after SOURCE_LEASE_TTL.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        # source -> monotonic time until which this process knows the breaker is open
+        self._open_until = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.holder = app.config.get('NODE_ID') or socket.gethostname()
+        self.default_limit = app.config.get('SOURCE_MAX_CONCURRENCY', 4)
+        self.limits = parse_overrides(app.config.get('SOURCE_CONCURRENCY'))
+        self.threshold = app.config.get('SOURCE_BREAKER_THRESHOLD', 5)
+        self.cooldown = app.config.get('SOURCE_BREAKER_COOLDOWN', 30.0)
+        self.probes = app.config.get('SOURCE_BREAKER_PROBES', 1)
+        self.busy_retry_after = app.config.get('SOURCE_BUSY_RETRY_AFTER', 5)
+        self.lease_ttl = app.config.get('SOURCE_LEASE_TTL', 3600)
+
+    def limit_for(self, source):
+        return self.limits.get(source, self.default_limit)
+
+    def acquire(self, source):
+        """Take a lease on the source, or raise SourceUnavailable"""
+        # Fail fast without a database round trip while this process knows the breaker is open
+        with self._lock:
+            open_until = self._open_until.get(source, 0)
+        if open_until > time.monotonic():
+            self._reject(source, 'open', max(1, round(open_until - time.monotonic())))
+
+        circuits = SourceCircuit.__table__
+        leases = SourceLease.__table__
+        now = datetime.utcnow()
+        transition = None
+        rejection = None
+        lease_id = uuid.uuid4().hex
+
+        with db.engine.begin() as conn:
+            row = self._lock_circuit(conn, source, now)
+            state = row.state
+
+            if state == 'open':
+                remaining = (row.opened_at + timedelta(seconds=self.cooldown) - now).total_seconds()
+                if remaining > 0:
+                    rejection = ('open', max(1, round(remaining)))
+                else:
+                    # Only one worker makes the transition; the others see half_open
+                    state = 'half_open'
+                    result = conn.execute(update(circuits).where(circuits.c.source == source, circuits.c.state == 'open')
+                                          .values(state=state, updated_at=now))
+                    if result.rowcount == 1:
+                        transition = ('open', state)
+
+            if rejection is None:
+                conn.execute(delete(leases).where(leases.c.source == source, leases.c.expires_at <= now))
+                in_flight = conn.execute(select(func.count()).select_from(leases)
+                                         .where(leases.c.source == source)).scalar()
+                if in_flight >= (self.probes if state == 'half_open' else self.limit_for(source)):
+                    rejection = ('probing' if state == 'half_open' else 'busy', self.busy_retry_after)
+                else:
+                    conn.execute(insert(leases).values(
+                        id=lease_id, source=source, holder=self.holder, acquired_at=now,
+                        expires_at=now + timedelta(seconds=self.lease_ttl)))
+                    metrics.set_gauge('sources.in_flight', in_flight + 1, source=source)
+
+        if transition:
+            self._record_transition(source, *transition)
+        if rejection:
+            if rejection[0] == 'open':
+                with self._lock:
+                    self._open_until[source] = time.monotonic() + rejection[1]
+            self._reject(source, *rejection)
+        metrics.inc('sources.acquired', source=source)
+        return lease_id
+
+    def release(self, source, lease_id, outcome=None):
+        """Give the lease back and feed the outcome ('success', 'failure' or None) to the breaker"""
+        circuits = SourceCircuit.__table__
+        leases = SourceLease.__table__
+        now = datetime.utcnow()
+        transition = None
+
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(delete(leases).where(leases.c.id == lease_id))
+                if outcome is None:
+                    return
+                row = self._lock_circuit(conn, source, now)
+
+                if outcome == 'success':
+                    # A late success from before the breaker opened does not close it
+                    values = {'failures': 0}
+                    if row.state == 'half_open':
+                        values['state'] = 'closed'
+                else:
+                    values = {'failures': row.failures + 1}
+                    if row.state == 'half_open' or (row.state == 'closed' and row.failures + 1 >= self.threshold):
+                        values.update(state='open', opened_at=now)
+
+                if values.get('state', row.state) != row.state:
+                    transition = (row.state, values['state'])
+                conn.execute(update(circuits).where(circuits.c.source == source).values(updated_at=now, **values))
+        except Exception as e:
+            # A lost release only costs a slot until the lease expires
+            logger.error("Error releasing %s lease: %s: %s", source, type(e).__name__, e)
+            return
+
+        metrics.inc('sources.outcomes', source=source, outcome=outcome)
+        if transition:
+            self._record_transition(source, *transition)
+
+    @contextmanager
+    def guard(self, source):
+        """Hold a lease on the source for the duration of the block.
+
+        Transient failures (throttling, 5xx, network) count against the
+        breaker; permanent ones (a private or removed video) show that the
+        source itself is answering, so they count as successes.
+        """
+        source = source or 'unknown'
+        lease_id = self.acquire(source)
+        outcome = None
+        try:
+            yield
+            outcome = 'success'
+        except downloader.DownloadFailed as e:
+            outcome = 'failure' if e.retryable else 'success'
+            raise
+        except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as e:
+            outcome = 'failure' if downloader.is_retryable(e) else 'success'
+            raise
+        finally:
+            self.release(source, lease_id, outcome)
+
+    def blocked_sources(self):
+        """Sources that cannot take a new lease right now (breaker open or at the limit)"""
+        circuits = SourceCircuit.__table__
+        leases = SourceLease.__table__
+        now = datetime.utcnow()
+        with db.engine.connect() as conn:
+            blocked = set(conn.execute(
+                select(circuits.c.source).where(
+                    circuits.c.state == 'open',
+                    circuits.c.opened_at > now - timedelta(seconds=self.cooldown))
+            ).scalars())
+            for source, in_flight in conn.execute(
+                    select(leases.c.source, func.count()).where(leases.c.expires_at > now)
+                    .group_by(leases.c.source)):
+                if in_flight >= self.limit_for(source):
+                    blocked.add(source)
+        return blocked
+
+    def retry_after(self, source):
+        """Seconds until an open breaker lets requests through again, or 0"""
+        circuits = SourceCircuit.__table__
+        with db.engine.connect() as conn:
+            row = conn.execute(select(circuits.c.state, circuits.c.opened_at)
+                               .where(circuits.c.source == (source or 'unknown'))).first()
+        if row is None or row.state != 'open':
+            return 0
+        remaining = (row.opened_at + timedelta(seconds=self.cooldown) - datetime.utcnow()).total_seconds()
+        return max(0, round(remaining))
+
+    def status(self):
+        """Cluster-wide breaker state and in-flight leases per source"""
+        circuits = SourceCircuit.__table__
+        leases = SourceLease.__table__
+        now = datetime.utcnow()
+        with db.engine.connect() as conn:
+            in_flight = dict(conn.execute(
+                select(leases.c.source, func.count()).where(leases.c.expires_at > now)
+                .group_by(leases.c.source)).all())
+            return {
+                row.source: {
+                    'state': row.state,
+                    'failures': row.failures,
+                    'opened_at': row.opened_at.strftime("%Y-%m-%d %H:%M:%S") if row.opened_at else None,
+                    'in_flight': in_flight.get(row.source, 0),
+                    'limit': self.limit_for(row.source),
+                }
+                for row in conn.execute(select(circuits))
+            }
+
+    def _lock_circuit(self, conn, source, now):
+        """Return the source's breaker row, locked for this transaction, creating it if needed"""
+        circuits = SourceCircuit.__table__
+        query = select(circuits).where(circuits.c.source == source).with_for_update()
+        row = conn.execute(query).first()
+        if row is None:
+            try:
+                with db.engine.begin() as create:
+                    create.execute(insert(circuits).values(source=source, state='closed', failures=0, updated_at=now))
+            except IntegrityError:
+                pass  # Another worker created it first
+            row = conn.execute(query).first()
+        return row
+
+    def _record_transition(self, source, from_state, to_state):
+        logger.warning("Circuit breaker for %s: %s -> %s", source, from_state, to_state)
+        metrics.inc('sources.breaker_transitions', source=source, from_state=from_state, to_state=to_state)
+        metrics.set_gauge('sources.breaker_state', STATE_VALUES[to_state], source=source)
+        with self._lock:
+            if to_state == 'open':
+                self._open_until[source] = time.monotonic() + self.cooldown
+            else:
+                self._open_until.pop(source, None)
+
+    def _reject(self, source, reason, retry_after):
+        metrics.inc('sources.rejected', source=source, reason=reason)
+        raise SourceUnavailable(source, reason, retry_after)
+
+
+source_limiter = SourceLimiter()
@@ -118,6 +118,15 @@ document.addEventListener('DOMContentLoaded', function() {
             }),
         })
         .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                return data;
+            }
+            
+            // The download runs in the background; wait for it to finish
+            downloadStatus.textContent = 'Downloading...';
+            return waitForJob(data.download_id);
+        })
         .then(data => {
             if (data.error) {
                 showError(data.error);
@@ -140,6 +149,19 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Poll a queued download until a worker has finished it
+    function waitForJob(downloadId) {
+        return fetch(`/job_status/${downloadId}`)
+            .then(response => response.json())
+            .then(job => {
+                if (job.status === 'queued' || job.status === 'running') {
+                    return new Promise(resolve => setTimeout(resolve, 1000))
+                        .then(() => waitForJob(downloadId));
+                }
+                return job;
+            });
+    }
+    
     // Show error message (reuse from main script)
     function showError(message) {
         errorMessageElement.textContent = message;
@@ -89,11 +89,11 @@ document.addEventListener('DOMContentLoaded', function() {
                 return;
             }
             
-            // Show video info
+            // Show video info (100px preview, 2x for high-DPI screens)
             scheduleInfoDiv.classList.remove('d-none');
             scheduleInfoDiv.innerHTML = `
                 <div class="d-flex align-items-center">
-                    <img src="${data.thumbnail}" alt="Thumbnail" class="img-thumbnail me-3" style="width: 100px;">
+                    <img src="${data.thumbnail ? data.thumbnail + '?w=200' : ''}" alt="Thumbnail" class="img-thumbnail me-3" style="width: 100px;">
                     <div>
                         <h5>${data.title}</h5>
                         <p class="mb-0">by ${data.author}</p>
@@ -130,6 +130,15 @@ document.addEventListener('DOMContentLoaded', function() {
             }),
         })
         .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                return data;
+            }
+            
+            // The download runs in the background; wait for it to finish
+            downloadStatus.textContent = 'Downloading...';
+            return waitForJob(data.download_id);
+        })
         .then(data => {
             if (data.error) {
                 showError(data.error);
@@ -151,6 +160,19 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Poll a queued download until a worker has finished it
+    function waitForJob(downloadId) {
+        return fetch(`/job_status/${downloadId}`)
+            .then(response => response.json())
+            .then(job => {
+                if (job.status === 'queued' || job.status === 'running') {
+                    return new Promise(resolve => setTimeout(resolve, 1000))
+                        .then(() => waitForJob(downloadId));
+                }
+                return job;
+            });
+    }
+    
     // Helper function to format duration
     function formatDuration(seconds) {
         const hrs = Math.floor(seconds / 3600);
@@ -0,0 +1,201 @@
+import os
+import hashlib
+import logging
+import threading
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import metrics
+
+try:
+    import boto3
+    from botocore.config import Config
+except ImportError:  # Optional: without boto3 files stay on local disk
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+# S3 requires every part but the last to be at least 5 MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Chunk size used when reading objects back, e.g. into a ZIP bundle
+READ_CHUNK_SIZE = 256 * 1024
+
+
+class StreamingUpload:
+    """Parallel multipart upload that can start while the file is still being written.
+
+    feed() is called from yt-dlp progress hooks with the partial file and the
+    bytes written so far; every complete part is read and handed to the upload
+    pool immediately. finish() uploads the rest of the final file in parallel,
+    after checking that the bytes already sent were not rewritten (yt-dlp
+    restarts a download when the server cannot resume it).
+    """
+
+    def __init__(self, client, bucket, key, content_type, part_size, concurrency):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='s3-upload')
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._digests = {}
+        self._offset = 0
+        self._streaming = True
+        self.upload_id = client.create_multipart_upload(
+            Bucket=bucket, Key=key, ContentType=content_type)['UploadId']
+
+    def feed(self, path, bytes_written):
+        """Upload every complete part of a growing file that has not been sent yet"""
+        with self._lock:
+            if not self._streaming:
+                return
+            if bytes_written < self._offset:
+                # The download restarted from scratch; finish() will resend everything
+                self._streaming = False
+                return
+            try:
+                with open(path, 'rb') as partial:
+                    while bytes_written - self._offset >= self.part_size:
+                        partial.seek(self._offset)
+                        data = partial.read(self.part_size)
+                        if len(data) < self.part_size:
+                            break
+                        self._submit(len(self._futures) + 1, data)
+                        self._offset += self.part_size
+            except OSError:
+                # The partial file was renamed under us; finish() picks up from the offset
+                pass
+
+    def finish(self, path):
+        """Upload the remainder of the finished file and complete the upload"""
+        with self._lock:
+            self._streaming = False
+            if self._offset and not self._prefix_matches(path):
+                logger.warning("Streamed parts of %s no longer match the file, re-uploading", self.key)
+                metrics.inc('storage.stream_restarts')
+                self._reset()
+
+            file_size = os.path.getsize(path)
+            streamed = self._offset
+            part_number = len(self._futures)
+            for offset in range(self._offset, file_size, self.part_size):
+                part_number += 1
+                self._futures[part_number] = self._pool.submit(self._upload_range, part_number, path, offset)
+            if not self._futures:
+                # Empty files still need one (empty) part
+                self._submit(1, b'')
+
+        try:
+            parts = [{'PartNumber': number, 'ETag': future.result()}
+                     for number, future in sorted(self._futures.items())]
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': parts})
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._pool.shutdown(wait=False)
+
+        metrics.inc('storage.bytes_uploaded', file_size)
+        metrics.inc('storage.bytes_streamed_early', streamed)
+        return file_size
+
+    def abort(self):
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except Exception as e:
+            logger.error("Error aborting upload of %s: %s", self.key, e)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, part_number, data):
+        self._digests[part_number] = hashlib.md5(data).digest()
+        self._futures[part_number] = self._pool.submit(self._upload_part, part_number, data)
+
+    def _upload_part(self, part_number, data):
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=data)
+        return response['ETag']
+
+    def _upload_range(self, part_number, path, offset):
+        with open(path, 'rb') as source:
+            source.seek(offset)
+            data = source.read(self.part_size)
+        return self._upload_part(part_number, data)
+
+    def _prefix_matches(self, path):
+        """Compare the parts streamed early with the same ranges of the final file"""
+        with open(path, 'rb') as final:
+            for part_number, digest in sorted(self._digests.items()):
+                final.seek((part_number - 1) * self.part_size)
+                if hashlib.md5(final.read(self.part_size)).digest() != digest:
+                    return False
+        return True
+
+    def _reset(self):
+        """Drop the streamed parts so finish() resends the whole file"""
+        for future in self._futures.values():
+            future.cancel()
+        # Let in-flight uploads land first so they cannot overwrite the resent parts
+        wait(list(self._futures.values()))
+        self._futures = {}
+        self._digests = {}
+        self._offset = 0
+
+
+class S3Storage:
+    """S3-compatible object store (AWS, MinIO, ...) for finished downloads"""
+
+    def __init__(self, config):
+        self.bucket = config['S3_BUCKET']
+        self.prefix = config.get('S3_PREFIX', 'downloads/')
+        self.part_size = config.get('S3_PART_SIZE', 16 * 1024 * 1024)
+        self.concurrency = config.get('S3_UPLOAD_CONCURRENCY', 4)
+        self.url_ttl = config.get('S3_URL_TTL', 300)
+        self.client = boto3.client(
+            's3',
+            endpoint_url=config.get('S3_ENDPOINT_URL'),
+            region_name=config.get('S3_REGION'),
+            config=Config(max_pool_connections=max(10, self.concurrency * 2),
+                          signature_version='s3v4'),
+        )
+
+    def key_for(self, job_id):
+        return f"{self.prefix}{job_id}"
+
+    def start_upload(self, key, content_type):
+        return StreamingUpload(self.client, self.bucket, key, content_type, self.part_size, self.concurrency)
+
+    def presigned_url(self, key, filename, content_type):
+        """Short-lived URL that downloads the object as an attachment"""
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.bucket,
+                'Key': key,
+                'ResponseContentDisposition': f"attachment; filename*=UTF-8''{quote(filename)}",
+                'ResponseContentType': content_type,
+            },
+            ExpiresIn=self.url_ttl,
+        )
+
+    def read_range(self, key, start, end):
+        """Yield bytes [start, end) of an object"""
+        body = self.client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end - 1}")['Body']
+        try:
+            yield from body.iter_chunks(READ_CHUNK_SIZE)
+        finally:
+            body.close()
+
+
+def create_storage(config):
+    """Return the configured object storage, or None to keep files on local disk"""
+    if config.get('STORAGE_BACKEND', 'local') != 's3':
+        return None
+    if boto3 is None:
+        logger.error("STORAGE_BACKEND=s3 needs boto3; keeping files on local disk")
+        return None
+    return S3Storage(config)
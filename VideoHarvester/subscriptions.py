@@ -0,0 +1,258 @@
+import time
+import logging
+import itertools
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+import yt_dlp
+
+import metrics
+from cron import CronSchedule
+from jobs import job_runner
+from membership import membership_index
+from source_limits import source_limiter, SourceUnavailable
+from models import db, Subscription, DownloadArchive
+
+logger = logging.getLogger(__name__)
+
+# List channel and playlist entries without resolving each video; pages are fetched lazily
+LIST_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': 'in_playlist',
+    'skip_download': True,
+}
+
+# Entries checked against the archive per query; small at first, since new uploads are
+# usually few and an archive hit ends the listing before the next page is fetched
+FIRST_ARCHIVE_CHUNK = 5
+ARCHIVE_CHUNK = 50
+
+# Newest entries of a first sync that are remembered as seen, so a later sync still stops
+# early if the newest entry it remembered has been deleted
+BASELINE_MARKERS = 5
+
+# Default yt-dlp format selectors for subscription downloads
+DEFAULT_FORMATS = {'video': 'best', 'audio': 'bestaudio'}
+
+
+def newest_first(url):
+    """Channel upload feeds list newest first; playlists list in playlist order"""
+    return 'list=' not in url
+
+
+def next_run(cron, after=None):
+    """Next time (UTC) the subscription's cron expression fires"""
+    return CronSchedule(cron).next_after(after or datetime.utcnow())
+
+
+class SubscriptionRunner:
+    """Syncs due subscriptions and queues their new entries as download jobs.
+
+    A sync lists the channel lazily, newest entry first, and stops at the
+    entry the previous sync saw first or at the first entry already in the
+    download archive, so an hourly sync of a large channel touches only the
+    first page. Playlists list oldest first and are read up to
+    SUBSCRIPTION_MAX_ENTRIES, skipping archived entries. Each due
+    subscription is claimed by advancing next_run_at with a conditional
+    UPDATE, so it syncs on one node only.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_interval = app.config.get('SUBSCRIPTION_POLL_INTERVAL', 30.0)
+        self.max_entries = app.config.get('SUBSCRIPTION_MAX_ENTRIES', 200)
+        self.backfill = app.config.get('SUBSCRIPTION_BACKFILL', 0)
+        self._thread = threading.Thread(target=self._run, name='subscription-sync', daemon=True)
+        self._thread.start()
+
+    def create(self, url, source, format_type, cron, format_id=None):
+        """Add a subscription; its first sync runs right away and records where the channel stands"""
+        next_run(cron)  # Validate the expression before storing it
+        subscription = Subscription(url=url, source=source, format_type=format_type,
+                                    format_id=format_id or DEFAULT_FORMATS[format_type],
+                                    cron=cron, status='active', next_run_at=datetime.utcnow())
+        db.session.add(subscription)
+        db.session.commit()
+        return subscription
+
+    def claim_due(self):
+        """Take one due subscription and move its next run forward; returns its id or None"""
+        now = datetime.utcnow()
+        for subscription_id, cron, due_at in db.session.execute(
+                select(Subscription.id, Subscription.cron, Subscription.next_run_at)
+                .where(Subscription.status == 'active', Subscription.next_run_at <= now)
+                .order_by(Subscription.next_run_at)
+                .limit(10)).all():
+            result = db.session.execute(
+                update(Subscription)
+                .where(Subscription.id == subscription_id, Subscription.next_run_at == due_at)
+                .values(next_run_at=next_run(cron, now), last_run_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            if result.rowcount == 1:
+                return subscription_id
+        db.session.rollback()
+        return None
+
+    def sync(self, subscription_id):
+        """List a subscription's new entries and queue them"""
+        subscription = db.session.get(Subscription, subscription_id)
+        started = time.perf_counter()
+        try:
+            title, newest_id, entries = self._list_new(subscription)
+        except SourceUnavailable as e:
+            # Come back once the source's breaker lets requests through
+            subscription.next_run_at = datetime.utcnow() + timedelta(seconds=e.retry_after)
+            db.session.commit()
+            metrics.inc('subscriptions.syncs', status='deferred')
+            return
+        except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as e:
+            logger.error("Error listing subscription %s: %s", subscription.id, e)
+            subscription.last_error = str(e)[:500]
+            db.session.commit()
+            metrics.inc('subscriptions.syncs', status='failed')
+            return
+
+        baseline = subscription.last_seen_id is None
+        queue = entries[:self.backfill] if baseline else entries
+        # Media downloaded outside this subscription is only archived, not fetched again
+        fresh = {video_id for _, video_id, _ in membership_index.filter_new(
+            [(subscription.source, entry['id'], subscription.format_type) for entry in queue])}
+        metrics.inc('subscriptions.items_skipped', len(queue) - len(fresh))
+        # Queue oldest first so the fair queue tags follow upload order
+        queued = 0
+        for entry in reversed(queue):
+            if entry['id'] in fresh:
+                queued += self._queue_entry(subscription, entry)
+            else:
+                self._archive(subscription, entry['id'])
+        if baseline:
+            # Playlists are re-read in full on every sync, so everything already in them is seen
+            markers = BASELINE_MARKERS if newest_first(subscription.url) else len(entries)
+            for entry in entries[len(queue):len(queue) + markers]:
+                self._archive(subscription, entry['id'])
+
+        subscription.title = subscription.title or title
+        subscription.last_seen_id = newest_id or subscription.last_seen_id
+        subscription.last_error = None
+        subscription.items_queued += queued
+        db.session.commit()
+
+        metrics.inc('subscriptions.syncs', status='ok')
+        metrics.inc('subscriptions.items_queued', queued)
+        metrics.observe('subscriptions.sync_seconds', time.perf_counter() - started)
+        logger.info("Subscription %s synced: %s queued, %s new entries listed", subscription.id, queued, len(entries))
+
+    def _list_new(self, subscription):
+        """Return (title, newest entry id, unarchived entries newest first) of a channel or playlist"""
+        ordered = newest_first(subscription.url)
+        # A first sync of a channel only needs its newest few entries to know where it stands
+        limit = self.max_entries
+        if ordered and subscription.last_seen_id is None:
+            limit = self.backfill + BASELINE_MARKERS
+
+        with source_limiter.guard(subscription.source), yt_dlp.YoutubeDL(LIST_OPTS) as ydl:
+            info = self._resolve(ydl, subscription.url)
+            title = info.get('title') or info.get('uploader')
+            newest_id = None
+            entries = []
+            chunk = []
+            chunk_size = FIRST_ARCHIVE_CHUNK
+            for entry in itertools.islice(info.get('entries') or [], limit):
+                if not entry or not entry.get('id'):
+                    continue
+                metrics.inc('subscriptions.entries_listed')
+                if newest_id is None or not ordered:
+                    newest_id = entry['id']
+                if ordered and entry['id'] == subscription.last_seen_id:
+                    metrics.inc('subscriptions.early_stops', reason='last_seen')
+                    break
+                chunk.append(entry)
+                if len(chunk) >= chunk_size:
+                    fresh, hit = self._unarchived(subscription, chunk, ordered)
+                    entries.extend(fresh)
+                    chunk = []
+                    chunk_size = min(ARCHIVE_CHUNK, chunk_size * 2)
+                    if hit:
+                        metrics.inc('subscriptions.early_stops', reason='archive')
+                        break
+            if chunk:
+                entries.extend(self._unarchived(subscription, chunk, ordered)[0])
+
+        if not ordered:
+            entries.reverse()
+        return title, newest_id, entries
+
+    def _resolve(self, ydl, url):
+        """Follow redirects (channel root -> uploads tab, ...) without listing any entries"""
+        info = ydl.extract_info(url, download=False, process=False)
+        for _ in range(3):
+            if not info or info.get('_type') not in ('url', 'url_transparent'):
+                break
+            info = ydl.extract_info(info['url'], download=False, process=False)
+        if not info:
+            raise yt_dlp.utils.ExtractorError('Could not list this channel or playlist')
+        return info
+
+    def _unarchived(self, subscription, chunk, stop_at_known):
+        """Drop archived entries from a chunk; with stop_at_known, cut it at the first archived one"""
+        known = set(db.session.execute(
+            select(DownloadArchive.video_id)
+            .where(DownloadArchive.source == subscription.source,
+                   DownloadArchive.format_type == subscription.format_type,
+                   DownloadArchive.video_id.in_([entry['id'] for entry in chunk]))
+        ).scalars())
+        if not stop_at_known:
+            return [entry for entry in chunk if entry['id'] not in known], False
+        for index, entry in enumerate(chunk):
+            if entry['id'] in known:
+                return chunk[:index], True
+        return chunk, False
+
+    def _archive(self, subscription, video_id):
+        db.session.merge(DownloadArchive(source=subscription.source, video_id=video_id,
+                                         format_type=subscription.format_type,
+                                         subscription_id=subscription.id))
+
+    def _queue_entry(self, subscription, entry):
+        """Queue one entry; it enters the archive in the same commit so no later sync queues it again"""
+        url = entry.get('webpage_url') or entry.get('url')
+        if not url or not url.startswith('http'):
+            return False
+        self._archive(subscription, entry['id'])
+        job_runner.enqueue(
+            subscription.format_type,
+            url,
+            subscription.format_id,
+            video_id=entry['id'],
+            title=entry.get('title'),
+            source=subscription.source,
+            # Subscriptions share the queue fairly with interactive clients
+            client_id=f"subscription:{subscription.id}"
+        )
+        return True
+
+    def _run(self):
+        """Sync loop: sync due subscriptions, then sleep for the poll interval"""
+        while True:
+            try:
+                with self.app.app_context():
+                    while True:
+                        subscription_id = self.claim_due()
+                        if subscription_id is None:
+                            break
+                        self.sync(subscription_id)
+            except Exception as e:
+                logger.error("Subscription sync error: %s: %s", type(e).__name__, e)
+            time.sleep(self.poll_interval)
+
+
+subscription_runner = SubscriptionRunner()
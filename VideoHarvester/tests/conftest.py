@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# main.py configures the app from the environment at import time, so point it
+# at a throwaway database and cache directories before anything imports it
+TEST_DIR = tempfile.mkdtemp(prefix='videoharvester-tests-')
+os.environ.update(
+    # TEST_DATABASE_URL runs the suite against a scratch Postgres database instead
+    DATABASE_URL=os.environ.get('TEST_DATABASE_URL') or f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}",
+    NODE_ID='test-node',
+    DOWNLOAD_WORKERS='0',
+    LOG_FORMAT='text',
+    LOG_LEVEL='WARNING',
+    HISTORY_SPOOL_DIR=os.path.join(TEST_DIR, 'history'),
+    HISTORY_FLUSH_INTERVAL='3600',
+    RESPONSE_CACHE_DIR=os.path.join(TEST_DIR, 'responses'),
+    ASSET_CACHE_DIR=os.path.join(TEST_DIR, 'assets'),
+    THUMB_CACHE_DIR=os.path.join(TEST_DIR, 'thumbs'),
+    METADATA_CACHE_DIR=os.path.join(TEST_DIR, 'metadata'),
+    PROFILE_DIR=os.path.join(TEST_DIR, 'profiles'),
+    SUBSCRIPTION_POLL_INTERVAL='3600',
+    SCHEDULE_POLL_INTERVAL='3600',
+    SCHEDULE_PREFETCH_POLL_INTERVAL='3600',
+    BUNDLE_SWEEP_INTERVAL='3600',
+)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app():
+    import main
+    return main.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
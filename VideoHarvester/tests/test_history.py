@@ -0,0 +1,53 @@
+import os
+import glob
+
+from history import HistoryRecorder
+from models import db, VideoDownload
+
+
+def _crash(recorder):
+    """Stop a recorder the way a killed worker would: buffered rows never flushed, spool left behind"""
+    recorder._closed = True
+    recorder._wakeup.set()
+    recorder._spool.close()
+
+
+def test_spool_of_crashed_worker_is_replayed(app, tmp_path):
+    app.config['HISTORY_SPOOL_DIR'] = str(tmp_path)
+    try:
+        crashed = HistoryRecorder(app)
+        for index in range(3):
+            crashed.record(video_id=f"crash{index:07d}", title=f"Crashed {index}", url='https://youtu.be/x',
+                           source='youtube', format_type='video', file_size=1.5)
+        _crash(crashed)
+        spool = glob.glob(os.path.join(tmp_path, 'history-*.jsonl'))
+        assert len(spool) == 1
+        with open(spool[0], 'a', encoding='utf-8') as torn:
+            torn.write('{"video_id": "torn')
+
+        # Same pid, new spool name: the crashed predecessor's file is claimed and replayed
+        recovered = HistoryRecorder(app)
+        assert recovered.flush() == 3
+        recovered.close()
+    finally:
+        app.config['HISTORY_SPOOL_DIR'] = os.environ['HISTORY_SPOOL_DIR']
+
+    with app.app_context():
+        rows = VideoDownload.query.filter(VideoDownload.video_id.like('crash%')).all()
+        assert sorted(row.video_id for row in rows) == ['crash0000000', 'crash0000001', 'crash0000002']
+        db.session.rollback()
+    assert os.listdir(tmp_path) == []
+
+
+def test_spool_of_live_worker_is_left_alone(app, tmp_path):
+    app.config['HISTORY_SPOOL_DIR'] = str(tmp_path)
+    live = os.path.join(tmp_path, f"history-{os.getppid()}-0123456789ab.jsonl")
+    with open(live, 'w', encoding='utf-8') as spool:
+        spool.write('{"video_id": "live0000000", "title": "Live", "url": "https://youtu.be/y"}\n')
+    try:
+        recorder = HistoryRecorder(app)
+        assert recorder.flush() == 0
+        recorder.close()
+    finally:
+        app.config['HISTORY_SPOOL_DIR'] = os.environ['HISTORY_SPOOL_DIR']
+    assert os.listdir(tmp_path) == [os.path.basename(live)]
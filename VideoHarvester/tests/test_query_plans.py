@@ -0,0 +1,33 @@
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+
+import schema
+
+
+def test_migrations_reach_head(app):
+    with app.app_context():
+        schema.migrate()
+        config = Config()
+        config.set_main_option('script_location', app.extensions['migrate'].directory)
+        assert schema._current_revision() == ScriptDirectory.from_config(config).get_current_head()
+
+
+def test_hot_queries_use_their_indexes(app):
+    with app.app_context():
+        results = schema.verify_query_plans()
+    assert len(results) == len(schema._hot_queries())
+    for name, index, used, plan in results:
+        assert used, f"{name} does not use {index}:\n{plan}"
+
+
+def test_missing_index_is_reported(app):
+    from models import db, VideoDownload
+    index = next(index for index in VideoDownload.__table__.indexes if index.name == 'ix_video_download_url')
+    with app.app_context():
+        index.drop(db.engine)
+        try:
+            results = {name: used for name, _, used, _ in schema.verify_query_plans()}
+        finally:
+            index.create(db.engine)
+    assert results['url lookup'] is False
+    assert results['history ordering'] is True
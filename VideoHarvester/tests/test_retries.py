@@ -0,0 +1,127 @@
+import os
+import json
+from datetime import datetime
+
+import pytest
+import yt_dlp
+
+import downloader
+from jobs import job_runner
+from models import db, DownloadJob
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, 'TEMP_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_retry_delay_is_jittered_exponential_backoff(app):
+    for attempt in range(1, 10):
+        ceiling = min(job_runner.retry_max_delay, job_runner.retry_base_delay * 2 ** (attempt - 1))
+        delays = [job_runner.retry_delay(attempt) for _ in range(200)]
+        assert all(ceiling / 2 <= delay <= ceiling for delay in delays)
+        assert len(set(delays)) > 1
+
+
+@pytest.mark.parametrize('error, retryable', [
+    (yt_dlp.utils.DownloadError('ERROR: unable to download video data: HTTP Error 503: Service Unavailable'), True),
+    (yt_dlp.utils.DownloadError('ERROR: [youtube] abc: Read timed out.'), True),
+    (yt_dlp.utils.DownloadError('ERROR: [youtube] abc: Private video'), False),
+    (yt_dlp.utils.DownloadError('ERROR: unable to download video data: HTTP Error 404: Not Found'), False),
+    (yt_dlp.utils.DownloadError('ERROR: [youtube] abc: Video unavailable. This video has been removed'), False),
+    (yt_dlp.utils.UnavailableVideoError('format 22 is not available'), False),
+])
+def test_error_classification(error, retryable):
+    assert downloader.is_retryable(error) is retryable
+
+
+def test_partial_files_of_every_download_shape(temp_dir):
+    work_id = '0123456789abcdef'
+    base = os.path.splitext(downloader.video_path(work_id))[0]
+    files = {
+        base + '.mp4.part': 1000,             # Progressive format
+        base + '.f137.mp4.part': 2000,        # Video half of a merged format
+        base + '.f140.m4a.part-Frag3': 300,   # Fragment of a DASH download
+        base + '.f137.mp4.ytdl': 10,          # yt-dlp fragment resume state
+    }
+    os.makedirs(downloader.audio_dir(work_id))
+    files[os.path.join(downloader.audio_dir(work_id), 'track.webm.part')] = 400
+    for path, size in files.items():
+        with open(path, 'wb') as partial:
+            partial.write(b'x' * size)
+
+    # Parallel sections preallocate the whole file; only the recorded progress counts
+    sections_part = base + '.mp4.sections.part'
+    with open(sections_part, 'wb') as partial:
+        partial.truncate(10000)
+    with open(base + '.mp4.sections.ytdl', 'w', encoding='utf-8') as record:
+        json.dump({'total': 10000, 'prefix': 500, 'sections': [[500, 5000, 1500], [5000, 10000, 0]]}, record)
+
+    record = base + '.mp4.sections.ytdl'
+    assert set(downloader.partial_files(work_id)) == set(files) | {sections_part, record}
+    assert downloader.partial_bytes(work_id) == sum(files.values()) + 2000 + os.path.getsize(record)
+
+    # Another job's files are not this job's partial data
+    other = os.path.splitext(downloader.video_path('fedcba9876543210'))[0] + '.mp4.part'
+    open(other, 'wb').close()
+    downloader.discard_partial(work_id)
+    assert os.listdir(temp_dir) == [os.path.basename(other)]
+
+
+class InterruptedOnceYDL:
+    """Stand-in for yt-dlp: the first attempt leaves a .part file and fails, the next one resumes it"""
+    outtmpls = []
+
+    def __init__(self, params=None, auto_init=True):
+        self.params = params
+        self.needs_postprocessing = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def extract_info(self, url, download=True):
+        path = self.params['outtmpl']
+        self.outtmpls.append(path)
+        if not os.path.exists(path + '.part'):
+            with open(path + '.part', 'wb') as partial:
+                partial.write(b'a' * 1000)
+            raise yt_dlp.utils.DownloadError('ERROR: unable to download video data: HTTP Error 503')
+        assert self.params['continuedl']
+        with open(path + '.part', 'ab') as partial:
+            partial.write(b'b' * 500)
+        os.replace(path + '.part', path)
+        return {'title': 'Resumed', 'height': 720}
+
+    def run_deferred(self):
+        return None
+
+
+def test_retry_resumes_the_partial_file(app, temp_dir, monkeypatch):
+    monkeypatch.setattr(downloader, 'DeferringYoutubeDL', InterruptedOnceYDL)
+    InterruptedOnceYDL.outtmpls = []
+    with app.app_context():
+        job = job_runner.enqueue('video', 'https://www.youtube.com/watch?v=retry000001', '22',
+                                 source='youtube', video_id='retry000001')
+        job_id = job.id
+
+        assert job_runner.claim() == job_id
+        job_runner.run(job_id)
+        job = db.session.get(DownloadJob, job_id)
+        assert (job.status, job.attempts) == ('queued', 1)
+        assert job.next_attempt_at > datetime.utcnow()
+
+        # Skip the backoff
+        job.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        assert job_runner.claim() == job_id
+        job_runner.run(job_id)
+        job = db.session.get(DownloadJob, job_id)
+        assert (job.status, job.attempts, job.bytes_recovered) == ('done', 2, 1000)
+        assert job.file_size == 1500
+        db.session.rollback()
+
+    assert len(set(InterruptedOnceYDL.outtmpls)) == 1
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import scheduler
+from scheduler import schedule_dispatcher
+from models import db, ScheduledDownload
+
+
+class FakeYoutubeDL:
+    """Resolves every selector to 137+140, or raises what the test sets"""
+    error = None
+
+    def __init__(self, params=None):
+        self.params = params
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def extract_info(self, url, download=True):
+        if self.error:
+            raise self.error
+        return {'id': 'abcdefghijk', 'title': 'Prefetched title', 'format_id': '137+140', 'height': 1080}
+
+
+@pytest.fixture
+def fake_ydl(monkeypatch):
+    FakeYoutubeDL.error = None
+    monkeypatch.setattr(scheduler.yt_dlp, 'YoutubeDL', FakeYoutubeDL)
+    # Full jitter, so a jittered row is told apart from one dispatched on time
+    monkeypatch.setattr(scheduler.random, 'uniform', lambda low, high: high)
+    return FakeYoutubeDL
+
+
+@pytest.fixture
+def schedule(app):
+    with app.app_context():
+        row = ScheduledDownload(video_id='abcdefghijk', url='https://www.youtube.com/watch?v=abcdefghijk',
+                                source='youtube', format_type='video',
+                                scheduled_time=(datetime.now() + timedelta(seconds=30)).replace(microsecond=0))
+        db.session.add(row)
+        db.session.commit()
+        yield row
+        db.session.rollback()
+        # Keep it out of the other tests' plans
+        db.session.get(ScheduledDownload, row.id).status = 'cancelled'
+        db.session.commit()
+
+
+def _planned_jitter(schedule):
+    schedule_dispatcher.plan()
+    db.session.refresh(schedule)
+    return (schedule.dispatch_at - schedule.scheduled_time).total_seconds()
+
+
+def test_prefetched_row_resolves_its_format_and_skips_jitter(fake_ydl, schedule):
+    assert schedule_dispatcher.prefetch() == 1
+    db.session.refresh(schedule)
+    assert (schedule.format_id, schedule.title, schedule.error) == ('137+140', 'Prefetched title', None)
+    assert schedule.resolved_at is not None
+    assert _planned_jitter(schedule) < 1
+
+
+def test_unexpected_prefetch_error_is_recorded(fake_ydl, schedule):
+    fake_ydl.error = RuntimeError('socket closed')
+    assert schedule_dispatcher.prefetch() == 1
+    db.session.refresh(schedule)
+    assert schedule.error == 'Prefetch failed: RuntimeError: socket closed'
+    assert schedule.resolved_at is None and schedule.status == 'pending'
+
+    # Not extracted again, and dispatched with jitter like any row without metadata
+    fake_ydl.error = None
+    assert schedule_dispatcher.prefetch() == 0
+    assert _planned_jitter(schedule) >= schedule_dispatcher.jitter - 1
+
+
+def test_stale_claim_is_taken_over(fake_ydl, schedule):
+    # Claimed by a node that died mid-extraction
+    schedule.prefetched_at = datetime.now() - scheduler.STALE_PREFETCH - timedelta(seconds=1)
+    db.session.commit()
+    assert _planned_jitter(schedule) >= schedule_dispatcher.jitter - 1
+
+    schedule.dispatch_at = schedule.dispatch_slot = None
+    db.session.commit()
+    assert schedule_dispatcher.prefetch() == 1
+    db.session.refresh(schedule)
+    assert schedule.resolved_at is not None
+    assert _planned_jitter(schedule) < 1
+
+
+def test_live_claim_is_left_alone(fake_ydl, schedule):
+    schedule.prefetched_at = datetime.now() - timedelta(seconds=10)
+    db.session.commit()
+    assert schedule_dispatcher.prefetch() == 0
+    db.session.refresh(schedule)
+    assert schedule.resolved_at is None and schedule.format_id is None
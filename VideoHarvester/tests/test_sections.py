@@ -0,0 +1,103 @@
+import os
+import json
+
+import pytest
+import yt_dlp
+
+import metrics
+from benchmarks.throttled_server import ThrottledMediaServer
+from sections import READ_SIZE, SectionedDownload, SectionError, SectionPolicy, recorded_bytes
+
+SIZE = 4 * 1024 * 1024
+
+POLICY = SectionPolicy({'PARALLEL_MAX_SECTIONS': 4, 'PARALLEL_MIN_DURATION': 10,
+                        'PARALLEL_MIN_SECTION_DURATION': 10, 'PARALLEL_SECTION_SECONDS': 0.001,
+                        'PARALLEL_MIN_SECTION_BYTES': 256 * 1024, 'PARALLEL_PROBE_BYTES': 256 * 1024})
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'source.mp4'
+    path.write_bytes(os.urandom(SIZE))
+    return path
+
+
+@pytest.fixture
+def server(source):
+    server = ThrottledMediaServer(str(source)).start()
+    yield server
+    server.stop()
+
+
+def counter(name):
+    return metrics.snapshot()['counters'].get(name, 0)
+
+
+def download(server, path):
+    with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+        return SectionedDownload(ydl, {'url': server.url, 'protocol': 'http', 'duration': 7200},
+                                 str(path), POLICY).run()
+
+
+def interrupt(server, path):
+    """Every range past the probe is cut short, a little past one read, until a section runs out of attempts"""
+    server.cut_after = READ_SIZE + 64 * 1024
+    with pytest.raises(SectionError):
+        download(server, path)
+    server.cut_after = None
+
+
+def test_interrupted_download_resumes_from_its_record(server, source, tmp_path):
+    path = tmp_path / 'video.mp4'
+    interrupt(server, path)
+
+    record = json.loads((tmp_path / 'video.mp4.sections.ytdl').read_text())
+    written = recorded_bytes(str(tmp_path / 'video.mp4.sections.part'))
+    assert record['total'] == SIZE and len(record['sections']) == 4
+    assert all(0 < done < end - start for start, end, done in record['sections'])
+    assert 0 < written < SIZE
+    assert not path.exists()
+
+    resumed, requested = counter('downloads.sections_resumed'), len(server.ranges_requested)
+    assert download(server, path) is True
+    assert counter('downloads.sections_resumed') == resumed + 1
+    # The 1-byte resume check, then only the bytes not already on disk
+    ranges = server.ranges_requested[requested:]
+    assert ranges[0] == (0, 0)
+    assert sum(end - start + 1 for start, end in ranges[1:]) == SIZE - written
+    assert sorted(start for start, _ in ranges[1:]) == [start + done for start, _, done in record['sections']]
+    assert path.read_bytes() == source.read_bytes()
+    assert sorted(os.listdir(tmp_path)) == ['source.mp4', 'video.mp4']
+
+
+def test_resume_discards_sections_when_the_file_changed(server, tmp_path):
+    path = tmp_path / 'video.mp4'
+    interrupt(server, path)
+
+    replacement = tmp_path / 'replacement.mp4'
+    replacement.write_bytes(os.urandom(SIZE + 1))
+    server.media_path = str(replacement)
+    mismatches, resumed = counter('downloads.section_resume_mismatches'), counter('downloads.sections_resumed')
+    assert download(server, path) is True
+    assert counter('downloads.section_resume_mismatches') == mismatches + 1
+    assert counter('downloads.sections_resumed') == resumed
+    assert path.read_bytes() == replacement.read_bytes()
+
+
+def test_resume_discards_a_part_file_of_the_wrong_size(server, source, tmp_path):
+    path = tmp_path / 'video.mp4'
+    interrupt(server, path)
+
+    with open(tmp_path / 'video.mp4.sections.part', 'r+b') as part:
+        part.truncate(SIZE // 2)
+    mismatches = counter('downloads.section_resume_mismatches')
+    assert download(server, path) is True
+    assert counter('downloads.section_resume_mismatches') == mismatches + 1
+    assert path.read_bytes() == source.read_bytes()
+
+
+def test_server_without_ranges_falls_back(server, tmp_path):
+    server.ranges = False
+    path = tmp_path / 'video.mp4'
+    assert download(server, path) is False
+    assert os.listdir(tmp_path) == ['source.mp4']
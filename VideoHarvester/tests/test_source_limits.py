@@ -0,0 +1,108 @@
+import time
+import uuid
+
+import pytest
+import yt_dlp
+
+import metrics
+from downloader import DownloadFailed
+from source_limits import SourceLimiter, SourceUnavailable
+
+
+@pytest.fixture
+def limiter(app):
+    limiter = SourceLimiter(app)
+    limiter.threshold = 3
+    limiter.cooldown = 1.0
+    limiter.probes = 1
+    limiter.default_limit = 2
+    with app.app_context():
+        yield limiter
+
+
+@pytest.fixture
+def source():
+    # A source of its own per test, since breaker rows are shared through the database
+    return f"test-{uuid.uuid4().hex[:8]}"
+
+
+def _fail(limiter, source, error=None):
+    with pytest.raises(type(error) if error else DownloadFailed):
+        with limiter.guard(source):
+            raise error or DownloadFailed('HTTP Error 429', retryable=True)
+
+
+def _state(limiter, source):
+    return limiter.status()[source]['state']
+
+
+def _transitions(source):
+    counters = metrics.snapshot()['counters']
+    return {(from_state, to_state): counters.get(
+        f"sources.breaker_transitions{{from_state={from_state},source={source},to_state={to_state}}}", 0)
+        for from_state, to_state in (('closed', 'open'), ('open', 'half_open'), ('half_open', 'closed'),
+                                     ('half_open', 'open'))}
+
+
+def test_breaker_opens_half_opens_and_closes(limiter, source):
+    for _ in range(limiter.threshold - 1):
+        _fail(limiter, source)
+    assert _state(limiter, source) == 'closed'
+    _fail(limiter, source)
+    assert _state(limiter, source) == 'open'
+
+    with pytest.raises(SourceUnavailable) as rejected:
+        limiter.acquire(source)
+    assert rejected.value.reason == 'open'
+    assert rejected.value.retry_after >= 1
+    assert source in limiter.blocked_sources()
+    assert limiter.retry_after(source) >= 0
+
+    time.sleep(limiter.cooldown + 0.1)
+    probe = limiter.acquire(source)
+    assert _state(limiter, source) == 'half_open'
+    # Only SOURCE_BREAKER_PROBES requests get through while half-open
+    with pytest.raises(SourceUnavailable) as rejected:
+        limiter.acquire(source)
+    assert rejected.value.reason == 'probing'
+
+    limiter.release(source, probe, 'success')
+    status = limiter.status()[source]
+    assert (status['state'], status['failures'], status['in_flight']) == ('closed', 0, 0)
+    limiter.release(source, limiter.acquire(source), 'success')
+    assert _transitions(source) == {('closed', 'open'): 1, ('open', 'half_open'): 1, ('half_open', 'closed'): 1,
+                                    ('half_open', 'open'): 0}
+    assert metrics.snapshot()['gauges'][f"sources.breaker_state{{source={source}}}"] == 0
+
+
+def test_failed_probe_reopens_the_breaker(limiter, source):
+    for _ in range(limiter.threshold):
+        _fail(limiter, source)
+    time.sleep(limiter.cooldown + 0.1)
+    _fail(limiter, source)
+    assert _state(limiter, source) == 'open'
+    assert _transitions(source)[('half_open', 'open')] == 1
+    with pytest.raises(SourceUnavailable):
+        limiter.acquire(source)
+
+
+def test_permanent_errors_do_not_trip_the_breaker(limiter, source):
+    for _ in range(limiter.threshold + 1):
+        _fail(limiter, source, yt_dlp.utils.DownloadError('ERROR: [youtube] abc: Private video'))
+    status = limiter.status()[source]
+    assert (status['state'], status['failures']) == ('closed', 0)
+
+
+def test_concurrency_limit(limiter, source):
+    leases = [limiter.acquire(source) for _ in range(limiter.default_limit)]
+    with pytest.raises(SourceUnavailable) as rejected:
+        limiter.acquire(source)
+    assert rejected.value.reason == 'busy'
+    assert rejected.value.retry_after == limiter.busy_retry_after
+    assert source in limiter.blocked_sources()
+
+    limiter.release(source, leases.pop())
+    leases.append(limiter.acquire(source))
+    for lease_id in leases:
+        limiter.release(source, lease_id)
+    assert limiter.status()[source]['in_flight'] == 0
@@ -0,0 +1,134 @@
+import io
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+import metrics
+import thumbnails
+
+
+def _image(image_format, size=(800, 450)):
+    output = io.BytesIO()
+    Image.new('RGB', size, (200, 40, 40)).save(output, image_format)
+    return output.getvalue()
+
+
+@pytest.fixture
+def origin():
+    """Local stand-in for an image host: serves /<name> from a dict and counts the requests"""
+    images = {}
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            body, mimetype = images.get(self.path.lstrip('/'), (None, None))
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', mimetype)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.images = images
+    server.requests_seen = requests_seen
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache_dir(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'THUMB_CACHE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def _register(app, origin, name, video_id):
+    with app.app_context():
+        return thumbnails.register('youtube', video_id, f"{origin.url}/{name}")
+
+
+def _counter(name):
+    return metrics.snapshot()['counters'].get(name, 0)
+
+
+def test_resized_variant_is_cached(app, client, origin, cache_dir):
+    origin.images['cover.jpg'] = (_image('JPEG'), 'image/jpeg')
+    media_key = _register(app, origin, 'cover.jpg', 'aaaaaaaaaaa')
+    hits, misses = _counter('thumbnails.hits'), _counter('thumbnails.misses')
+
+    first = client.get(f"/thumb/{media_key}?w=200", headers={'Accept': 'image/jpeg'})
+    assert first.status_code == 200
+    assert (_counter('thumbnails.hits'), _counter('thumbnails.misses')) == (hits, misses + 1)
+
+    second = client.get(f"/thumb/{media_key}?w=200", headers={'Accept': 'image/jpeg'})
+    assert second.status_code == 200
+    assert (_counter('thumbnails.hits'), _counter('thumbnails.misses')) == (hits + 1, misses + 1)
+    assert second.data == first.data
+    assert origin.requests_seen == ['/cover.jpg']
+
+    assert second.mimetype == 'image/jpeg'
+    assert second.cache_control.max_age == thumbnails.MAX_AGE
+    with Image.open(io.BytesIO(second.data)) as image:
+        assert image.format == 'JPEG'
+        assert image.size == (200, 112)
+
+
+def test_webp_variant_for_clients_that_accept_it(app, client, origin, cache_dir):
+    origin.images['cover.jpg'] = (_image('JPEG'), 'image/jpeg')
+    media_key = _register(app, origin, 'cover.jpg', 'bbbbbbbbbbb')
+
+    response = client.get(f"/thumb/{media_key}?w=150", headers={'Accept': 'image/webp,image/*'})
+    assert response.mimetype == 'image/webp'
+    assert 'Accept' in response.vary
+    with Image.open(io.BytesIO(response.data)) as image:
+        assert image.format == 'WEBP'
+        assert image.width == 200  # Rounded up to a cached width
+
+
+def test_eviction_removes_whole_media_items(app, client, origin, cache_dir, monkeypatch):
+    origin.images['old.jpg'] = (_image('JPEG'), 'image/jpeg')
+    origin.images['new.jpg'] = (_image('JPEG'), 'image/jpeg')
+    old_key = _register(app, origin, 'old.jpg', 'ccccccccccc')
+    assert client.get(f"/thumb/{old_key}?w=100", headers={'Accept': 'image/jpeg'}).status_code == 200
+    old_files = sorted(name for name in os.listdir(cache_dir) if name.startswith(old_key))
+    assert old_files == sorted(f"{old_key}{suffix}" for suffix in ('.src', '.lock', '.orig', '-100.jpeg'))
+
+    # Room for one media item only: the least recently used one goes, .src and .lock included
+    monkeypatch.setitem(app.config, 'THUMB_CACHE_MAX_BYTES', sum(
+        os.path.getsize(os.path.join(cache_dir, name)) for name in old_files) + 1024)
+    for name in old_files:
+        os.utime(os.path.join(cache_dir, name), (1, 1))
+    new_key = _register(app, origin, 'new.jpg', 'ddddddddddd')
+    assert client.get(f"/thumb/{new_key}?w=100", headers={'Accept': 'image/jpeg'}).status_code == 200
+
+    remaining = os.listdir(cache_dir)
+    assert not [name for name in remaining if name.startswith(old_key)]
+    assert f"{new_key}.orig" in remaining and f"{new_key}.src" in remaining
+
+
+def test_original_served_with_its_real_type_without_pillow(app, client, origin, cache_dir, monkeypatch):
+    monkeypatch.setattr(thumbnails, 'Image', None)
+    origin.images['cover'] = (_image('PNG'), 'image/png')
+    media_key = _register(app, origin, 'cover', 'eeeeeeeeeee')
+
+    response = client.get(f"/thumb/{media_key}?w=200")
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert response.data == origin.images['cover'][0]
+
+
+def test_unknown_media_key(client, cache_dir):
+    assert client.get('/thumb/0123456789abcdef0123').status_code == 404
+    assert client.get('/thumb/not-a-key').status_code == 404
@@ -0,0 +1,190 @@
+import os
+import io
+import re
+import fcntl
+import hashlib
+import logging
+import tempfile
+import threading
+from flask import current_app
+import requests
+
+import metrics
+
+try:
+    from PIL import Image
+except ImportError:  # Optional: without Pillow the original image is served as-is
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Requested widths are rounded up to one of these to bound the number of variants
+WIDTHS = (100, 200, 320, 480, 640, 1280)
+DEFAULT_WIDTH = 480
+
+# Thumbnails rarely change; clients and CDNs may keep them for 30 days
+MAX_AGE = 30 * 24 * 3600
+
+# Refuse to proxy anything larger than this from the origin
+MAX_ORIGINAL_BYTES = 10 * 1024 * 1024
+
+MEDIA_KEY_PATTERN = re.compile(r'^[0-9a-f]{20}$')
+
+
+def _cache_dir():
+    path = current_app.config.get('THUMB_CACHE_DIR') or os.path.join(
+        tempfile.gettempdir(), 'videoharvester-thumbs')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _write_atomic(path, data):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as output:
+        output.write(data)
+    os.replace(temp_path, path)
+
+
+def register(source, video_id, thumbnail_url):
+    """Remember where a media item's thumbnail lives and return its media key"""
+    identity = video_id if video_id and video_id != 'unknown' else thumbnail_url
+    media_key = hashlib.sha1(f"{source}:{identity}".encode('utf-8')).hexdigest()[:20]
+    src_path = os.path.join(_cache_dir(), f"{media_key}.src")
+    # Signed origin URLs expire, so always keep the latest one we were given
+    _write_atomic(src_path, thumbnail_url.encode('utf-8'))
+    return media_key
+
+
+def pick_width(requested):
+    """Round a requested width up to the nearest cached size"""
+    if not requested:
+        return DEFAULT_WIDTH
+    return next((width for width in WIDTHS if width >= requested), WIDTHS[-1])
+
+
+def _fetch_original(directory, media_key):
+    """Download the origin image once; concurrent workers wait on a file lock"""
+    orig_path = os.path.join(directory, f"{media_key}.orig")
+    if os.path.exists(orig_path):
+        return orig_path
+
+    with open(os.path.join(directory, f"{media_key}.lock"), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(orig_path):
+            return orig_path
+
+        try:
+            with open(os.path.join(directory, f"{media_key}.src"), encoding='utf-8') as src:
+                url = src.read().strip()
+        except OSError:
+            return None
+
+        response = requests.get(url, timeout=10, stream=True)
+        response.raise_for_status()
+        data = response.raw.read(MAX_ORIGINAL_BYTES + 1, decode_content=True)
+        if len(data) > MAX_ORIGINAL_BYTES:
+            raise ValueError(f"Thumbnail larger than {MAX_ORIGINAL_BYTES} bytes")
+        _write_atomic(orig_path, data)
+        metrics.inc('thumbnails.origin_fetches')
+        return orig_path
+
+
+def _resize(orig_path, width, image_format):
+    with Image.open(orig_path) as image:
+        image = image.convert('RGB')
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        output = io.BytesIO()
+        if image_format == 'webp':
+            image.save(output, 'WEBP', quality=80, method=4)
+        else:
+            image.save(output, 'JPEG', quality=82, optimize=True, progressive=True)
+        return output.getvalue()
+
+
+def _evict(directory, keep):
+    """Trim the cache to THUMB_CACHE_MAX_BYTES, least recently used media first.
+
+    A media item's files (origin URL, lock, original and variants) go
+    together, so the .src and .lock files of evicted items do not pile up;
+    a later /video_info registers the item again.
+    """
+    max_bytes = current_app.config.get('THUMB_CACHE_MAX_BYTES', 200 * 1024 * 1024)
+    groups = {}
+    total = 0
+    for name in os.listdir(directory):
+        if name.endswith('.tmp'):
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        group = groups.setdefault(name[:20], [0, 0, []])
+        group[0] = max(group[0], stat.st_mtime)
+        group[1] += stat.st_size
+        group[2].append(name)
+        total += stat.st_size
+
+    for media_key, (_, size, names) in sorted(groups.items(), key=lambda item: item[1][0]):
+        if total <= max_bytes:
+            break
+        if media_key == keep:
+            continue
+        for name in names:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+        total -= size
+        metrics.inc('thumbnails.evictions')
+
+
+def _sniff_mimetype(path):
+    """Image type of an original from its magic bytes, for serving it unconverted"""
+    with open(path, 'rb') as image:
+        head = image.read(16)
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:12] in (b'ftypavif', b'ftypavis'):
+        return 'image/avif'
+    return 'application/octet-stream'
+
+
+def get_variant(media_key, width, accept_webp):
+    """Return (path, mimetype) of a resized thumbnail, creating it on first use"""
+    if not MEDIA_KEY_PATTERN.match(media_key):
+        return None
+    directory = _cache_dir()
+
+    if Image is None:
+        fetched = not os.path.exists(os.path.join(directory, f"{media_key}.orig"))
+        orig_path = _fetch_original(directory, media_key)
+        if not orig_path:
+            return None
+        if fetched:
+            _evict(directory, keep=media_key)
+        return orig_path, _sniff_mimetype(orig_path)
+
+    image_format = 'webp' if accept_webp else 'jpeg'
+    name = f"{media_key}-{width}.{image_format}"
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+        # Touch for LRU ordering
+        os.utime(path)
+        metrics.inc('thumbnails.hits')
+        return path, f"image/{image_format}"
+
+    metrics.inc('thumbnails.misses')
+    orig_path = _fetch_original(directory, media_key)
+    if not orig_path:
+        return None
+    _write_atomic(path, _resize(orig_path, width, image_format))
+    _evict(directory, keep=media_key)
+    return path, f"image/{image_format}"
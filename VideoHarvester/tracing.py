@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import queue
+import secrets
+import logging
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+import requests
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Phases stored on every history row as <phase>_ms columns
+PHASES = ('validate', 'queue', 'extract', 'transfer', 'postprocess', 'commit')
+
+# Finished spans waiting for the exporter; beyond this, new spans are dropped
+QUEUE_SIZE = 10000
+
+# Spans written or posted per export
+EXPORT_BATCH = 200
+
+# OTLP span status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+def new_trace_id():
+    return secrets.token_hex(16)
+
+
+def current_trace():
+    """Trace of the request or job running in this context, if any"""
+    return _current.get()
+
+
+@contextmanager
+def activate(trace):
+    """Make a started trace current in this thread, e.g. in each stage a job passes through"""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def span(name, **attributes):
+    """Time a block as a span of the current trace; does nothing outside a trace"""
+    trace = _current.get()
+    return trace.span(name, **attributes) if trace else nullcontext()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class Trace:
+    """One unit of work (a request or a job attempt): a root span and its phase spans"""
+
+    def __init__(self, tracer, name, trace_id=None, **attributes):
+        self.tracer = tracer
+        self.trace_id = trace_id or new_trace_id()
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.started = time.time_ns()
+        self.attributes = attributes
+        self.spans = []
+        self.durations = {}
+        self.finished = False
+
+    def add(self, name, start_ns, end_ns, error=None, **attributes):
+        """Record a phase that ran from start_ns to end_ns (Unix epoch nanoseconds)"""
+        end_ns = max(start_ns, end_ns)
+        self.spans.append({'name': name, 'span_id': secrets.token_hex(8), 'parent_id': self.span_id,
+                           'start': start_ns, 'end': end_ns, 'error': error, 'attributes': attributes})
+        self.durations[name] = self.durations.get(name, 0) + end_ns - start_ns
+
+    @contextmanager
+    def span(self, name, **attributes):
+        start = time.time_ns()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = f"{type(e).__name__}: {str(e)}"[:200]
+            raise
+        finally:
+            self.add(name, start, time.time_ns(), error=error, **attributes)
+
+    def millis(self, name):
+        """Total time spent in a phase, in whole milliseconds, or None if it never ran"""
+        duration = self.durations.get(name)
+        return None if duration is None else round(duration / 1e6)
+
+    def phase_millis(self):
+        return {f"{phase}_ms": self.millis(phase) for phase in PHASES}
+
+    def finish(self, error=None, **attributes):
+        """End the root span and hand the trace to the exporter; later calls are ignored"""
+        if self.finished:
+            return
+        self.finished = True
+        self.attributes.update(attributes)
+        root = {'name': self.name, 'span_id': self.span_id, 'parent_id': None, 'start': self.started,
+                'end': time.time_ns(), 'error': error, 'attributes': self.attributes}
+        self.tracer.export(self.trace_id, [root] + self.spans)
+
+
+class Tracer:
+    """Span-based tracing of downloads, exported as OTLP/JSON.
+
+    Spans are handed to a background thread in batches and either
+    appended to TRACE_FILE (one OTLP export request per line, as read by
+    the collector's otlpjsonfile receiver) or POSTed to an OTLP/HTTP
+    collector at TRACE_OTLP_ENDPOINT. Phase durations are also kept as
+    trace.phase_seconds metrics, whether or not an exporter is set.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.export_to = None
+        self._queue = queue.Queue(QUEUE_SIZE)
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.export_to = app.config.get('TRACE_EXPORT') or None
+        self.service_name = app.config.get('TRACE_SERVICE_NAME', 'videoharvester')
+        self.file_path = app.config.get('TRACE_FILE') or os.path.join(
+            tempfile.gettempdir(), 'videoharvester-traces.jsonl')
+        self.endpoint = app.config.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+        if self.export_to not in (None, 'file', 'otlp'):
+            raise ValueError(f"Unknown TRACE_EXPORT '{self.export_to}'; use 'file' or 'otlp'")
+        if self.export_to:
+            self._thread = threading.Thread(target=self._run, name='trace-export', daemon=True)
+            self._thread.start()
+
+    def start(self, name, trace_id=None, **attributes):
+        """Start a trace that the caller finishes, e.g. once a streamed response closes"""
+        return Trace(self, name, trace_id, **attributes)
+
+    @contextmanager
+    def trace(self, name, trace_id=None, **attributes):
+        """Run a block as a trace that is current for span() calls inside it"""
+        trace = self.start(name, trace_id, **attributes)
+        token = _current.set(trace)
+        try:
+            yield trace
+        except Exception as e:
+            trace.finish(error=f"{type(e).__name__}: {str(e)}"[:200])
+            raise
+        finally:
+            _current.reset(token)
+            trace.finish()
+
+    def export(self, trace_id, spans):
+        for item in spans[1:]:
+            metrics.observe('trace.phase_seconds', (item['end'] - item['start']) / 1e9, phase=item['name'])
+        if not self.export_to:
+            return
+        for item in spans:
+            try:
+                self._queue.put_nowait((trace_id, item))
+            except queue.Full:
+                metrics.inc('trace.dropped_spans')
+
+    def _run(self):
+        """Export loop: send spans in batches as they finish"""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < EXPORT_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+                metrics.inc('trace.exported_spans', len(batch))
+            except Exception as e:
+                metrics.inc('trace.export_errors')
+                logger.error("Error exporting %s spans: %s: %s", len(batch), type(e).__name__, e)
+
+    def _write(self, batch):
+        payload = json.dumps(self._to_otlp(batch), separators=(',', ':'))
+        if self.export_to == 'file':
+            with open(self.file_path, 'a', encoding='utf-8') as trace_file:
+                trace_file.write(payload + '\n')
+        else:
+            response = requests.post(self.endpoint, data=payload, timeout=5,
+                                     headers={'Content-Type': 'application/json'})
+            response.raise_for_status()
+
+    def _to_otlp(self, batch):
+        """OTLP/JSON ExportTraceServiceRequest for a batch of (trace id, span) pairs"""
+        spans = []
+        for trace_id, item in batch:
+            otlp_span = {
+                'traceId': trace_id,
+                'spanId': item['span_id'],
+                'name': item['name'],
+                'kind': 1,
+                'startTimeUnixNano': str(item['start']),
+                'endTimeUnixNano': str(item['end']),
+                'attributes': _otlp_attributes(item['attributes']),
+                'status': {'code': STATUS_ERROR, 'message': item['error']} if item['error'] else {'code': STATUS_OK},
+            }
+            if item['parent_id']:
+                otlp_span['parentSpanId'] = item['parent_id']
+            spans.append(otlp_span)
+        return {'resourceSpans': [{
+            'resource': {'attributes': _otlp_attributes({'service.name': self.service_name})},
+            'scopeSpans': [{'scope': {'name': 'videoharvester'}, 'spans': spans}],
+        }]}
+
+
+tracer = Tracer()
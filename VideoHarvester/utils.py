@@ -7,6 +7,16 @@ import yt_dlp
 # Configure logging
 logger = logging.getLogger(__name__)
 
+def pid_alive(pid):
+    """Check whether a process with the given pid is still running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
 def detect_source(url):
     """Detect the source platform from a URL"""
     try:
@@ -30,7 +40,7 @@ def detect_source(url):
         else:
             return 'unknown'
     except Exception as e:
-        logger.error(f"Error detecting source: {e}")
+        logger.error("Error detecting source: %s", e)
         return 'unknown'
 
 def is_valid_url(url, source=None):
@@ -51,7 +61,7 @@ def is_valid_url(url, source=None):
             
         return False
     except Exception as e:
-        logger.error(f"Error validating URL: {e}")
+        logger.error("Error validating URL: %s", e)
         return False
 
 def extract_video_id(url, source=None):
@@ -98,7 +108,7 @@ def extract_video_id(url, source=None):
         
         return None
     except Exception as e:
-        logger.error(f"Error extracting video ID: {e}")
+        logger.error("Error extracting video ID: %s", e)
         return None
 
 def get_best_audio_format(formats):
@@ -120,4 +130,32 @@ def get_best_audio_format(formats):
 def sanitize_filename(filename):
     """Remove invalid characters from the filename"""
     # Replace any character that's not alphanumeric, space, hyphen, or underscore
-    return re.sub(r'[^\w\s-]', '_', filename)[:100]  # Also truncate to reasonable length
\ No newline at end of file
+    return re.sub(r'[^\w\s-]', '_', filename)[:100]  # Also truncate to reasonable length
+
+def parse_overrides(value):
+    """Parse integer overrides like 'youtube=8,vimeo=2' into a dict"""
+    overrides = {}
+    for item in (value or '').split(','):
+        name, _, number = item.rpartition('=')
+        if name.strip() and number.strip().isdigit():
+            overrides[name.strip()] = int(number)
+    return overrides
+
+
+def parse_timestamp(value):
+    """Parse a time offset given as seconds or as [HH:]MM:SS[.fff] into seconds"""
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid time '{value}'")
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        match = re.fullmatch(r'(?:(?:(\d+):)?(\d+):)?(\d+(?:\.\d+)?)', str(value).strip())
+        if not match:
+            raise ValueError(f"Invalid time '{value}'")
+        hours, minutes, rest = match.groups()
+        if (hours or minutes) and float(rest) >= 60 or hours and int(minutes) >= 60:
+            raise ValueError(f"Invalid time '{value}'")
+        seconds = int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(rest)
+    if not 0 <= seconds < float('inf'):
+        raise ValueError(f"Invalid time '{value}'")
+    return seconds